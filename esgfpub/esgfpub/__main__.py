@@ -23,14 +23,17 @@ def main():
         return stage(ARGS)
     elif subcommand == 'publish':
         
-        from esgfpub.publisher import publish
+        from esgfpub.publisher import publish, parse_project_workers
         return publish(
             mapsin=ARGS.maps_in,
             mapsout=ARGS.maps_done,
             mapserr=ARGS.maps_err,
             loop=ARGS.loop,
-            sproket=ARGS.sproket,
+            search_api=ARGS.search_api,
             logpath=ARGS.logs,
+            no_custom=ARGS.no_custom,
+            workers=ARGS.workers,
+            project_workers=parse_project_workers(ARGS.project_workers),
             debug=ARGS.debug)
     elif subcommand == 'custom':
         
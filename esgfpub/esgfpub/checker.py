@@ -8,238 +8,81 @@ logger.setLevel(logging.ERROR)
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from esgfpub.util import print_message
+from esgfpub import completeness, filenames
+from esgfpub.crawler import TreeCrawler, SKIP, DESCEND, COLLECT
 from esgfpub.verify import verify_dataset
 from tempfile import NamedTemporaryFile
 from subprocess import Popen, PIPE
 from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
-import re
 import json
 import yaml
 import os
 
-SEASONS = [{
-    'name': 'ANN',
-    'start': '01',
-    'end': '12'
-}, {
-    'name': 'DJF',
-    'start': '01',
-    'end': '12'
-}, {
-    'name': 'MAM',
-    'start': '03',
-    'end': '05'
-}, {
-    'name': 'JJA',
-    'start': '06',
-    'end': '08'
-}, {
-    'name': 'SON',
-    'start': '09',
-    'end': '11'
-}]
-
-
-def get_cmip_start_end(filename):
-    if 'clim' in filename:
-        return int(filename[-21:-17]), int(filename[-14: -10])
-    else:
-        return int(filename[-16:-12]), int(filename[-9: -5])
-
-
-def get_e3sm_start_end(filename):
-    if 'climo' in filename:
-        return int(filename[-22:-18]), int(filename[-15: -11])
-    else:
-        return int(filename[-16:-12]), int(filename[-9: -5])
-
-
 def check_spans(files, start, end, dataset_id):
 
     missing = []
-    files_found = []
+    files_found = set()
 
+    files = sorted(files)
+    spans = filenames.parse_listing(files, filenames.CMIP6)
+    if not spans:
+        raise ValueError(f'Unexpected file format: {files[0]}')
     if not start or not end:
-        start, end = infer_start_end_cmip(files)
-    if not start and not end:
-        start, end = infer_start_end_e3sm(files)
-    
-    file_start, file_end = get_cmip_start_end(files[0])
+        start, end = min(spans.start), max(spans.end)
+
+    file_start, file_end = spans.start[0], spans.end[0]
     if file_start != start:
         missing.append(f"{dataset_id}-{start:04d}-{file_end:04d}")
 
     prev_end = start
-    for file in sorted(files):
-        file_start, file_end = get_cmip_start_end(file)
+    for name, file_start, file_end in zip(spans.name, spans.start, spans.end):
         if file_start == start:
             prev_end = file_end
-            files_found.append(file)
+            files_found.add(name)
             continue
         if file_start == prev_end + 1:
             prev_end = file_end
-            files_found.append(file)
+            files_found.add(name)
         else:
             missing.append(f"{dataset_id}-{prev_end:04d}-{file_start:04d}")
 
-    file_start, file_end = get_cmip_start_end(files[-1])
+    file_start, file_end = spans.start[-1], spans.end[-1]
     if file_end != end:
         missing.append(f"{dataset_id}-{file_start:04d}-{end:04d}")
 
-    extra_files = [x for x in files if x not in files_found]
+    extra_files = [x for x, name in zip(files, filenames.base_names(files)) if name not in files_found]
     return missing, extra_files
 
 
-def infer_start_end_cmip(files):
-    """
-    From a list of files with the given naming convention
-    return the start year of the first file and the end year of the
-    last file
-
-    A typical CMIP6 file will have a name like:
-    pbo_Omon_E3SM-1-1-ECA_hist-bgc_r1i1p1f1_gr_185001-185412.nc' 
-    """
-    files = sorted(files)
-    first, last = files[0], files[-1]
-    p = r'\d{6}-\d{6}'
-    idx = re.search(pattern=p, string=first)
-    if not idx:
-        return None, None
-    start = int(first[idx.start(): idx.start() + 4])
-
-    idx = re.search(pattern=p, string=last)
-    end = int(last[idx.start() + 7: idx.start() + 11])
-
-    return start, end
-
-
-def infer_start_end_e3sm(files):
-    """
-    From a list of files with the given naming convention
-    return the start year of the first file and the end year of the
-    last file
-    """
-    f = sorted(files)
-    p = r'\.\d{4}-\d{2}'
-    idx = re.search(pattern=p, string=f[0])
-    if not idx:
-        return None, None
-    start = int(f[0][idx.start() + 1: idx.start() + 5])
-
-    idx = re.search(pattern=p, string=f[-1])
-    end = int(f[-1][idx.start() + 1: idx.start() + 5])
-
-    return start, end
-
-
-def infer_start_end_climo(files):
-    f = sorted(files)
-    p = r'_\d{6}_\d{6}_'
-    idx = re.search(pattern=p, string=f[0])
-    start = int(f[0][idx.start() + 1: idx.start() + 5])
-
-    idx = re.search(pattern=p, string=f[-1])
-    end = int(f[-1][idx.start() + 8: idx.start() + 12])
-
-    return start, end
-
-
 def check_monthly(files, start=None, end=None):
 
-    missing = []
-    files_found = []
-
-    pattern = r'\d{4}-\d{2}.*nc'
-    idx = re.search(pattern=pattern, string=files[0])
-    if not idx:
-        print_message(f'Unexpected file format: {files[0]}', 'error')
-        return [], []
-    prefix = files[0][:idx.start()]
-    suffix = files[0][idx.start() + 7:]
-
     if not start or not end:
-        start, end = infer_start_end_e3sm(files)
-
-    for year in range(start, end + 1):
-        for month in range(1, 13):
-            name = f'{prefix}{year:04d}-{month:02d}{suffix}'
-            if name not in files:
-                missing.append(name)
-            else:
-                files_found.append(name)
-
-    extra_files = [x for x in files if x not in files_found]
-    return missing, extra_files
+        start, end = filenames.infer_start_end(files, filenames.E3SM_MODEL_OUTPUT)
+    try:
+        return completeness.check_monthly(files, start, end)
+    except ValueError as e:
+        print_message(str(e), 'error')
+        return [], []
 
 
 def check_climos(files, start, end):
-    missing = []
-    files_found = []
-
-    pattern = r'_\d{6}_\d{6}_climo.nc'
     files = sorted(files)
-    idx = re.search(pattern=pattern, string=files[0])
-    if not idx:
-        raise ValueError(f'Unexpected file format: {files[0]}')
-    prefix = files[0][:idx.start() - 2]
-
-    if not start or not end:
-        start, end = infer_start_end_climo(files)
-
-    start, end = get_e3sm_start_end(files[0])
-
-    for month in range(1, 13):
-        name = f'{prefix}{month:02d}_{start:04d}{month:02d}_{end:04d}{month:02d}_climo.nc'
-        if name not in files:
-            missing.append(name)
-        else:
-            files_found.append(name)
-
-    for season in SEASONS:
-        name = f'{prefix}{season["name"]}_{start:04d}{season["start"]}_{end:04d}{season["end"]}_climo.nc'
-        if name not in files:
-            missing.append(name)
-        else:
-            files_found.append(name)
-    extra_files = [x for x in files if x not in files_found]
-    return missing, extra_files
+    start, end = filenames.get_start_end(files[0], filenames.E3SM_CLIMO)
+    return completeness.check_climos(files, start, end)
 
 
 def check_submonthly(files, start, end, debug=False):
 
-    missing, extra = list(), list()
-    pattern = re.compile(r'\d{4}-\d{2}.*nc')
-    first = files[0]
-    idx = pattern.search(first)
-    # idx = re.search(pattern=pattern, string=first)
-    if not idx:
-        raise ValueError(f'Unexpected file format: {first}')
     if not start or not end:
-        start, end = infer_start_end_e3sm(files)
-
-    prefix = first[:idx.start()]
-    # TODO: Come up with a way of doing this check more 
-    # robustly. Its hard because the high-freq files arent consistant
-    # from case to case, using different 'h' codes and different frequencies
-    # for the time being, if there's at least one file per year it'll get marked as correct
-    for year in range(start, end):
-        found = None
-        for idx, file in enumerate(files):
-            pattern = re.compile(fr'{year:04d}-\d{2}.*nc')
-            if pattern.search(file):
-                found = idx
-                break
-        if found:
-            files.pop(idx)
-        else:
-            name = f'{prefix}{year:04d}'
-            missing.append(name)
+        start, end = filenames.infer_start_end(files, filenames.E3SM_MODEL_OUTPUT)
+    missing = completeness.check_submonthly(files, start, end)
 
     if not missing and debug:
         msg = f'Found {len(files)} files for submonthly dataset'
         print_message(msg, 'info')
-    return missing, extra
+    return missing, []
 
 
 def check_fixed(files, dataset_id, spec):
@@ -250,33 +93,15 @@ def check_fixed(files, dataset_id, spec):
 
 
 def get_ts_start_end(filename):
-    p = re.compile(r'_\d{6}_\d{6}.*nc')
-    idx = p.search(filename)
-    if not idx:
-        raise ValueError(f'Unexpected file format: {filename}')
-    start = int(filename[idx.start() + 1: idx.start() + 5])
-    end = int(filename[idx.start() + 8: idx.start() + 12])
-    return start, end
+    return filenames.get_start_end(filename, filenames.E3SM_TIME_SERIES)
 
 
 def check_time_series(files, dataset_id, spec, start=None, end=None):
 
-    missing = []
-    extra = []
-    files = [x.split('/')[-1] for x in sorted(files)]
-    files_found = []
-    if not start or not end:
-        start, end = get_ts_start_end(files[0])
-
     case_info = dataset_id.split('.')
-    project = case_info[0]
     model_version = case_info[1]
     casename = case_info[2]
     realm = case_info[4]
-    if project == 'CMIP6':
-        ens = case_info[5]
-    else:
-        ens = case_info[6][1:]
 
     case_spec = [x for x in spec['project']['E3SM'][model_version] if x['experiment'] == casename].pop()
 
@@ -286,58 +111,7 @@ def check_time_series(files, dataset_id, spec, start=None, end=None):
     else:
         expected_vars = spec['time-series'][realm]
 
-    for v in expected_vars:
-        
-        v_files = list()
-        for x in files:
-            idx = -36 if 'cmip6_180x360_aave' in x else -17
-            if v in x and x[:idx] == v:
-                v_files.append(x)
-
-        if not v_files:
-            missing.append(f'{dataset_id}-{v}-{start:04d}-{end:04d}')
-            continue
-        else:
-            v_files = sorted(v_files)
-            v_start, v_end = get_ts_start_end(v_files[0])
-            if start != v_start:
-                missing.append(f'{dataset_id}-{v}-{start:04d}-{v_start:04d}')
-
-            prev_end = start
-            for file in v_files:
-                file_start, file_end = get_ts_start_end(file)
-                if file_start == start:
-                    prev_end = file_end
-                    files_found.append(file)
-                    continue
-                if file_start == prev_end + 1:
-                    prev_end = file_end
-                    files_found.append(file)
-                else:
-                    missing.append(f"{dataset_id}-{prev_end:04d}-{file_start:04d}")
-            # f_start, f_end = get_ts_start_end(v_files[0])
-            # freq = f_end - f_start + 1
-            # spans = list(range(start, end, freq))
-
-            # for idx, span_start in enumerate(spans):
-            #     if span_start != spans[-1]:
-            #         span_end = spans[idx + 1] - 1
-            #     else:
-            #         span_end = end
-
-            #     found_span = False
-
-            #     for f in v_files:
-            #         f_start, f_end = get_ts_start_end(f)
-            #         if f_start == span_start and f_end == span_end:
-            #             found_span = True
-            #             files_found.append(f)
-            #             break
-            #     if not found_span:
-            #         missing.append(f'{dataset_id}-{v}-{span_start:04d}-{span_end:04d}')
-    e = [x for x in files if x not in files_found]
-    extra.extend(e)
-    return missing, extra
+    return completeness.check_time_series(files, expected_vars, start, end, dataset_id)
 
 
 def get_version(filename):
@@ -799,11 +573,27 @@ def facet_filter(facet, facets, exclude=None):
     return False
 
 
-def collect_paths(data_path=None, case_spec=None, projects=None, model_versions='all', experiments='all', tables='all', variables='all', ens='all', exclude=None, debug=False, **kwargs):
-
+def collect_paths(data_path=None, case_spec=None, projects=None, model_versions='all', experiments='all', tables='all', variables='all', ens='all', exclude=None, debug=False, crawler=None, walk_workers=16, snapshot=None, **kwargs):
+    """
+    Find the latest (or the requested --data-version) version directory of every dataset under data_path
+    that passes the facet filters. The directories are listed a level at a time on a pool of workers,
+    and the filters are applied at each level so excluded facets are never listed
+
+    Parameters:
+        crawler (TreeCrawler): the crawler to list directories with, so listings are shared between checks
+        walk_workers (int): the number of directories to list at once, if no crawler is given
+        snapshot (str): path to the directory snapshot, if no crawler is given
+    Returns:
+        (dataset_paths, dataset_ids, extra) the dataset directories, their ids, and the messages for
+        E3SM directories that arent in the case spec
+    """
     dataset_paths, dataset_ids, extra = list(), list(), list()
+    owns_crawler = crawler is None
+    if owns_crawler:
+        crawler = TreeCrawler(workers=walk_workers, snapshot_path=snapshot)
+    data_version = kwargs.get('data_version', 'latest')
 
-    for project in os.listdir(data_path):
+    for project in crawler.listdir(data_path):
         if facet_filter(project, projects, exclude):
             continue
         if debug:
@@ -815,197 +605,145 @@ def collect_paths(data_path=None, case_spec=None, projects=None, model_versions=
             The CMIP6 paths go like
             /base/CMIP6/cmip_project/model_name/case_id/realization_id/table/variable/gr/dataset_version
             """
-            for cmip_project in os.listdir(project_path):
-                cmip_project_path = os.path.join(
-                    project_path, cmip_project, 'E3SM-Project')
+            cmip_facets = [None, None, model_versions, experiments, ens, tables, variables]
+
+            def accept(parts):
+                depth = len(parts) - 1
+                name = parts[-1]
+                if depth == 1:
+                    return DESCEND if name == 'E3SM-Project' else SKIP
+                if depth == 7:
+                    return COLLECT if name == 'gr' else SKIP
+                if depth >= 2 and facet_filter(name, cmip_facets[depth], exclude):
+                    return SKIP
+                return DESCEND
+
+            grid_dirs = crawler.crawl(project_path, accept)
+            listings = crawler.scan_many([os.path.join(project_path, *x) for x in grid_dirs])
+            for parts in grid_dirs:
+                cmip_project, _, model_version, case, e, table, v, _ = parts
+                grid_path = os.path.join(project_path, *parts)
+
+                # pick just the last version
+                versions = listings[grid_path].dirs
+                if data_version == 'latest':
+                    try:
+                        version = versions[-1]
+                    except IndexError as e:
+                        raise ValueError(f'Unable to find latest version for {v}') from e
+                else:
+                    version = data_version
                 if debug:
-                    print_message(f' checking cmip-project: {cmip_project}', 'info')
-                if not os.path.exists(cmip_project_path):
+                    print_message(f'      checking variable-{version}: {v}', 'info')
+
+                dataset_id = '.'.join(
+                    [project, cmip_project, 'E3SM-Project', model_version, case, e, table, v, 'gr#'+version])
+                if version not in versions:
+                    print(f"Cant find requested version, skipping {dataset_id}")
                     continue
-                for model_version in os.listdir(cmip_project_path):
-                    if facet_filter(model_version, model_versions, exclude):
-                        continue
-                    model_version_path = os.path.join(
-                        cmip_project_path, model_version)
-                    if debug:
-                        print_message(f'  checking model_version: {model_version}', 'info')
-                    for case in os.listdir(model_version_path):
-                        if facet_filter(case, experiments, exclude):
-                            continue
-                        if debug:
-                            print_message(f'   checking experiment: {case}', 'info')
-                        case_path = os.path.join(model_version_path, case)
-
-                        for e in os.listdir(case_path):
-                            if facet_filter(e, ens, exclude):
-                                continue
-                            if debug:
-                                print_message(f'    checking ensemble: {e}', 'info')
-                            ensemble_path = os.path.join(case_path, e)
-
-                            for table in os.listdir(ensemble_path):
-                                if facet_filter(table, tables, exclude):
-                                    continue
-                                table_path = os.path.join(ensemble_path, table)
-                                if debug:
-                                    print_message(f'     checking table: {table}', 'info')
-                                for v in os.listdir(table_path):
-                                    if facet_filter(v, variables, exclude):
-                                        continue
-                                    variable_path = os.path.join(table_path, v)
-
-                                    # pick just the last version
-                                    try:
-                                        versions = os.listdir(
-                                            os.path.join(variable_path, 'gr'))
-                                    except:
-                                        import ipdb; ipdb.set_trace()
-
-                                    data_version = kwargs.get('data_version', 'latest')
-                                    if data_version == 'latest':
-                                        try:
-                                            version = sorted(versions)[-1]
-                                        except IndexError as e:
-                                            raise ValueError(f'Unable to find latest version for {v}') from e
-                                    else:
-                                        version = data_version
-                                    if debug:
-                                        print_message(f'      checking variable-{version}: {v}', 'info')
-
-                                    dataset_id = '.'.join(
-                                        [project, cmip_project, 'E3SM-Project', model_version, case, e, table, v, 'gr#'+version])
-                                    dataset_path = os.path.join(
-                                        variable_path, 'gr', version)
-                                    if not os.path.exists(dataset_path):
-                                        print(f"Cant find requested version, skipping {dataset_id}")
-                                        continue
-                                    dataset_paths.append(dataset_path)
-                                    dataset_ids.append(dataset_id)
+                dataset_paths.append(os.path.join(grid_path, version))
+                dataset_ids.append(dataset_id)
         elif project == 'E3SM':
+            """
+            The E3SM paths go like
+            /base/E3SM/model_version/case/resolution/[tuning/]component/grid/data_type/freq/ensemble/dataset_version
+            where the tuning directory is either highres or lowres, and is left out of the dataset id
+            """
             project_info = case_spec['project'].get(project)
-            for model_version in os.listdir(project_path):
-                if facet_filter(model_version, model_versions, exclude):
-                    continue
-                if model_version not in project_info.keys():
-                    msg = f'Project not found in data spec: {project}:{model_version}'
-                    extra.append(msg)
-                    continue
-                model_info = project_info[model_version]
-                for casename in os.listdir(os.path.join(project_path, model_version)):
-                    if facet_filter(casename, cases, exclude):
-                        continue
-                    case_info = next(
-                        (i for i in model_info if i['experiment'] == casename), None)
-                    if not case_info:
-                        msg = f"Couldnt find case in dataset specifications: {casename}"
-                        extra.append(msg)
-                        continue
 
-                    case_path = os.path.join(
-                        project_path, model_version, casename)
-                    for res in os.listdir(case_path):
-                        tuning = None
-                        if res not in case_info.get('resolution').keys():
-                            msg = f"Resolution {res} is present on filesystem but not in case specification: {casename}"
-                            extra.append(msg)
-                            continue
-                        res_path = os.path.join(case_path, res)
-                        for comp in os.listdir(res_path):
-                            if comp in ['highres', 'lowres']:
-                                tuning = comp
-                                for comp in os.listdir(os.path.join(res_path, tuning)):
-                                    comp_path = os.path.join(
-                                        res_path, tuning, comp)
-                                    comp_name = next(
-                                        (i for i in case_info['resolution'][res].keys() if comp in i), None)
-                                    for grid in os.listdir(comp_path):
-                                        try:
-                                            comp_info = next(
-                                                (i for i in case_info['resolution'][res][comp_name] if i['grid'] == grid), None)
-                                        except:
-                                            import ipdb
-                                            ipdb.set_trace()
-                                        if not comp_info:
-                                            msg = f"Grid {grid} is present on filesystem but not in case specification: {casename}-{res}-{comp}"
-                                            extra.append(msg)
-                                            continue
-                                        for data_type in os.listdir(os.path.join(comp_path, grid)):
-                                            for freq in os.listdir(os.path.join(comp_path, grid, data_type)):
-                                                if facet_filter(freq, tables, exclude):
-                                                    continue
-                                                freq_type = f"{data_type}.{freq}"
-                                                if freq_type not in comp_info['data_types']:
-                                                    msg = f"Frequency {freq} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}"
-                                                    extra.append(msg)
-                                                    continue
-                                                for ensemble in os.listdir(os.path.join(comp_path, grid, data_type, freq)):
-                                                    if facet_filter(ensemble, ens, exclude):
-                                                        continue
-                                                    if ensemble not in case_info['ens']:
-                                                        msg = f"Ensemble {ensemble} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}-{freq}"
-                                                        extra.append(msg)
-                                                        continue
-
-                                                    version = sorted(os.listdir(os.path.join(
-                                                        comp_path, grid, data_type, freq, ensemble)))[-1]
-                                                    dataset_path = os.path.join(
-                                                        comp_path, grid, data_type, freq, ensemble, version)
-                                                    dataset_id = '.'.join(
-                                                        ['E3SM', model_version, casename, res, comp, grid, data_type, freq, ensemble, version])
-                                                    if debug:
-                                                        print_message(f'checking dataset: {dataset_id}', 'info')
-                                                    dataset_paths.append(
-                                                        dataset_path)
-                                                    dataset_ids.append(
-                                                        dataset_id)
-                                                    continue
-                            else:
-                                if facet_filter(comp, tables, exclude):
-                                    continue
-                                if comp not in case_info['resolution'][res].keys():
-                                    msg = f"Component {comp} is present on filesystem but not in case specification: {casename}-{res}"
-                                    extra.append(msg)
-                                    continue
+            def case_info(model_version, casename):
+                return next(
+                    (i for i in project_info[model_version] if i['experiment'] == casename), None)
 
-                                comp_path = os.path.join(res_path, comp)
-                                for grid in os.listdir(comp_path):
-                                    comp_info = next(
-                                        (i for i in case_info['resolution'][res][comp] if i['grid'] == grid), None)
-                                    if not comp_info:
-                                        msg = f"Grid {grid} is present on filesystem but not in case specification: {casename}-{res}-{comp}"
-                                        extra.append(msg)
-                                        continue
-                                    for data_type in os.listdir(os.path.join(comp_path, grid)):
-                                        for freq in os.listdir(os.path.join(comp_path, grid, data_type)):
-                                            if facet_filter(freq, tables, exclude):
-                                                continue
-                                            freq_type = f"{data_type}.{freq}"
-                                            if freq_type not in comp_info['data_types']:
-                                                import ipdb
-                                                ipdb.set_trace()
-                                                msg = f"Frequency freq is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}"
-                                                extra.append(msg)
-                                                continue
-                                            for ensemble in os.listdir(os.path.join(comp_path, grid, data_type, freq)):
-                                                if facet_filter(ensemble, ens, exclude):
-                                                    continue
-                                                if ensemble not in case_info['ens']:
-                                                    msg = f"Ensemble {ensemble} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}-{freq}"
-                                                    extra.append(msg)
-                                                    continue
-
-                                                version = sorted(os.listdir(os.path.join(
-                                                    comp_path, grid, data_type, freq, ensemble)))[-1]
-
-                                                dataset_path = os.path.join(
-                                                    comp_path, grid, data_type, freq, ensemble, version)
-                                                dataset_id = '.'.join(
-                                                    ['E3SM', model_version, casename, res, comp, grid, data_type, freq, ensemble, version])
-                                                dataset_paths.append(
-                                                    dataset_path)
-                                                dataset_ids.append(dataset_id)
-                                                if debug:
-                                                    print_message(f'checking dataset: {dataset_id}', 'info')
+            def accept(parts):
+                if len(parts) == 1:
+                    model_version = parts[0]
+                    if facet_filter(model_version, model_versions, exclude):
+                        return SKIP
+                    if model_version not in project_info.keys():
+                        extra.append(f'Project not found in data spec: {project}:{model_version}')
+                        return SKIP
+                    return DESCEND
+                model_version, casename = parts[:2]
+                info = case_info(model_version, casename)
+                if len(parts) == 2:
+                    if facet_filter(casename, experiments, exclude):
+                        return SKIP
+                    if not info:
+                        extra.append(f"Couldnt find case in dataset specifications: {casename}")
+                        return SKIP
+                    return DESCEND
+                res = parts[2]
+                if len(parts) == 3:
+                    if res not in info.get('resolution').keys():
+                        extra.append(f"Resolution {res} is present on filesystem but not in case specification: {casename}")
+                        return SKIP
+                    return DESCEND
+
+                tuning = parts[3] in ['highres', 'lowres']
+                if tuning:
+                    if len(parts) == 4:
+                        return DESCEND
+                    comp = parts[4]
+                    comp_name = next((i for i in info['resolution'][res].keys() if comp in i), None)
+                    rest = parts[5:]
+                else:
+                    comp = comp_name = parts[3]
+                    rest = parts[4:]
+                    if not rest:
+                        if facet_filter(comp, tables, exclude):
+                            return SKIP
+                        if comp not in info['resolution'][res].keys():
+                            extra.append(f"Component {comp} is present on filesystem but not in case specification: {casename}-{res}")
+                            return SKIP
+                        return DESCEND
+                if not rest:
+                    return DESCEND
+
+                grid = rest[0]
+                comp_info = next(
+                    (i for i in info['resolution'][res].get(comp_name) or [] if i['grid'] == grid), None)
+                if not comp_info:
+                    if len(rest) == 1:
+                        extra.append(f"Grid {grid} is present on filesystem but not in case specification: {casename}-{res}-{comp}")
+                    return SKIP
+                if len(rest) <= 2:
+                    return DESCEND
+                freq = rest[2]
+                if len(rest) == 3:
+                    if facet_filter(freq, tables, exclude):
+                        return SKIP
+                    if f"{rest[1]}.{freq}" not in comp_info['data_types']:
+                        extra.append(f"Frequency {freq} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}")
+                        return SKIP
+                    return DESCEND
+                ensemble = rest[3]
+                if facet_filter(ensemble, ens, exclude):
+                    return SKIP
+                if ensemble not in info['ens']:
+                    extra.append(f"Ensemble {ensemble} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}-{freq}")
+                    return SKIP
+                return COLLECT
+
+            ensemble_dirs = crawler.crawl(project_path, accept)
+            listings = crawler.scan_many([os.path.join(project_path, *x) for x in ensemble_dirs])
+            for parts in ensemble_dirs:
+                ensemble_path = os.path.join(project_path, *parts)
+                model_version, casename, res = parts[:3]
+                comp, grid, data_type, freq, ensemble = parts[-5:]
+                try:
+                    version = listings[ensemble_path].dirs[-1]
+                except IndexError as e:
+                    raise ValueError(f'Unable to find latest version for {ensemble_path}') from e
+                dataset_id = '.'.join(
+                    ['E3SM', model_version, casename, res, comp, grid, data_type, freq, ensemble, version])
+                if debug:
+                    print_message(f'checking dataset: {dataset_id}', 'info')
+                dataset_paths.append(os.path.join(ensemble_path, version))
+                dataset_ids.append(dataset_id)
+
+    if owns_crawler:
+        crawler.save()
     return dataset_paths, dataset_ids, extra
 
 
@@ -1017,14 +755,22 @@ def filesystem_check(client, case_spec=None, debug=False, **kwargs):
 
     missing, futures = list(), list()
     print_message("Starting file-system check", 'ok')
-    dataset_paths, dataset_ids, extra = collect_paths(**kwargs)
+    dataset_paths, dataset_ids, extra = collect_paths(case_spec=case_spec, debug=debug, **kwargs)
     expected_datasets = [x for x in collect_cmip_datasets(case_spec, **kwargs)]
 
+    # a dataset directory with no files in it is missing, and doesnt need to be listed
+    file_counts = dict()
+    if (crawler := kwargs.get('crawler')) is not None:
+        file_counts = {x: y.file_count for x, y in crawler.scan_many(dataset_paths, count_files=True).items()}
+
     if not client:
         pbar = tqdm(total=len(dataset_paths))
 
     for idx, dataset_path in enumerate(dataset_paths):
         dataset_id = dataset_ids[idx]
+        if file_counts.get(dataset_path) == 0:
+            missing.append(dataset_id)
+            continue
         files = [os.path.join(dataset_path, x) for x in sorted(os.listdir(dataset_path))]
         if not files:
             missing.append(dataset_id)
@@ -1084,7 +830,7 @@ def filesystem_check(client, case_spec=None, debug=False, **kwargs):
     return missing, extra
 
 
-def verification(plot_path=None, debug=None, **kwargs):
+def verification(plot_path=None, debug=None, reduction_cache=None, **kwargs):
     issues, futures = list(), list()
     print_message("Starting dataset verification", 'ok')
     dataset_paths, dataset_ids, _ = collect_paths(**kwargs)
@@ -1105,7 +851,8 @@ def verification(plot_path=None, debug=None, **kwargs):
                 dataset_id,
                 variable,
                 plot_path,
-                debug))
+                debug,
+                cache_path=reduction_cache))
         pbar.update(1)
     
     pbar.close()
@@ -1165,6 +912,11 @@ def data_check(**kwargs):
     if dataset_ids:
         published = True
     missing, extra, issues = list(), list(), list()
+    # the filesystem check and verification share the directory listings
+    crawler = TreeCrawler(
+        workers=kwargs.get('walk_workers') or 16,
+        snapshot_path=kwargs.get('snapshot'))
+    kwargs['crawler'] = crawler
     try:
         if published:
             m, e, dataset_ids = publication_check(
@@ -1185,10 +937,11 @@ def data_check(**kwargs):
 
         if verify and data_path:
             from esgfpub.verify import verify_dataset
-            issues = verification(**kwargs)
+            issues = verification(case_spec=case_spec, **kwargs)
     finally:
         if pool:
             pool.shutdown()
+        crawler.save()
     
     digest = kwargs.get('digest')
     if digest:
@@ -0,0 +1,195 @@
+"""
+Completeness checks for the files of a dataset.
+
+Every file name is parsed once into the time span it holds, the spans are collected
+into sets, and the expected span of the dataset is compared against them with set and
+interval arithmetic. Gaps are reported as ranges, so a dataset missing a decade of
+monthly files gets one line for the decade rather than one for each of its 120 files.
+"""
+import re
+
+from esgfpub import filenames
+
+# high frequency files whose names dont match any registered convention are still
+# counted towards their year, as long as they have a YYYY-MM date
+DATED_PATTERN = re.compile(r'(\d{4})-\d{2}.*nc')
+
+SEASONS = [
+    {'name': 'ANN', 'start': '01', 'end': '12'},
+    {'name': 'DJF', 'start': '01', 'end': '12'},
+    {'name': 'MAM', 'start': '03', 'end': '05'},
+    {'name': 'JJA', 'start': '06', 'end': '08'},
+    {'name': 'SON', 'start': '09', 'end': '11'},
+]
+
+
+def file_names(files):
+    """
+    Returns the sorted base names of the files, which can be paths or names
+    """
+    return sorted(filenames.base_names(files))
+
+
+def collapse(values):
+    """
+    Collapse integers into a sorted list of (first, last) runs of consecutive values
+    """
+    runs = []
+    for value in sorted(values):
+        if runs and value == runs[-1][1] + 1:
+            runs[-1][1] = value
+        else:
+            runs.append([value, value])
+    return [tuple(x) for x in runs]
+
+
+def find_gaps(spans, start, end):
+    """
+    Returns the (first, last) ranges between start and end, inclusive, that arent covered
+    by any of the (first, last) spans. The spans can overlap and be in any order
+    """
+    gaps = []
+    covered_to = start - 1
+    for first, last in sorted(spans):
+        if last < start:
+            continue
+        if first > end:
+            break
+        if first > covered_to + 1:
+            gaps.append((covered_to + 1, first - 1))
+        covered_to = max(covered_to, last)
+    if covered_to < end:
+        gaps.append((covered_to + 1, end))
+    return gaps
+
+
+def model_output_spans(files):
+    """
+    Parse a listing of E3SM model output, and find the prefix and convention of its first file
+
+    Returns:
+        (spans, convention, prefix) where the first file is the first name in sort order
+    """
+    spans = filenames.parse_listing(files, filenames.E3SM_MODEL_OUTPUT)
+    if not spans:
+        raise ValueError(f'Unexpected file format: {min(file_names(files))}')
+    first = spans.name.index(min(spans.name))
+    return spans, spans.convention[first], spans.prefix[first]
+
+
+def check_monthly(files, start, end):
+    """
+    Find the months between the start and end years that dont have a file named like the first file
+
+    Returns:
+        (missing, extra) the file names or ranges of file names that are missing, and the files
+        that dont belong to the dataset
+    """
+    spans, convention, prefix = model_output_spans(files)
+    first_name = min(spans.name)
+    # everything after the YYYY-MM, so missing names can be given in full
+    suffix = first_name[len(prefix) + 8:]
+
+    first, last = start * 12, end * 12 + 11
+    months, extra = set(), list(spans.unparsed)
+    for idx, name in enumerate(spans.name):
+        if spans.convention[idx] == convention and spans.prefix[idx] == prefix and name.endswith(suffix):
+            month = spans.start[idx] * 12 + spans.start_month[idx] - 1
+            if first <= month <= last:
+                months.add(month)
+                continue
+        extra.append(name)
+
+    missing = []
+    for gap_start, gap_end in collapse(set(range(first, last + 1)) - months):
+        first_month = f'{gap_start // 12:04d}-{gap_start % 12 + 1:02d}'
+        if gap_start == gap_end:
+            missing.append(f'{prefix}.{first_month}{suffix}')
+        else:
+            missing.append(f'{prefix}.{first_month}..{gap_end // 12:04d}-{gap_end % 12 + 1:02d}{suffix}')
+    return missing, sorted(extra)
+
+
+def check_climos(files, start, end):
+    """
+    Find which of the monthly and seasonal climo files named like the first file are missing
+    """
+    names = file_names(files)
+    _, match = filenames.match_name(names[0], filenames.E3SM_CLIMO)
+    if match is None:
+        raise ValueError(f'Unexpected file format: {names[0]}')
+    prefix = match.group('prefix')
+
+    expected = [
+        f'{prefix}_{month:02d}_{start:04d}{month:02d}_{end:04d}{month:02d}_climo.nc'
+        for month in range(1, 13)
+    ] + [
+        f'{prefix}_{season["name"]}_{start:04d}{season["start"]}_{end:04d}{season["end"]}_climo.nc'
+        for season in SEASONS
+    ]
+    present = set(names)
+    missing = [x for x in expected if x not in present]
+    expected = set(expected)
+    extra = [x for x in names if x not in expected]
+    return missing, extra
+
+
+def check_submonthly(files, start=None, end=None):
+    """
+    Check there's at least one file for every year from start up to, but not including, end.
+    The high frequency files use different h codes and output frequencies from case to case,
+    so their exact names cant be predicted. If start and end arent given they're taken from
+    the earliest and latest files
+
+    Returns:
+        the list of missing years, or ranges of years, as prefix.YYYY
+    """
+    spans = filenames.parse_listing(files, filenames.E3SM_MODEL_OUTPUT)
+    years = set(spans.start)
+    prefix = spans.prefix[spans.name.index(min(spans.name))] if spans else None
+    for name in sorted(spans.unparsed):
+        if match := DATED_PATTERN.search(name):
+            years.add(int(match.group(1)))
+            if prefix is None:
+                prefix = name[:match.start()].rstrip('.')
+    if not years:
+        raise ValueError(f'Unexpected file format: {min(file_names(files))}')
+    if not start or not end:
+        start, end = min(years), max(years) + 1
+
+    missing = []
+    for gap_start, gap_end in collapse(set(range(start, end)) - years):
+        if gap_start == gap_end:
+            missing.append(f'{prefix}.{gap_start:04d}')
+        else:
+            missing.append(f'{prefix}.{gap_start:04d}..{gap_end:04d}')
+    return missing
+
+
+def check_time_series(files, variables, start=None, end=None, dataset_id=''):
+    """
+    Find the years between start and end that each variable doesnt have a time-series file for,
+    if start and end arent given they're taken from the earliest and latest files
+
+    Returns:
+        (missing, extra) the missing ranges as dataset_id-VAR-YYYY-YYYY, and the files
+        that arent time-series files of the expected variables
+    """
+    spans = filenames.parse_listing(files, filenames.E3SM_TIME_SERIES)
+    if not start or not end:
+        if not spans:
+            raise ValueError('No time-series files found')
+        start, end = min(spans.start), max(spans.end)
+
+    var_spans = dict()
+    for var, first, last in zip(spans.prefix, spans.start, spans.end):
+        var_spans.setdefault(var, []).append((first, last))
+
+    missing = []
+    for var in variables:
+        for gap_start, gap_end in find_gaps(var_spans.get(var, []), start, end):
+            missing.append(f'{dataset_id}-{var}-{gap_start:04d}-{gap_end:04d}')
+    variables = set(variables)
+    extra = list(spans.unparsed) + [
+        name for name, var in zip(spans.name, spans.prefix) if var not in variables]
+    return missing, sorted(extra)
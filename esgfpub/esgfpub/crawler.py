@@ -0,0 +1,178 @@
+"""
+A concurrent directory tree crawler for the publication trees.
+
+The trees are walked a level at a time, with every directory of a level listed at once on a
+thread pool, since on Lustre/GPFS each listing is a metadata round trip that is mostly spent
+waiting. A filter is applied to each directory as it's found, so filtered out facets prune
+their whole subtree before it's listed.
+
+With a snapshot path, the listing of every directory is saved in a sqlite file along with
+its mtime. On later runs a directory whose mtime hasnt changed is only stat'd, and its
+listing is taken from the snapshot.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from esgfpub.sqlite_store import SqliteStore
+
+# what the accept callback of TreeCrawler.crawl can return for a directory
+SKIP = 0
+DESCEND = 1
+COLLECT = 2
+
+
+class DirectoryInfo(object):
+    """
+    The listing of a directory, file_count and newest_mtime are None unless the files were counted
+    """
+    __slots__ = ['mtime', 'dirs', 'file_count', 'newest_mtime']
+
+    def __init__(self, mtime, dirs, file_count=None, newest_mtime=None):
+        self.mtime = mtime
+        self.dirs = dirs
+        self.file_count = file_count
+        self.newest_mtime = newest_mtime
+
+
+def scan_directory(path, count_files=False):
+    """
+    List the subdirectories of path, and optionally count its files and find their newest mtime
+    """
+    mtime = os.stat(path).st_mtime_ns
+    dirs = []
+    file_count = None
+    newest_mtime = None
+    if count_files:
+        file_count = 0
+        newest_mtime = 0.0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif count_files and entry.is_file():
+                file_count += 1
+                newest_mtime = max(newest_mtime, entry.stat().st_mtime)
+    return DirectoryInfo(mtime, sorted(dirs), file_count, newest_mtime)
+
+
+class TreeCrawler(object):
+    """
+    Lists directories concurrently, remembering each listing for the life of the crawler,
+    and across runs if a snapshot path is given
+    """
+
+    def __init__(self, workers=16, snapshot_path=None):
+        """
+        Parameters:
+            workers (int): the number of directories to list at once
+            snapshot_path (str): path to the sqlite snapshot of directory listings, optional
+        """
+        self.workers = workers
+        self.snapshot_path = snapshot_path
+        self.listed = {}
+        self.snapshot = {}
+        self.changed = {}
+        self.rescanned = 0
+        self.store = None
+        if snapshot_path:
+            self.store = SqliteStore(
+                snapshot_path,
+                "CREATE TABLE IF NOT EXISTS directories ("
+                "path TEXT PRIMARY KEY, mtime INTEGER, dirs TEXT, file_count INTEGER, newest_mtime REAL)")
+            self.snapshot = self.load()
+
+    def load(self):
+        with self.store.connect() as con:
+            rows = con.execute("SELECT path, mtime, dirs, file_count, newest_mtime FROM directories").fetchall()
+        return {
+            row[0]: DirectoryInfo(row[1], json.loads(row[2]), row[3], row[4])
+            for row in rows
+        }
+
+    def save(self):
+        """
+        Write the listings that changed during this run to the snapshot
+        """
+        if not self.snapshot_path or not self.changed:
+            return
+        rows = [
+            (path, x.mtime, json.dumps(x.dirs), x.file_count, x.newest_mtime)
+            for path, x in self.changed.items()
+        ]
+        self.store.replace_many('directories', ['path', 'mtime', 'dirs', 'file_count', 'newest_mtime'], rows)
+        self.snapshot.update(self.changed)
+        self.changed = {}
+
+    def _scan(self, path, count_files):
+        """
+        Returns the DirectoryInfo of path and whether it had to be rescanned, or None if it cant be read
+        """
+        try:
+            if (cached := self.snapshot.get(path)) is not None:
+                if os.stat(path).st_mtime_ns == cached.mtime and (cached.file_count is not None or not count_files):
+                    return cached, False
+            return scan_directory(path, count_files), True
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return None, False
+
+    def scan_many(self, paths, count_files=False):
+        """
+        Returns a dict of path to DirectoryInfo for the paths, directories that couldnt be read are left out
+        """
+        found = {}
+        todo = []
+        for path in paths:
+            info = self.listed.get(path)
+            if info is not None and (info.file_count is not None or not count_files):
+                found[path] = info
+            else:
+                todo.append(path)
+        if not todo:
+            return found
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(todo)))) as pool:
+            results = pool.map(lambda x: self._scan(x, count_files), todo)
+            for path, (info, rescanned) in zip(todo, results):
+                if info is None:
+                    continue
+                if rescanned:
+                    self.rescanned += 1
+                    self.changed[path] = info
+                self.listed[path] = info
+                found[path] = info
+        return found
+
+    def listdir(self, path):
+        """
+        Returns the sorted names of the subdirectories of path, or an empty list if it cant be read
+        """
+        info = self.scan_many([path]).get(path)
+        return info.dirs if info is not None else []
+
+    def crawl(self, root, accept):
+        """
+        Walk down from root a level at a time. accept is called with the tuple of directory
+        names from root to each directory found, and returns SKIP to prune it, DESCEND to
+        list it, or COLLECT to stop there and return it
+
+        Returns:
+            the sorted list of name tuples of the collected directories
+        """
+        collected = []
+        level = [()]
+        while level:
+            listings = self.scan_many([os.path.join(root, *x) for x in level])
+            next_level = []
+            for parts in level:
+                info = listings.get(os.path.join(root, *parts))
+                if info is None:
+                    continue
+                for name in info.dirs:
+                    child = parts + (name,)
+                    action = accept(child)
+                    if action == COLLECT:
+                        collected.append(child)
+                    elif action == DESCEND:
+                        next_level.append(child)
+            level = next_level
+        return sorted(collected)
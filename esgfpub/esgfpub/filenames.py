@@ -0,0 +1,177 @@
+"""
+Parse the time span out of E3SM and CMIP6 file names.
+
+Each naming convention is a compiled pattern in CONVENTIONS, with named groups for the
+prefix of the name before its dates, and the start and end year and month. A directory
+listing is usually all one convention, so the convention of its first name is matched
+against the whole listing joined into one string in a single findall, and the fields
+are returned as columns rather than an object per file. Only names that dont match
+that convention are parsed one at a time against the rest of the registry.
+"""
+import os
+import re
+
+# name -> pattern, in the order names are matched against them when their convention
+# isnt known. Every group is named, and each pattern has at least the prefix and start
+# groups, a pattern without end groups is for files that hold a single date
+CONVENTIONS = {}
+
+
+def register_convention(name, pattern):
+    """
+    Add a naming convention to the registry, after the ones already in it
+
+    Parameters:
+        name (str): the name of the convention
+        pattern (str): regex for a whole file name, with named groups for the prefix, start,
+            start_month and optionally end and end_month, and no unnamed groups
+    """
+    compiled = re.compile(pattern, re.M)
+    if compiled.groups != len(compiled.groupindex) or 'prefix' not in compiled.groupindex or 'start' not in compiled.groupindex:
+        raise ValueError(f"The pattern for {name} must only have named groups, including prefix and start")
+    CONVENTIONS[name] = compiled
+
+
+# CMIP6 names are var_table_source_experiment_member_grid_dates.nc
+register_convention('cmip6-climo', r'^(?P<prefix>.+)_(?P<start>\d{4})(?P<start_month>\d{2})-(?P<end>\d{4})(?P<end_month>\d{2})-clim\.nc$')
+register_convention('cmip6-mon', r'^(?P<prefix>.+)_(?P<start>\d{4})(?P<start_month>\d{2})-(?P<end>\d{4})(?P<end_month>\d{2})\.nc$')
+register_convention('cmip6-day', r'^(?P<prefix>.+)_(?P<start>\d{4})(?P<start_month>\d{2})\d{2}-(?P<end>\d{4})(?P<end_month>\d{2})\d{2}\.nc$')
+# the 3hr, 6hr and 1hr tables all use YYYYMMDDhhmm
+register_convention('cmip6-subdaily', r'^(?P<prefix>.+)_(?P<start>\d{4})(?P<start_month>\d{2})\d{6}-(?P<end>\d{4})(?P<end_month>\d{2})\d{6}\.nc$')
+
+# E3SM climos are case_SEASON_YYYYMM_YYYYMM_climo.nc, where SEASON is a month number or season name
+register_convention('e3sm-climo', r'^(?P<prefix>.+)_(?:\d{2}|ANN|DJF|MAM|JJA|SON)_(?P<start>\d{4})(?P<start_month>\d{2})_(?P<end>\d{4})(?P<end_month>\d{2})_climo\.nc$')
+# time-series are VAR_YYYYMM_YYYYMM.nc, or VAR_cmip6_180x360_aave_YYYYMM_YYYYMM.nc once regridded
+register_convention('e3sm-time-series-regridded', r'^(?P<prefix>.+)_cmip6_180x360_aave_(?P<start>\d{4})(?P<start_month>\d{2})_(?P<end>\d{4})(?P<end_month>\d{2})\.nc$')
+register_convention('e3sm-time-series', r'^(?P<prefix>.+)(?<!_cmip6_180x360_aave)_(?P<start>\d{4})(?P<start_month>\d{2})_(?P<end>\d{4})(?P<end_month>\d{2})\.nc$')
+# model output is case.component.hN.YYYY-MM.nc for monthly files, and has the day, and
+# the seconds for sub-daily files, after it. MPAS monthly means are dated with the day
+register_convention('e3sm-monthly', r'^(?P<prefix>.+)\.(?P<start>\d{4})-(?P<start_month>\d{2})\.nc$')
+register_convention('e3sm-daily', r'^(?P<prefix>.+)\.(?P<start>\d{4})-(?P<start_month>\d{2})-\d{2}\.nc$')
+register_convention('e3sm-subdaily', r'^(?P<prefix>.+)\.(?P<start>\d{4})-(?P<start_month>\d{2})-\d{2}-\d{5}\.nc$')
+# MPAS high frequency output, like the 5day_snap datasets, is dated YYYY-MM-DD_hh.mm.ss
+register_convention('e3sm-mpas-snapshot', r'^(?P<prefix>.+)\.(?P<start>\d{4})-(?P<start_month>\d{2})-\d{2}_\d{2}\.\d{2}\.\d{2}\.nc$')
+
+CMIP6 = ['cmip6-climo', 'cmip6-mon', 'cmip6-day', 'cmip6-subdaily']
+E3SM_MODEL_OUTPUT = ['e3sm-monthly', 'e3sm-daily', 'e3sm-subdaily', 'e3sm-mpas-snapshot']
+E3SM_TIME_SERIES = ['e3sm-time-series-regridded', 'e3sm-time-series']
+E3SM_CLIMO = ['e3sm-climo']
+
+
+class FileSpans(object):
+    """
+    The time spans of a listing of files, as a column for each field with a row for each
+    name that matched a convention. end and end_month are the same as start and start_month
+    for files with a single date. The names that didnt match any convention are in unparsed
+    """
+    __slots__ = ['name', 'convention', 'prefix', 'start', 'start_month', 'end', 'end_month', 'unparsed']
+
+    def __init__(self):
+        for column in self.__slots__:
+            setattr(self, column, [])
+
+    def __len__(self):
+        return len(self.name)
+
+    def extend(self, convention, names, rows):
+        """
+        Add the findall rows of a convention's pattern for the names
+        """
+        fields = sorted(CONVENTIONS[convention].groupindex, key=CONVENTIONS[convention].groupindex.get)
+        columns = dict(zip(fields, zip(*rows)))
+        # a listing only has a few distinct years and months, so each is only converted once
+        numbers = {x: int(x) for name in fields if name != 'prefix' for x in set(columns[name])}
+        start = list(map(numbers.__getitem__, columns['start']))
+        start_month = list(map(numbers.__getitem__, columns['start_month']))
+        self.name.extend(names)
+        self.convention.extend([convention] * len(names))
+        self.prefix.extend(columns['prefix'])
+        self.start.extend(start)
+        self.start_month.extend(start_month)
+        self.end.extend(map(numbers.__getitem__, columns['end']) if 'end' in columns else start)
+        self.end_month.extend(map(numbers.__getitem__, columns['end_month']) if 'end_month' in columns else start_month)
+
+    def append(self, convention, name, match):
+        start = int(match.group('start'))
+        start_month = int(match.group('start_month'))
+        self.name.append(name)
+        self.convention.append(convention)
+        self.prefix.append(match.group('prefix'))
+        self.start.append(start)
+        self.start_month.append(start_month)
+        self.end.append(int(match.group('end')) if 'end' in match.re.groupindex else start)
+        self.end_month.append(int(match.group('end_month')) if 'end_month' in match.re.groupindex else start_month)
+
+
+def base_names(files):
+    """
+    Returns the base names of file names or paths, without the per-call overhead of os.path.basename
+    """
+    return [str(x).rpartition(os.sep)[2] for x in files]
+
+
+def match_name(name, conventions=None):
+    """
+    Returns the (convention, match) of the first convention that matches the name, or (None, None)
+    """
+    for convention in conventions or CONVENTIONS:
+        if match := CONVENTIONS[convention].match(name):
+            return convention, match
+    return None, None
+
+
+def parse_listing(files, conventions=None):
+    """
+    Parse the time spans of a listing of files
+
+    Parameters:
+        files (list): file names or paths, only their base names are parsed
+        conventions (list): the names of the conventions to try, by default every registered one
+    Returns:
+        FileSpans with the rows in the order of the files
+    """
+    names = base_names(files)
+    conventions = [x for x in CONVENTIONS if x in conventions] if conventions else list(CONVENTIONS)
+    spans = FileSpans()
+    if not names:
+        return spans
+
+    convention, _ = match_name(names[0], conventions)
+    if convention is not None:
+        text = '\n'.join(names)
+        # a name with a newline in it would throw off the row for each name
+        if text.count('\n') == len(names) - 1:
+            rows = CONVENTIONS[convention].findall(text)
+            if len(rows) == len(names):
+                spans.extend(convention, names, rows)
+                return spans
+
+    for name in names:
+        convention, match = match_name(name, conventions)
+        if convention is None:
+            spans.unparsed.append(name)
+        else:
+            spans.append(convention, name, match)
+    return spans
+
+
+def get_start_end(name, conventions=None):
+    """
+    Returns the start and end year of a single file
+    """
+    _, match = match_name(str(name).rpartition(os.sep)[2], conventions)
+    if match is None:
+        raise ValueError(f'Unexpected file format: {name}')
+    start = int(match.group('start'))
+    return start, int(match.group('end')) if 'end' in match.re.groupindex else start
+
+
+def infer_start_end(files, conventions=None):
+    """
+    Returns the start year of the earliest file and the end year of the latest,
+    or (None, None) if none of the file names could be parsed
+    """
+    spans = parse_listing(files, conventions)
+    if not spans:
+        return None, None
+    return min(spans.start), max(spans.end)
@@ -2,13 +2,24 @@ import os
 import stat
 import json
 import yaml
+import requests
 from os import remove
-from time import sleep
 from subprocess import Popen, PIPE
-from esgfpub.util import print_message, check_ds_exists
+from esgfpub.util import print_message
 from esgfpub import resources
 from datetime import datetime
+from functools import partial
 from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+SEARCH_API = "https://esgf-node.llnl.gov/esg-search/search/"
 
 
 def get_facet_info(datasetID):
@@ -51,91 +62,340 @@ def print_while_running(process):
     raise StopIteration
 
 
-def publish_maps(mapfiles, mapsin, mapsout, mapserr, logpath, sproket='spoket', no_custom=False, debug=False):
-    os.makedirs(logpath, exist_ok=True)
+_session = None
+
+
+def get_session():
+    """
+    Returns a requests.Session shared by the existence searches, so the connection
+    to the index node is pooled instead of re-opened for every request
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=3)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
+
+def mapfile_version(path):
+    """
+    Returns the dataset version from the first line of a mapfile, which starts with
+    dataset_id#version, or None if it doesnt have one
+    """
+    with open(path, 'r') as instream:
+        _, _, version = instream.readline().split('|')[0].strip().partition('#')
+    return version.lstrip('v') or None
+
+
+def datasets_exist(datasets, search_api=SEARCH_API, debug=False, batch_size=100, page_size=10000):
+    """
+    Look up which of the datasets have already been published. The dataset ids are
+    OR'd together into a single Dataset search, batch_size ids per request so the URL
+    stays a reasonable length, and the results are paged through and split by dataset
+
+    Parameters:
+        datasets (dict): dataset id (the ESGF master_id, which is how mapfiles are named) to the
+            version about to be published, a dataset whose version is None exists if any version does
+        search_api (str): the ESGF search endpoint
+        batch_size (int): the number of dataset ids to put in a single request
+        page_size (int): the number of documents to request at once
+    Returns:
+        the set of dataset ids that already exist
+    """
+    dataset_ids = list(datasets)
+    published = {}
+    session = get_session()
+    for i in range(0, len(dataset_ids), batch_size):
+        batch = dataset_ids[i: i + batch_size]
+        params = [
+            ('type', 'Dataset'),
+            ('format', 'application/solr+json'),
+            ('fields', 'master_id,version')]
+        params.extend([('master_id', x) for x in batch])
+        offset = 0
+        while True:
+            res = session.get(search_api, params=params + [('offset', offset), ('limit', page_size)])
+            if res.status_code != 200:
+                raise ValueError(f"ESGF search request failed: (status {res.status_code}) {res.url}")
+            response = res.json()['response']
+            # each replica, and each version, of a dataset is its own document
+            for doc in response['docs']:
+                published.setdefault(doc['master_id'], set()).add(str(doc.get('version', '')).lstrip('v'))
+            offset += len(response['docs'])
+            if not response['docs'] or offset >= response['numFound']:
+                break
+        if debug:
+            print_message(f"Searched for {len(batch)} datasets, {len(published)} found so far", 'info')
+    return {
+        x for x in dataset_ids
+        if x in published and (datasets[x] is None or datasets[x] in published[x])}
+
+
+def parse_project_workers(items):
+    """
+    Parse per project worker counts given as PROJECT=N strings into a dict
+    """
+    project_workers = {}
+    for item in items or []:
+        project, _, count = item.partition('=')
+        if not project or not count.isdigit() or int(count) < 1:
+            raise ValueError(
+                f"Project workers {item} should look like PROJECT=N, with N a positive number")
+        project_workers[project] = int(count)
+    return project_workers
+
+
+def publish_map(m, mapsin, mapsout, mapserr, logpath, no_custom=False):
+    """
+    Publish a single mapfile, then move it from mapsin to mapsout, or to mapserr if the publication failed.
+    Each mapfile gets its own temp directory and log, so publications running at the same time dont share anything
+
+    Returns:
+        True if the publication succeeded
+    """
+    print_message(f"Starting publication for {m}", 'ok')
+
+    datasetID = m[:-4]
+    project = datasetID.split('.')[0]
+    project_metadata = None
     with TemporaryDirectory() as tmpdir:
+        if project == 'CMIP6':
+            project = 'cmip6'
+        elif project == 'E3SM':
+            if not no_custom:
+                campaign, driver, period = get_facet_info(datasetID)
+                if campaign and driver and period:
+                    project_metadata_path = os.path.join(
+                        tmpdir, f'{datasetID}.json')
+                    project_metadata = {
+                        'Campaign': campaign,
+                        'Science Driver': driver,
+                        'Period': period
+                    }
+                    with open(project_metadata_path, 'w') as op:
+                        json.dump(project_metadata, op)
+        else:
+            raise ValueError(
+                "Unrecognized project name for mapfile: {}".format(m))
+
+        map_path = os.path.join(mapsin, m)
+        cmd = f"esgpublish --project {project} --map {map_path}".split()
+        if project_metadata and not no_custom:
+            cmd.extend(['--json', project_metadata_path])
+
+        print_message(f"Running: {' '.join(cmd)}", 'ok')
+        log = os.path.join(logpath, f"{datasetID}.log")
+        print_message(f"Writing publication log to {log}", 'ok')
+
+        with open(log, 'w') as outstream:
+            proc = Popen(cmd, stdout=outstream,
+                         stderr=outstream, universal_newlines=True)
+            proc.wait()
+
+    if proc.returncode != 0:
+        print_message(
+            f"Error in publication, moving {m} to {mapserr}\n", "error")
+        os.rename(
+            os.path.join(mapsin, m),
+            os.path.join(mapserr, m))
+        return False
+    else:
+        print_message(
+            f"Publication success, moving {m} to {mapsout}\n", "info")
+        os.rename(
+            os.path.join(mapsin, m),
+            os.path.join(mapsout, m))
+        return True
 
-        for m in mapfiles:
-            if not m.endswith('.map'):
-                continue
 
-            print_message(f"Starting publication for {m}", 'ok')
+class Publisher(object):
+    """
+    Publishes mapfiles on a pool of workers for each project. A mapfile is
+    only handed to a worker once, and a failure in one publication moves
+    just that mapfile to the error directory.
+    """
 
-            datasetID = m[:-4]
-            project = datasetID.split('.')[0]
-            if check_ds_exists(datasetID, debug=debug, sproket=sproket):
-                msg = f"Dataset {datasetID} already exists"
-                print_message(msg, 'err')
+    def __init__(self, mapsin, mapsout, mapserr, logpath, search_api=SEARCH_API, no_custom=False,
+                 debug=False, workers=1, project_workers=None, exists=None):
+        """
+        Parameters:
+            workers (int): the number of publications to run at once for each project
+            project_workers (dict): project name to the number of workers for that project, overriding workers
+            exists (callable): takes a dict of dataset id to the version in its mapfile, and returns the set of
+                the dataset ids whose version is already published, the default searches the ESGF search_api
+        """
+        self.mapsin = mapsin
+        self.mapsout = mapsout
+        self.mapserr = mapserr
+        self.logpath = logpath
+        self.no_custom = no_custom
+        self.workers = workers
+        self.project_workers = project_workers or {}
+        if exists is None:
+            exists = partial(datasets_exist, search_api=search_api, debug=debug)
+        self.exists = exists
+        self.pools = {}
+        self.running = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        os.makedirs(logpath, exist_ok=True)
+
+    def pool(self, project):
+        if project not in self.pools:
+            self.pools[project] = ThreadPoolExecutor(
+                max_workers=self.project_workers.get(project, self.workers))
+        return self.pools[project]
+
+    def submit(self, mapfiles):
+        """
+        Check which of the mapfiles are already published in a single pre-check, move those
+        to the error directory, and queue the rest for publication. Mapfiles that are
+        already queued or running are skipped
+
+        Returns:
+            the list of futures for the queued mapfiles
+        """
+        with self.lock:
+            mapfiles = [x for x in mapfiles if x.endswith('.map') and x not in self.running]
+        if not mapfiles:
+            return []
+
+        existing = self.exists({
+            x[:-4]: mapfile_version(os.path.join(self.mapsin, x)) for x in mapfiles})
+        futures = []
+        for m in mapfiles:
+            if m[:-4] in existing:
+                print_message(f"Dataset {m[:-4]} already exists", 'err')
                 os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapserr, m))
+                    os.path.join(self.mapsin, m),
+                    os.path.join(self.mapserr, m))
                 continue
-            if project == 'CMIP6':
-                project = 'cmip6'
-                project_metadata = None
-            elif project == 'E3SM':
-                if not no_custom:
-                    campaign, driver, period = get_facet_info(datasetID)
-                    if campaign and driver and period:
-                        project_metadata_path = os.path.join(
-                            tmpdir, f'{datasetID}.json')
-                        project_metadata = {
-                            'Campaign': campaign,
-                            'Science Driver': driver,
-                            'Period': period
-                        }
-                        with open(project_metadata_path, 'w') as op:
-                            json.dump(project_metadata, op)
-            else:
-                raise ValueError(
-                    "Unrecognized project name for mapfile: {}".format(m))
-
-            map_path = os.path.join(mapsin, m)
-            cmd = f"esgpublish --project {project} --map {map_path}".split()
-            if project_metadata and not no_custom:
-                cmd.extend(['--json', project_metadata_path])
-
-            print_message(f"Running: {' '.join(cmd)}", 'ok')
-            log = os.path.join(logpath, f"{datasetID}.log")
-            print_message(f"Writing publication log to {log}", 'ok')
-
-            with open(log, 'w') as outstream:
-                proc = Popen(cmd, stdout=outstream,
-                             stderr=outstream, universal_newlines=True)
-                proc.wait()
-
-            if proc.returncode != 0:
-                if proc.stderr:
-                    print(proc.stderr.readlines(), flush=True)
-                print_message(
-                    f"Error in publication, moving {m} to {mapserr}\n", "error")
-                os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapserr, m))
-            else:
-                print_message(
-                    f"Publication success, moving {m} to {mapsout}\n", "info")
+            future = self.pool(m.split('.')[0]).submit(self.run, m)
+            with self.lock:
+                self.running[m] = future
+            future.add_done_callback(lambda f, m=m: self.finished(m))
+            futures.append(future)
+        return futures
+
+    def run(self, m):
+        try:
+            return publish_map(m, self.mapsin, self.mapsout, self.mapserr, self.logpath, no_custom=self.no_custom)
+        except Exception as e:
+            print_message(f"Error publishing {m}: {repr(e)}, moving it to {self.mapserr}", 'error')
+            if os.path.exists(os.path.join(self.mapsin, m)):
                 os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapsout, m))
+                    os.path.join(self.mapsin, m),
+                    os.path.join(self.mapserr, m))
+            return False
+
+    def finished(self, m):
+        with self.lock:
+            self.running.pop(m, None)
+        self.done.set()
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+
+def publish_maps(mapfiles, mapsin, mapsout, mapserr, logpath, search_api=SEARCH_API, no_custom=False, debug=False,
+                 workers=1, project_workers=None, exists=None):
+    """
+    Publish the given mapfiles and wait for all of them to finish
 
+    Returns:
+        the number of mapfiles that were published successfully
+    """
+    publisher = Publisher(
+        mapsin, mapsout, mapserr, logpath,
+        search_api=search_api, no_custom=no_custom, debug=debug,
+        workers=workers, project_workers=project_workers, exists=exists)
+    futures = publisher.submit(mapfiles)
+    publisher.shutdown()
+    return sum(1 for f in futures if f.result())
 
-def publish(mapsin, mapsout, mapserr, loop, logpath, sproket='sproket', no_custom=False, debug=False):
+
+def watch_maps(mapsin, wake, closed):
+    """
+    Set the wake event whenever a file in the input mapfile directory is closed after writing, or
+    moved into it, and add its name to the closed set. A file is only reported once its written, so
+    a mapfile thats still being written isnt claimed. Returns None if watchdog isnt available
+    """
+    if Observer is None:
+        return None
+
+    def ready(path):
+        closed.add(os.path.basename(path))
+        wake.set()
+
+    handler = FileSystemEventHandler()
+    handler.on_closed = lambda event: ready(event.src_path)
+    handler.on_moved = lambda event: ready(event.dest_path)
+    observer = Observer()
+    observer.schedule(handler, mapsin, recursive=False)
+    observer.start()
+    return observer
+
+
+def settled_maps(mapsin, sizes, closed):
+    """
+    Returns the mapfiles in mapsin that are done being written, either because the watcher saw
+    them closed or moved in, or because their size hasnt changed since the last call
+
+    Parameters:
+        sizes (dict): the mapfile sizes seen by the last call, updated with the current ones
+        closed (set): the names the watcher reported as written, the returned names are removed from it
+    """
+    current = {}
+    for name in os.listdir(mapsin):
+        if not name.endswith('.map'):
+            continue
+        try:
+            current[name] = os.stat(os.path.join(mapsin, name)).st_size
+        except FileNotFoundError:
+            continue
+    settled = sorted(
+        name for name, size in current.items()
+        if size and (name in closed or sizes.get(name) == size))
+    closed.difference_update(settled)
+    sizes.clear()
+    sizes.update(current)
+    return settled
+
+
+def publish(mapsin, mapsout, mapserr, loop, logpath, search_api=SEARCH_API, no_custom=False, debug=False,
+            workers=1, project_workers=None, exists=None):
 
     if loop:
         print_message("Starting publisher loop", 'ok')
     else:
         print_message("Starting one-off publisher", 'ok')
-    while True:
-        mapfiles = [x for x in os.listdir(mapsin) if x.endswith('.map')]
-        if mapfiles:
-            publish_maps(mapfiles, mapsin, mapsout,
-                         mapserr, logpath,
-                         debug=debug,
-                         no_custom=no_custom,
-                         sproket=sproket)
-        if not loop:
-            break
-        sleep(30)
+        publish_maps(
+            [x for x in os.listdir(mapsin) if x.endswith('.map')],
+            mapsin, mapsout, mapserr, logpath,
+            search_api=search_api, no_custom=no_custom, debug=debug,
+            workers=workers, project_workers=project_workers, exists=exists)
+        return 0
+
+    publisher = Publisher(
+        mapsin, mapsout, mapserr, logpath,
+        search_api=search_api, no_custom=no_custom, debug=debug,
+        workers=workers, project_workers=project_workers, exists=exists)
+    # new mapfiles wake the loop as soon as theyre written, but the directory is still checked
+    # every 30 seconds in case an event was missed, a mapfile found that way is only claimed once
+    # its size is the same on two checks in a row
+    sizes, closed = {}, set()
+    observer = watch_maps(mapsin, publisher.done, closed)
+    try:
+        while True:
+            publisher.done.clear()
+            publisher.submit(settled_maps(mapsin, sizes, closed))
+            publisher.done.wait(timeout=30)
+    finally:
+        if observer is not None:
+            observer.stop()
+        publisher.shutdown()
 
     return 0
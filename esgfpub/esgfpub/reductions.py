@@ -0,0 +1,220 @@
+"""
+A persistent store of per-time-step spatial reductions of dataset variables.
+
+Plotting and verifying a variable only needs its spatial mean, min, max and std at each
+time step, but computing them means reading the whole 3D/4D variable. The reductions are
+stored per file, keyed by the dataset id, variable and file name, and checked against the
+files size and mtime, so only new or changed files are read again. A new version of a
+dataset whose files were moved rather than rewritten keeps their size and mtime, and
+reuses their reductions.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from esgfpub.sqlite_store import SqliteStore
+
+# the dimensions that the spatial reductions are taken over
+SPATIAL_DIMS = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']
+
+# the number of time steps of a file that are read into memory at once
+TIME_BLOCK = 120
+
+# weighted_mean is the mean area weighted by cos(lat), the plain mean is what the plots show
+REDUCTIONS = ['mean', 'min', 'max', 'std', 'weighted_mean']
+
+
+def reduce_file(path, variable, block=TIME_BLOCK):
+    """
+    Compute the spatial reductions of the variable at each time step of a single file,
+    reading the file block time steps at a time so only one block is in memory. The mean
+    and std are the same plain reductions over the spatial dims the plots used before the
+    store, the weighted_mean is also area weighted by cos(lat) when the variable has a lat dimension
+
+    Returns:
+        dict with the 'time' values as strings, a numpy array for each of REDUCTIONS, and the variables 'units'.
+        time is None if the variable doesnt have a time axis
+    """
+    with xr.open_dataset(path) as ds:
+        da = ds[variable]
+        reduction = {'time': None, 'units': da.attrs.get('units')}
+        if 'time' not in da.dims:
+            return reduction
+        dims = tuple(x if x != 'sector' else 'basin' for x in SPATIAL_DIMS if x in da.dims)
+        weights = None
+        if 'lat' in da.dims:
+            weights = np.cos(np.deg2rad(ds['lat'])).fillna(0)
+
+        size = da['time'].size
+        for name in REDUCTIONS:
+            reduction[name] = np.empty(size)
+        for start in range(0, size, block):
+            chunk = da.isel(time=slice(start, start + block))
+            end = start + chunk['time'].size
+            if not dims:
+                for name in REDUCTIONS:
+                    reduction[name][start: end] = chunk.values if name != 'std' else 0
+                continue
+            reduction['mean'][start: end] = chunk.mean(dim=dims).values
+            if weights is not None:
+                reduction['weighted_mean'][start: end] = chunk.weighted(weights).mean(dim=dims).values
+            else:
+                reduction['weighted_mean'][start: end] = reduction['mean'][start: end]
+            reduction['std'][start: end] = chunk.std(dim=dims).values
+            reduction['min'][start: end] = chunk.min(dim=dims).values
+            reduction['max'][start: end] = chunk.max(dim=dims).values
+        reduction['time'] = [str(x) for x in da['time'].values]
+    return reduction
+
+
+class ReductionStore(SqliteStore):
+    """
+    A sqlite table of per-file reductions keyed by (dataset_id, variable, file name),
+    an entry is only used if the files size and mtime havent changed since it was stored
+    """
+
+    def __init__(self, path):
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS reductions ("
+            "dataset_id TEXT, variable TEXT, name TEXT, size INTEGER, mtime INTEGER, "
+            "version TEXT, units TEXT, time TEXT, "
+            "mean BLOB, min BLOB, max BLOB, std BLOB, weighted_mean BLOB, "
+            "PRIMARY KEY (dataset_id, variable, name))")
+
+    def get_many(self, dataset_id, variable, paths):
+        """
+        Returns the stored reduction for each of the files, or None if its missing or the file has changed
+        """
+        params = []
+        for path in paths:
+            st = os.stat(path)
+            params.append((dataset_id, variable, os.path.basename(path), st.st_size, st.st_mtime_ns))
+        return self.select_many(
+            "SELECT units, time, mean, min, max, std, weighted_mean FROM reductions "
+            "WHERE dataset_id = ? AND variable = ? AND name = ? AND size = ? AND mtime = ?",
+            params, self.from_row)
+
+    @staticmethod
+    def from_row(row):
+        reduction = {'units': row[0], 'time': json.loads(row[1])}
+        for name, value in zip(REDUCTIONS, row[2:]):
+            reduction[name] = np.frombuffer(value, dtype=np.float64)
+        return reduction
+
+    def put_many(self, dataset_id, variable, items, version=None):
+        """
+        Store a list of (path, reduction) pairs in a single transaction, reductions of
+        variables without a time axis arent stored
+        """
+        rows = []
+        for path, reduction in items:
+            if reduction['time'] is None:
+                continue
+            st = os.stat(path)
+            rows.append(
+                (dataset_id, variable, os.path.basename(path), st.st_size, st.st_mtime_ns,
+                 version, reduction['units'], json.dumps(reduction['time']))
+                + tuple(np.asarray(reduction[x], dtype=np.float64).tobytes() for x in REDUCTIONS))
+        self.replace_many(
+            'reductions',
+            ['dataset_id', 'variable', 'name', 'size', 'mtime', 'version', 'units', 'time'] + REDUCTIONS,
+            rows)
+
+
+def stream_reductions(paths, variable, dataset_id=None, store=None, version=None, client=None, workers=1):
+    """
+    Yield the reductions of each file in the order given, reading only the files that
+    arent already in the store and saving those to it. On a dask cluster each file is a
+    task, otherwise the files are read workers at a time
+
+    Parameters:
+        paths (list): the files of the dataset
+        variable (str): the variable to reduce
+        dataset_id (str): the dataset id the reductions are stored under, required with a store
+        store (ReductionStore): the store to read from and update, optional
+        version (str): the dataset version the files belong to, recorded with the reductions
+        client (dask.distributed.Client): compute the reductions on this cluster
+        workers (int): the number of files to read at once when computing locally
+    """
+    paths = list(paths)
+    found = store.get_many(dataset_id, variable, paths) if store is not None else [None] * len(paths)
+    missing = [x for x, y in zip(paths, found) if y is None]
+
+    pool = None
+    if client is not None:
+        futures = client.map(reduce_file, missing, variable=variable)
+    else:
+        pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        futures = [pool.submit(reduce_file, x, variable) for x in missing]
+    try:
+        pending = []
+        results = iter(futures)
+        for path, reduction in zip(paths, found):
+            if reduction is None:
+                reduction = next(results).result()
+                pending.append((path, reduction))
+            yield reduction
+        if store is not None and pending:
+            store.put_many(dataset_id, variable, pending, version=version)
+    finally:
+        for future in futures:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def dataset_files(dataset_path):
+    """
+    Returns the paths of the netCDF files in a dataset directory in file name order,
+    which for CMIP and E3SM file names is time order
+    """
+    paths = sorted(
+        os.path.join(dataset_path, x)
+        for x in os.listdir(dataset_path) if x.endswith('.nc'))
+    if not paths:
+        raise ValueError(f"Empty dataset directory {dataset_path}")
+    return paths
+
+
+def stream_dataset_reductions(dataset_path, variable, dataset_id=None, cache_path=None, client=None, workers=1):
+    """
+    Yield the reductions of each file in a dataset directory, in the order of dataset_files,
+    with the directory name recorded as their version
+
+    Parameters:
+        cache_path (str): path to the sqlite ReductionStore, if not given every file is read
+    """
+    if dataset_id is None:
+        dataset_id = os.path.abspath(dataset_path)
+    store = ReductionStore(cache_path) if cache_path else None
+    version = os.path.basename(os.path.normpath(dataset_path))
+    yield from stream_reductions(
+        dataset_files(dataset_path), variable, dataset_id=dataset_id, store=store, version=version,
+        client=client, workers=workers)
+
+
+def dataset_reductions(dataset_path, variable, dataset_id=None, cache_path=None, client=None, workers=1):
+    """
+    The reductions of a variable over every file in a dataset directory, concatenated in
+    file name order, which for CMIP and E3SM file names is time order
+
+    Parameters:
+        cache_path (str): path to the sqlite ReductionStore, if not given every file is read
+    Returns:
+        dict like reduce_file's for the whole dataset, time is None if the variable doesnt have a time axis
+    """
+    reductions = list(stream_dataset_reductions(
+        dataset_path, variable, dataset_id=dataset_id, cache_path=cache_path, client=client, workers=workers))
+    if any(x['time'] is None for x in reductions):
+        return {'time': None, 'units': reductions[0]['units']}
+    dataset = {
+        'units': reductions[0]['units'],
+        'time': [t for x in reductions for t in x['time']],
+    }
+    for name in REDUCTIONS:
+        dataset[name] = np.concatenate([x[name] for x in reductions])
+    return dataset
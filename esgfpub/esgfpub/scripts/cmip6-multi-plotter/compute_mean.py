@@ -2,21 +2,28 @@ import sys
 import os
 import argparse
 import xarray as xr
+from esgfpub.reductions import dataset_reductions
         
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--path', required=True)
+    parser.add_argument('--reduction-cache', help="Path to the sqlite store of per-file spatial means, files already in it arent read again")
     args = parser.parse_args()
 
-    ds = xr.open_mfdataset(f'{args.path}/*.nc', combine='by_coords')
-    possible_dims = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']    
-    dims = tuple(x if x != 'sector' else 'basin' for x in ds.dims if x in possible_dims)
-    variable = next(x for x in ds.data_vars if 'bnds' not in x and 'bounds' not in x)
+    first = sorted(x for x in os.listdir(args.path) if x.endswith('.nc'))[0]
+    with xr.open_dataset(os.path.join(args.path, first)) as ds:
+        variable = next(x for x in ds.data_vars if 'bnds' not in x and 'bounds' not in x)
     idx = args.path.find('CMIP6')
     dataset_id = args.path[idx:].replace(os.sep, '.')
-    ds[variable].mean(dims).compute().to_netcdf(f"{dataset_id}.nc")
+    reductions = dataset_reductions(args.path, variable, dataset_id=dataset_id, cache_path=args.reduction_cache)
+    xr.DataArray(
+        reductions['mean'],
+        dims=['time'],
+        coords={'time': reductions['time']},
+        name=variable,
+        attrs={'units': reductions['units'] or ''}).to_netcdf(f"{dataset_id}.nc")
 
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
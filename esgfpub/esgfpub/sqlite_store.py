@@ -0,0 +1,73 @@
+"""
+The sqlite file behind a persistent cache.
+
+Each cache is a single table in its own sqlite file, opened with a new connection for
+every batch of lookups or writes so the file can be shared between processes, and a
+batch is read or written in one transaction.
+"""
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class SqliteStore(object):
+    """
+    A sqlite table, created along with its directory if they dont exist, with the hit and
+    miss counts of the lookups made through it
+    """
+
+    def __init__(self, path, schema):
+        """
+        Parameters:
+            path (str, Path): the sqlite file
+            schema (str): the CREATE TABLE IF NOT EXISTS statement for the table
+        """
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as con:
+            con.execute(schema)
+
+    @contextmanager
+    def connect(self):
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def select_many(self, query, params_list, convert=None, valid=None):
+        """
+        Run a single row query once for each set of parameters, in one transaction
+
+        Parameters:
+            query (str): the SELECT statement
+            params_list (list): the parameters of each lookup
+            convert (callable): turns a row into the value to return, by default its first column
+            valid (callable): a row it returns False for is treated as missing, e.g. an expired entry
+        Returns:
+            a list of the converted row, or None if there wasnt one, for each lookup
+        """
+        values = []
+        with self.connect() as con:
+            for params in params_list:
+                row = con.execute(query, params).fetchone()
+                if row is None or (valid is not None and not valid(row)):
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self.hits += 1
+                    values.append(convert(row) if convert is not None else row[0])
+        return values
+
+    def replace_many(self, table, columns, rows):
+        """
+        Insert or replace rows of values for the columns of a table in a single transaction
+        """
+        with self.connect() as con:
+            con.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                rows)
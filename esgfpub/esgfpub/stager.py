@@ -62,7 +62,8 @@ def stage(ARGS):
         mode=transfer_mode,
         data_paths=DATA_PATHS,
         ensemble=ENSEMBLE,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        workers=ARGS.transfer_workers)
     if num_moved == -1:
         return 1
 
@@ -0,0 +1,96 @@
+"""
+Copying files between the filesystems of the warehouse and the publication directories.
+
+The data is copied inside the kernel where possible, and when a checksum of the copy is
+needed its read through a single buffer that is hashed as its written out, so large
+datasets are only read once.
+"""
+import os
+import errno
+import shutil
+import hashlib
+from pathlib import Path
+
+# files are copied and hashed in large blocks, on GPFS/Lustre small reads are dominated by per-call latency
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# errors from copy_file_range and sendfile that mean the kernel cant do the copy
+# for this pair of files, so it has to be done in userspace
+KERNEL_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP)
+
+
+def same_device(src, dst):
+    """
+    Returns True if src and dst are on the same filesystem, in which case a rename moves the
+    file without copying any data. If dst doesnt exist yet its nearest existing parent is used
+    """
+    dst = Path(dst).absolute()
+    while not dst.exists() and dst != dst.parent:
+        dst = dst.parent
+    return os.stat(src).st_dev == os.stat(dst).st_dev
+
+
+def _kernel_copy(infd, outfd, size, block_size):
+    """
+    Copy up to size bytes from the start of infd to outfd without passing the data through
+    userspace, with copy_file_range if the platform and filesystem support it and sendfile otherwise
+
+    Returns:
+        the number of bytes copied, which is short of size if neither could finish the copy
+    """
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                if not (count := os.copy_file_range(infd, outfd, min(block_size, size - copied))):
+                    break
+                copied += count
+            return copied
+        except OSError as e:
+            if copied or e.errno not in KERNEL_COPY_ERRORS:
+                raise
+    try:
+        while copied < size:
+            if not (count := os.sendfile(outfd, infd, copied, min(block_size, size - copied))):
+                break
+            copied += count
+    except OSError as e:
+        if copied or e.errno not in KERNEL_COPY_ERRORS:
+            raise
+    return copied
+
+
+def copy_file(src, dst, checksum=False, block_size=BLOCK_SIZE):
+    """
+    Copy a file, keeping its permissions and modification time like shutil.copy2.
+
+    Without a checksum the data is copied inside the kernel. With one, the data is
+    streamed once through a buffer that is hashed as it is written out, so the copy
+    doesnt have to be read back again to checksum it
+
+    Parameters:
+        src (str, Path): the file to copy
+        dst (str, Path): the path to copy it to
+        checksum (bool): compute the SHA256 of the file during the copy
+    Returns:
+        the SHA256 hex digest of the file if checksum is set, otherwise None
+    """
+    sha256 = hashlib.sha256() if checksum else None
+    with open(src, "rb", buffering=0) as instream, open(dst, "wb", buffering=0) as outstream:
+        size = os.fstat(instream.fileno()).st_size
+        copied = 0
+        if sha256 is None:
+            copied = _kernel_copy(instream.fileno(), outstream.fileno(), size, block_size)
+            instream.seek(copied)
+            outstream.seek(copied)
+        if sha256 is not None or copied < size:
+            buffer = bytearray(block_size)
+            view = memoryview(buffer)
+            while count := instream.readinto(buffer):
+                if sha256 is not None:
+                    sha256.update(view[:count])
+                written = 0
+                while written < count:
+                    written += outstream.write(view[written:count])
+    shutil.copystat(src, dst)
+    return sha256.hexdigest() if sha256 is not None else None
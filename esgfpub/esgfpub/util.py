@@ -9,12 +9,13 @@ import argparse
 import json
 from subprocess import call, Popen, PIPE
 from datetime import datetime
-from shutil import move, copy
 from time import sleep
 from tqdm import tqdm
 from esgfpub import resources
+from esgfpub.transfer import copy_file, same_device
 from esgfpub.version import __version__
 from tempfile import NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 def parse_args():
@@ -38,6 +39,11 @@ def parse_args():
         "--transfer-mode",
         default='link',
         help="the file transfer mode, allowed values are link, move, or copy")
+    parser_publish.add_argument(
+        '--transfer-workers',
+        type=int,
+        default=8,
+        help="the number of files to copy at once, default is 8")
     parser_publish.add_argument(
         '--over-write',
         help="Over write any existing files",
@@ -103,6 +109,15 @@ def parse_args():
         '--sproket',
         default='sproket',
         help='Path to custom sproket binary, only needed if --published is turned on.')
+    parser_esgf_check.add_argument(
+        '--walk-workers',
+        type=int,
+        default=16,
+        help="The number of directories to list at once when walking the data path, default: 16")
+    parser_esgf_check.add_argument(
+        '--snapshot',
+        help="Path to a sqlite snapshot of the directory listings under the data path. Directories whose "
+             "mtime hasnt changed since the last run are not listed again")
     parser_esgf_check.add_argument(
         '--file-system',
         action="store_true",
@@ -139,6 +154,9 @@ def parse_args():
     parser_esgf_check.add_argument(
         '--plot-path',
         help="Where to store verification plots")
+    parser_esgf_check.add_argument(
+        '--reduction-cache',
+        help="Path to the sqlite store of per-file spatial means used by --verify, files already in it arent read again")
     parser_esgf_check.add_argument(
         '--spec-path',
         default=os.path.join(resource_path, 'dataset_spec.yaml'),
@@ -185,13 +203,23 @@ def parse_args():
         action="store_true",
         help="If set, this will cause the publisher to loop continuously and publish any mapfiles placed in the input directory")
     parser_publish.add_argument(
-        '--sproket',
-        default='sproket',
-        help="path to sproket binary if its not in your PATH")
+        '--search-api',
+        default="https://esgf-node.llnl.gov/esg-search/search/",
+        help="The ESGF search endpoint used to check which datasets are already published, default is the LLNL index node")
     parser_publish.add_argument(
         '--no-custom',
         action="store_true",
         help="dont do the custom facet update")
+    parser_publish.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help="The number of mapfiles to publish at once for each project, default is 1")
+    parser_publish.add_argument(
+        '--project-workers',
+        nargs='+',
+        help="Per project number of publication workers given as PROJECT=N, e.g. CMIP6=2 E3SM=8, overrides --workers for those projects")
     parser_publish.add_argument(
         '--debug',
         action="store_true")
@@ -361,9 +389,11 @@ def validate_raw(data_paths, start, end):
         return True
 
 
-def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwrite):
+def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwrite, workers=8):
     """
-    Move or copy data into the ESGF publication structure
+    Move or copy data into the ESGF publication structure. All the destinations are
+    worked out first, then moves within a filesystem are done as renames and everything
+    else is copied on a pool of workers
 
     Parameters
     ----------
@@ -373,6 +403,7 @@ def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwr
         grid (str): the non-native grid name
         data_paths (dict): a dictionary with keys with the file type name, and values of the
             path to where those files are stored
+        workers (int): the number of files to copy at once
     Returns
     -------
         number of files transfer if everything completed successfully
@@ -380,21 +411,16 @@ def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwr
     """
     if mode not in ['copy', 'move', 'link']:
         raise ValueError('{} is not a supported mode'.format(mode))
-    if mode == 'move':
-        transfer = move
-    elif mode == 'link':
-        transfer = os.symlink
-    else:
-        transfer = copy
 
     resolution_dir = os.listdir(os.path.join(outpath, experiment))[0]
     num_transfered = 0
     dataset_paths = list()
+    transfers = list()
 
     for dtype, path in list(data_paths.items()):
         contents = os.listdir(path)
 
-        for _, item in enumerate(tqdm(contents, desc="{}: ".format(dtype))):
+        for item in contents:
 
             src = os.path.join(path, item)
             dst = setup_dst(
@@ -424,12 +450,47 @@ def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwr
             if not os.path.exists(src):
                 print_message('{} does not exist'.format(src))
                 continue
-            try:
-                transfer(src, dst)
-            except OSError as error:
-                print(src, dst)
-                print(repr(error))
-                return -1
+            transfers.append((src, dst))
+
+    # a rename is all a move needs if the source and destination share a filesystem,
+    # which is checked once for each pair of directories
+    copies = list()
+    devices = dict()
+    for src, dst in tqdm(transfers, desc="renaming: " if mode == 'move' else "linking: ", disable=mode == 'copy'):
+        try:
+            if mode == 'link':
+                os.symlink(src, dst)
+                continue
+            if mode == 'move':
+                key = (os.path.dirname(src), os.path.dirname(dst))
+                if key not in devices:
+                    devices[key] = same_device(*key)
+                if devices[key]:
+                    os.rename(src, dst)
+                    continue
+        except OSError as error:
+            print(src, dst)
+            print(repr(error))
+            return -1, dataset_paths
+        copies.append((src, dst))
+
+    if copies:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(copy_file, src, dst): (src, dst) for src, dst in copies}
+            failed = False
+            for future in tqdm(as_completed(futures), total=len(futures), desc="copying: "):
+                src, dst = futures[future]
+                try:
+                    future.result()
+                except OSError as error:
+                    print(src, dst)
+                    print(repr(error))
+                    failed = True
+                    continue
+                if mode == 'move':
+                    os.remove(src)
+        if failed:
+            return -1, dataset_paths
 
     return num_transfered, dataset_paths
 
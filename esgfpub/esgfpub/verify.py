@@ -2,12 +2,14 @@ import warnings
 warnings.simplefilter('ignore')
 
 from esgfpub.util import path_to_dataset_id, print_message
-from dask.distributed import get_client, worker_client, as_completed
+from esgfpub.reductions import dataset_files, stream_dataset_reductions, dataset_reductions
+from dask.distributed import get_client
 from dask.diagnostics import ProgressBar
 
 import statsmodels.api as sm
 import xarray as xr
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime
 import os
 from tqdm import tqdm
@@ -19,143 +21,126 @@ logger = logging.getLogger("distributed.worker")
 logger.setLevel(logging.ERROR)
 
 
-def plot_minmaxmean(outpath, ds, vmax, dataset_id, debug=False):
+def plot_minmaxmean(outpath, times, means, vmax, dataset_id, units=None, debug=False):
 
     fig, ax1 = plt.subplots()
     fig.set_size_inches(18.5, 10.5)
     plt.title(dataset_id)
-    
-    xtick_positions = [i for i, t in enumerate(ds['time']) if i % (120) == 0]
-    xtick_values = [t.values.item().strftime('%Y') for i, t in enumerate(ds['time']) if i % (120) == 0]
-    plt.xticks(xtick_positions, xtick_values)
 
+    xtick_positions = [i for i in range(len(times)) if i % (120) == 0]
+    xtick_values = [str(times[i])[:4] for i in xtick_positions]
+    plt.xticks(xtick_positions, xtick_values)
 
     ax1.set_xlabel('year')
-    var = next(filter(lambda x: 'bnds' not in x, ds.data_vars))
-    if hasattr(ds[var], 'units'):
-        ax1.set_ylabel(ds[var].units)
+    if units:
+        ax1.set_ylabel(units)
 
-    ax1.plot(ds['means'], color='tab:blue')
+    ax1.plot(means, color='tab:blue')
 
     ax2 = ax1.twinx()
     ax2.plot(vmax, color='tab:red')
 
     plt.savefig(outpath, dpi=100)
+    plt.close(fig)
     return
 
 
-def run_chunk(ds, dataset_id, maxrollingvar, maxrollingstd, segment, index):
-    issues = list()
-    vmax = np.ndarray(shape=(len(ds['time'])))
-    idx = -1
-    for step in ds['time']:
-        idx += 1
-
-        mean = ds.sel(time=step)['means'].values
-        if not isinstance(mean, int) and not isinstance(mean, float) and mean.size > 1:
-            mean = max(mean)
+class RollingSqVariance(object):
+    """
+    The squared variance of each value against the rolling mean and standard deviation of
+    the window that ends at it, like rolling(time=window, min_periods=1) in xarray. Values are
+    given a chunk at a time, and only the last window-1 values are kept between chunks
+    """
+
+    def __init__(self, window=120):
+        self.window = window
+        self.tail = np.full(window - 1, np.nan)
+
+    def update(self, values):
+        """
+        Parameters:
+            values (np.ndarray): the next values of the series, without any NaNs
+        Returns:
+            np.ndarray of the squared variance of each value, 0 where its undefined or the value is 0
+        """
+        buffer = np.concatenate([self.tail, values])
+        # one row per value, holding the window ending at it, padded with NaN at the start of the series
+        windows = sliding_window_view(buffer, self.window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rolling_mean = np.nanmean(windows, axis=1)
+            rolling_std = np.nanstd(windows, axis=1)
+            vmax = ((values - rolling_mean) / rolling_std) ** 2
+        vmax[(values == 0) | ~np.isfinite(vmax)] = 0
+        self.tail = buffer[len(buffer) - (self.window - 1):]
+        return vmax
+
+
+def check_sq_variance(dataset_path, dataset_id, variable, pngpath, pbar=None, debug=False, window=120, client=None, workers=1,
+                      cache_path=None):
+    """
+    Look for time steps whose area weighted spatial mean is 0, or is an outlier against the
+    rolling mean and standard deviation of the window time steps before it.
+
+    The files are streamed in a single pass, in file name order which for CMIP and E3SM
+    file names is time order. Only the per-time-step means and the rolling window are kept,
+    so the memory use doesnt grow with the size of the variable.
+
+    Parameters:
+        client (dask.distributed.Client): compute the file means on this cluster, by default
+            the current client is used if there is one, otherwise the means are computed locally
+        workers (int): the number of files to read at once when computing locally
+        cache_path (str): path to the ReductionStore, files already in it arent read again
+    Returns:
+        the list of issues found
+    """
+    paths = dataset_files(dataset_path)
+    if client is None:
+        try:
+            client = get_client()
+        except ValueError:
+            client = None
+
+    if pbar is not None:
+        pbar.total = len(paths) + 1
+        if pbar.n != 0:
+            pbar.n = 0
+            pbar.last_print_n = 0
+            pbar.update()
 
-        if mean == 0.0:
+    issues = []
+    rolling = RollingSqVariance(window)
+    times, means, vmax = [], [], []
+    units = None
+    reductions = stream_dataset_reductions(
+        dataset_path, variable, dataset_id=dataset_id, cache_path=cache_path, client=client, workers=workers)
+    for reduction in reductions:
+        if pbar is not None:
+            pbar.update(1)
+        if reduction['time'] is None:
+            return []
+        units = reduction['units']
+        ftimes, fmeans = np.array(reduction['time']), reduction['weighted_mean']
+        keep = ~np.isnan(fmeans)
+        ftimes, fmeans = ftimes[keep], fmeans[keep]
+        for step in ftimes[fmeans == 0]:
             issues.append(
-                f"\tZero data issue found for {dataset_id} at {str(step['time'].item())[:7]}")
-            vmax[idx] = 0
-            continue
-
-        max_rolling_var = maxrollingvar.sel(time=step)
-        mx_rolling_std = maxrollingstd.sel(time=step)
-        # if there's a NAN in the array skip it
-        if np.isnan(max_rolling_var) or np.isnan(mx_rolling_std) or np.isnan(mean):
-            vmax[idx] = 0
-            continue
-        if not mx_rolling_std.any():
-            vmax[idx] = 0
-            continue
-
-        # import ipdb; ipdb.set_trace()
-        max_variance = pow((mean - max_rolling_var)/mx_rolling_std, 2).values.item()
-        vmax[idx] = max_variance
-        
+                f"\tZero data issue found for {dataset_id} at {str(step)[:7]}")
+        times.append(ftimes)
+        means.append(fmeans)
+        vmax.append(rolling.update(fmeans))
+
+    times = np.concatenate(times)
+    means = np.concatenate(means)
+    vmax = np.concatenate(vmax)
 
     # if the variance is greater then 3x the variance std mark it as an issue
     threshold = 3 * vmax.std() + vmax.mean()
-    for idx, v in enumerate(vmax):
-        if v >= threshold:
-            issues.append(
-                f"\tmax variance issue found for {dataset_id} at {str( ds['time'][idx].item() )[:7]}")
-    return vmax, issues, segment, threshold
-
-def check_sq_variance(dataset_path, dataset_id, variable, pngpath, pbar, debug=False):
-    issues = []
-    client = get_client()
-    num_segments = 10
-    pbar.total = num_segments + 2
-    if pbar.n != 0:
-        pbar.n = 0
-        pbar.last_print_n = 0
-        pbar.update()
-
-    contents = os.listdir(dataset_path)
-    if not contents:
-        raise ValueError(f"Empty dataset directory {dataset_path}")
-    with xr.open_mfdataset(dataset_path + '/*.nc') as ds:
-
-        segments = list(
-            range(0, ds['time'].size, ds['time'].size//num_segments))
-        vmax = np.zeros(ds['time'].size)
-        futures = []
-        
-        if 'time' not in ds.coords:
-            return [], dataset_id
-        
-        dims = list()
-        possible_dims = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']
-        for i in possible_dims:
-            if i in ds.dims:
-                if i == 'sector':
-                    dims.append('basin')
-                else:
-                    dims.append(i)
-        
-        dims = tuple(dims)
-        if 'lat' not in dims and 'lon' not in dims:
-            ds['means'] = ds[variable]
-            # maxrollingstd = client.compute( ds['means'].std ).result()
-            # maxrollingvar = client.compute( ds['means'].mean ).result()
-        else:
-            ds['means'] = client.compute( ds[variable].mean(dim=dims) ).result()
-            # maxrollingstd = ds['means'].std().compute()
-            # maxrollingvar = ds['means'].mean().compute()
-            # maxrollingstd = client.compute( ds['means'].std ).result()
-            # maxrollingvar = client.compute( ds['means'].mean ).result()
-        # import ipdb; ipdb.set_trace()
-        ds['means'] = ds['means'][~np.isnan(ds['means'])]
+    for step in times[vmax >= threshold]:
+        issues.append(
+            f"\tmax variance issue found for {dataset_id} at {str(step)[:7]}")
+    plot_minmaxmean(pngpath, times, means, vmax, dataset_id, units=units, debug=debug)
+    if pbar is not None:
         pbar.update(1)
-           
-        maxrollingvar = client.compute( ds['means'].rolling({'time':120}, min_periods=1).mean() )
-        maxrollingstd = client.compute( ds['means'].rolling({'time':120}, min_periods=1).std() )
-        for idx, seg in enumerate(segments):
-            if idx == num_segments - 1:
-                seg_end = ds['time'].size
-            else:
-                seg_end = segments[idx + 1]
-
-            temp_ds = ds['time'][seg: seg_end]
-            chunk = ds.sel(time=temp_ds)
-            futures.append(
-                client.submit(
-                    run_chunk, 
-                        chunk, 
-                        dataset_id, 
-                        maxrollingvar, 
-                        maxrollingstd, 
-                        (seg, seg_end), 
-                        idx))
-
-        for f in as_completed(futures):
-            pbar.update(1)
-            vx, issues, seg, threshold = f.result()
-            vmax[seg[0]: seg[1]] = vx
-        plot_minmaxmean(pngpath, ds, vmax, dataset_id, debug=debug)
 
     return issues
 
@@ -178,29 +163,23 @@ def plot_global(dataset, variable, pngpath, dataset_id, debug=False):
     plt.savefig(pngpath, dpi=100)
 
 
-def plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug=False):
+def plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug=False, cache_path=None):
 
-    contents = os.listdir(dataset_path)
-    if not contents:
-        raise ValueError(f"Empty dataset directory {dataset_path}")
-    
-    # open the multi-file dataset, combining the files by their coords
-    ds = xr.open_mfdataset(f'{dataset_path}/*.nc', combine='by_coords')
+
+    reductions = dataset_reductions(dataset_path, variable, dataset_id=dataset_id, cache_path=cache_path)
 
     # if the variable doesn't have a time axis, just plot whatever's there
-    if 'time' not in ds[variable].coords and 'time' not in ds[variable].dims:
-        plot_global(ds, variable, pngpath, debug)
+    if reductions['time'] is None:
+        with xr.open_mfdataset(f'{dataset_path}/*.nc', combine='by_coords') as ds:
+            plot_global(ds, variable, pngpath, debug)
         return []
 
-    # find the dimensions to average over
-    possible_dims = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']    
-    dims = tuple(x if x != 'sector' else 'basin' for x in ds.dims if x in possible_dims)
-
-    meanvalues = ds[variable].mean(dims).compute()
-    mpd = meanvalues.to_pandas()
+    # the spatial means come from the reduction store, only files that are new since the last run are read
+    times = reductions['time']
+    meanvalues = reductions['mean']
 
     # compute the seasonal decomposition
-    decomposition = sm.tsa.seasonal_decompose(mpd, model='additive', period=12)
+    decomposition = sm.tsa.seasonal_decompose(meanvalues, model='additive', period=12)
 
     # produce the plot
     fig, axes = plt.subplots(3)
@@ -209,8 +188,8 @@ def plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug=Fals
     fig.set_size_inches(15, 10)
     fig.tight_layout(pad=5.0)
 
-    xtick_positions = [i for i, t in enumerate(ds['time']) if i % (120) == 0]
-    xtick_values = [t.values.item().strftime('%Y') for i, t in enumerate(ds['time']) if i % (120) == 0]
+    xtick_positions = [i for i in range(len(times)) if i % (120) == 0]
+    xtick_values = [times[i][:4] for i in xtick_positions]
     # plt.xticks(xtick_positions, xtick_values)
     plt.setp(axes, xticks=xtick_positions, xticklabels=xtick_values)
     plt.xlabel('year')
@@ -220,32 +199,32 @@ def plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug=Fals
     axes[0].plot(meanvalues)
 
     # second plot is seasonality - mean
-    trend = decomposition.trend[:].to_xarray()
+    trend = decomposition.trend
     axes[1].set_title('trend')
     axes[1].plot(trend)
 
     # thrid plot is the residual
-    resid = decomposition.resid[:].to_xarray()
+    resid = decomposition.resid
     axes[2].set_title('residual')
     axes[2].plot(resid, 'o')
 
     plt.savefig(pngpath, dpi=100)
 
-    rstd = np.std(resid)
-    rmean = np.mean(resid)
+    rstd = np.nanstd(resid)
+    rmean = np.nanmean(resid)
     diff = rstd * 5
     # flag anything thats outside 5x away from the std as a potential issue
-    issues = [f"{variable} - {r.time.values.item().strftime('%Y-%m')}" for r in resid if r > rmean + diff or r < rmean - diff]
+    issues = [f"{variable} - {times[i][:7]}" for i, r in enumerate(resid) if r > rmean + diff or r < rmean - diff]
     return issues
 
 
 
-def verify_dataset(dataset_path, dataset_id, variable, output, debug=False):
+def verify_dataset(dataset_path, dataset_id, variable, output, debug=False, cache_path=None):
 
     issues = list()
     if not os.path.exists(output):
         os.makedirs(output)
 
     pngpath = os.path.join(output, f"{dataset_id}.png")
-    return plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug)
-    # return check_sq_variance(dataset_path, dataset_id, variable, pngpath, pbar, debug)
+    return plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug, cache_path=cache_path)
+    # return check_sq_variance(dataset_path, dataset_id, variable, pngpath, debug=debug, cache_path=cache_path)
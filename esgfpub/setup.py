@@ -3,7 +3,7 @@ Setup for esgfpub
 """
 from setuptools import find_packages, setup
 
-from esgfpub import __version__
+from esgfpub.version import __version__
 
 setup(
     name="esgfpub",
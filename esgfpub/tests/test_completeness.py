@@ -0,0 +1,57 @@
+import pytest
+
+from esgfpub import completeness
+
+
+def test_collapse():
+    assert completeness.collapse([]) == []
+    assert completeness.collapse([5, 1, 2, 3, 7, 8]) == [(1, 3), (5, 5), (7, 8)]
+
+
+@pytest.mark.parametrize('spans, start, end, gaps', [
+    ([], 1850, 1860, [(1850, 1860)]),
+    ([(1850, 1860)], 1850, 1860, []),
+    ([(1850, 1854), (1857, 1860)], 1850, 1860, [(1855, 1856)]),
+    # overlapping and out of order spans, and spans outside the range
+    ([(1855, 1870), (1800, 1852), (1850, 1856)], 1850, 1860, []),
+    ([(1852, 1853), (1840, 1849)], 1850, 1860, [(1850, 1851), (1854, 1860)]),
+])
+def test_find_gaps(spans, start, end, gaps):
+    assert completeness.find_gaps(spans, start, end) == gaps
+
+
+def test_check_submonthly_unregistered_names():
+    names = [f'case.mpaso.hist.am.someOutput.{year:04d}-01-01_00:00.nc' for year in (1850, 1851, 1853)]
+    assert completeness.check_submonthly(names, 1850, 1854) == ['case.mpaso.hist.am.someOutput.1852']
+
+
+def test_check_monthly():
+    names = [f'case.eam.h0.{year:04d}-{month:02d}.nc' for year in range(1850, 1860) for month in range(1, 13)]
+    names = [x for x in names if '.1855-' not in x and not x.endswith('1857-03.nc')] + ['case.eam.h1.1850-01-01.nc']
+    missing, extra = completeness.check_monthly(names, 1850, 1859)
+    assert missing == ['case.eam.h0.1855-01..1855-12.nc', 'case.eam.h0.1857-03.nc']
+    assert extra == ['case.eam.h1.1850-01-01.nc']
+
+
+def test_check_time_series():
+    names = ['TS_185001_189912.nc', 'TS_190001_194912.nc', 'PRECT_185001_187412.nc', 'PRECT_188001_194912.nc', 'FOO_185001_194912.nc']
+    missing, extra = completeness.check_time_series(names, ['TS', 'PRECT', 'U'], 1850, 1949, 'E3SM.case')
+    assert missing == ['E3SM.case-PRECT-1875-1879', 'E3SM.case-U-1850-1949']
+    assert extra == ['FOO_185001_194912.nc']
+
+
+def test_check_monthly_unexpected_names():
+    with pytest.raises(ValueError):
+        completeness.check_monthly(['TS_185001_189912.nc'], 1850, 1899)
+
+
+def test_check_climos():
+    prefix = '20180215.DECKv1b_H1.ne30_oEC.edison'
+    names = [f'{prefix}_{month:02d}_1850{month:02d}_1899{month:02d}_climo.nc' for month in range(1, 13)]
+    names += [f'{prefix}_{season}_1850{first}_1899{last}_climo.nc' for season, first, last in [
+        ('ANN', '01', '12'), ('DJF', '01', '12'), ('MAM', '03', '05'), ('JJA', '06', '08')]]
+    names.remove(f'{prefix}_07_185007_189907_climo.nc')
+    names.append(f'{prefix}_ANN_190001_194912_climo.nc')
+    missing, extra = completeness.check_climos(names, 1850, 1899)
+    assert missing == [f'{prefix}_07_185007_189907_climo.nc', f'{prefix}_SON_185009_189911_climo.nc']
+    assert extra == [f'{prefix}_ANN_190001_194912_climo.nc']
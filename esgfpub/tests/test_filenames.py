@@ -0,0 +1,60 @@
+import pytest
+
+from esgfpub import completeness, filenames
+
+
+def snapshot_names(years, prefix='mpaso.hist.am.highFrequencyOutput'):
+    return [
+        f'/p/user_pub/work/E3SM/1_0/historical/1deg_atm_60-30km_ocean/ocean/native/model-output/5day_snap/ens1/v1/'
+        f'{prefix}.{year:04d}-{month:02d}-{day:02d}_00.00.00.nc'
+        for year in years for month in range(1, 13) for day in (1, 6, 11, 16, 21, 26)
+    ]
+
+
+@pytest.mark.parametrize('name, convention, start, end', [
+    ('tas_Amon_E3SM-1-0_historical_r1i1p1f1_gr_185001-201412.nc', 'cmip6-mon', 1850, 2014),
+    ('tas_Amon_E3SM-1-0_historical_r1i1p1f1_gr_185001-201412-clim.nc', 'cmip6-climo', 1850, 2014),
+    ('pr_day_E3SM-1-0_historical_r1i1p1f1_gr_18500101-18991231.nc', 'cmip6-day', 1850, 1899),
+    ('tas_3hr_E3SM-1-0_historical_r1i1p1f1_gr_185001010300-185101010000.nc', 'cmip6-subdaily', 1850, 1851),
+    ('20180215.DECKv1b_H1.ne30_oEC.edison_ANN_185001_201412_climo.nc', 'e3sm-climo', 1850, 2014),
+    ('TS_185001_201412.nc', 'e3sm-time-series', 1850, 2014),
+    ('TS_cmip6_180x360_aave_185001_201412.nc', 'e3sm-time-series-regridded', 1850, 2014),
+    ('20180215.DECKv1b_H1.ne30_oEC.edison.cam.h0.1850-01.nc', 'e3sm-monthly', 1850, 1850),
+    ('mpaso.hist.am.timeSeriesStatsMonthly.1850-02-01.nc', 'e3sm-daily', 1850, 1850),
+    ('20180215.DECKv1b_H1.ne30_oEC.edison.cam.h3.1850-01-01-00000.nc', 'e3sm-subdaily', 1850, 1850),
+    ('mpaso.hist.am.highFrequencyOutput.1850-01-01_00.00.00.nc', 'e3sm-mpas-snapshot', 1850, 1850),
+])
+def test_conventions(name, convention, start, end):
+    assert filenames.match_name(name)[0] == convention
+    assert filenames.get_start_end(name) == (start, end)
+
+
+def test_unmatched_name():
+    assert filenames.match_name('areacella_fx_E3SM-1-0_historical_r1i1p1f1_gr.nc') == (None, None)
+    with pytest.raises(ValueError):
+        filenames.get_start_end('areacella_fx_E3SM-1-0_historical_r1i1p1f1_gr.nc')
+
+
+def test_parse_listing_5day_snap():
+    spans = filenames.parse_listing(snapshot_names(range(1850, 1855)), filenames.E3SM_MODEL_OUTPUT)
+    assert len(spans) == 5 * 12 * 6
+    assert not spans.unparsed
+    assert set(spans.convention) == {'e3sm-mpas-snapshot'}
+    assert set(spans.prefix) == {'mpaso.hist.am.highFrequencyOutput'}
+    assert (spans.start[0], spans.start_month[0]) == (1850, 1)
+    assert (spans.end[-1], spans.end_month[-1]) == (1854, 12)
+    assert filenames.infer_start_end(snapshot_names(range(1850, 1855))) == (1850, 1854)
+
+
+def test_parse_listing_mixed():
+    names = ['TS_185001_189912.nc', 'TS_cmip6_180x360_aave_185001_189912.nc', '.mapfile']
+    spans = filenames.parse_listing(names)
+    assert spans.convention == ['e3sm-time-series', 'e3sm-time-series-regridded']
+    assert spans.prefix == ['TS', 'TS']
+    assert spans.unparsed == ['.mapfile']
+
+
+def test_check_submonthly_5day_snap():
+    names = snapshot_names([x for x in range(1850, 1860) if x not in (1853, 1854)])
+    assert completeness.check_submonthly(names, 1850, 1860) == ['mpaso.hist.am.highFrequencyOutput.1853..1854']
+    assert completeness.check_submonthly(names) == ['mpaso.hist.am.highFrequencyOutput.1853..1854']
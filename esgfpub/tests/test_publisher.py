@@ -0,0 +1,144 @@
+import os
+import stat
+import threading
+
+import pytest
+
+from esgfpub import publisher
+
+PUBLISHED = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.piControl.r1i1p1f1.Amon.ts.gr'
+NEW_VERSION = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.piControl.r1i1p1f1.Amon.pr.gr'
+UNPUBLISHED = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.piControl.r1i1p1f1.Amon.tas.gr'
+
+
+class FakeResponse(object):
+    status_code = 200
+    url = 'fake'
+
+    def __init__(self, docs, found):
+        self.docs = docs
+        self.found = found
+
+    def json(self):
+        return {'response': {'docs': self.docs, 'numFound': self.found}}
+
+
+class FakeSession(object):
+    """
+    Answers Dataset searches from a list of (master_id, version) documents
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.requests = []
+
+    def get(self, url, params):
+        self.requests.append(params)
+        ids = {v for k, v in params if k == 'master_id'}
+        offset = dict(params)['offset']
+        limit = dict(params)['limit']
+        docs = [{'master_id': x, 'version': v} for x, v in self.docs if x in ids]
+        return FakeResponse(docs[offset: offset + limit], len(docs))
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession([(PUBLISHED, '20190719'), (PUBLISHED, '20190719'), (NEW_VERSION, '20190719')])
+    monkeypatch.setattr(publisher, 'get_session', lambda: session)
+    return session
+
+
+def write_mapfile(path, dataset_id, version):
+    with open(path, 'w') as outstream:
+        outstream.write(f"{dataset_id}#{version} | /p/{dataset_id}/v{version}/x.nc | 10 | checksum=abc\n")
+
+
+def test_datasets_exist_pages_and_splits(session):
+    datasets = {PUBLISHED: '20190719', NEW_VERSION: '20200101', UNPUBLISHED: '20190719'}
+    assert publisher.datasets_exist(datasets, batch_size=2, page_size=1) == {PUBLISHED}
+    # two batches, the first paged through its three documents one at a time
+    assert [dict(x)['offset'] for x in session.requests] == [0, 1, 2, 0]
+    assert [x for k, x in session.requests[0] if k == 'master_id'] == [PUBLISHED, NEW_VERSION]
+    assert publisher.datasets_exist({NEW_VERSION: None}) == {NEW_VERSION}
+    assert publisher.datasets_exist({}) == set()
+
+
+def test_mapfile_version(tmp_path):
+    write_mapfile(tmp_path / 'a.map', PUBLISHED, 'v20190719')
+    assert publisher.mapfile_version(tmp_path / 'a.map') == '20190719'
+    (tmp_path / 'b.map').write_text(f"{PUBLISHED} | /p/x.nc | 10\n")
+    assert publisher.mapfile_version(tmp_path / 'b.map') is None
+
+
+def test_published_dataset_goes_to_maps_err(tmp_path, monkeypatch, session):
+    mapsin, mapsout, mapserr, logs, bin_dir = [tmp_path / x for x in ['in', 'done', 'err', 'logs', 'bin']]
+    for path in [mapsin, mapsout, mapserr, bin_dir]:
+        path.mkdir()
+    # esgpublish is replaced by a script that always succeeds
+    esgpublish = bin_dir / 'esgpublish'
+    esgpublish.write_text('#!/bin/sh\nexit 0\n')
+    esgpublish.chmod(esgpublish.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    for dataset_id, version in [(PUBLISHED, '20190719'), (NEW_VERSION, '20200101'), (UNPUBLISHED, '20190719')]:
+        write_mapfile(mapsin / f'{dataset_id}.map', dataset_id, version)
+
+    published = publisher.publish_maps(
+        sorted(os.listdir(mapsin)), str(mapsin), str(mapsout), str(mapserr), str(logs), workers=2)
+    assert published == 2
+    assert os.listdir(mapserr) == [f'{PUBLISHED}.map']
+    assert sorted(os.listdir(mapsout)) == [f'{NEW_VERSION}.map', f'{UNPUBLISHED}.map']
+    assert os.listdir(mapsin) == []
+
+
+def test_injected_exists_check(tmp_path):
+    mapsin, mapsout, mapserr, logs = [tmp_path / x for x in ['in', 'done', 'err', 'logs']]
+    for path in [mapsin, mapsout, mapserr]:
+        path.mkdir()
+    write_mapfile(mapsin / f'{PUBLISHED}.map', PUBLISHED, '20190719')
+    checked = []
+
+    def exists(datasets):
+        checked.append(datasets)
+        return set(datasets)
+
+    assert publisher.publish_maps(
+        [f'{PUBLISHED}.map'], str(mapsin), str(mapsout), str(mapserr), str(logs), exists=exists) == 0
+    assert checked == [{PUBLISHED: '20190719'}]
+    assert os.listdir(mapserr) == [f'{PUBLISHED}.map']
+
+
+def test_settled_maps_waits_for_writes(tmp_path):
+    sizes, closed = {}, set()
+    with open(tmp_path / 'a.map', 'w') as outstream:
+        outstream.write('partial')
+        outstream.flush()
+        # the first time a file is seen its size cant have settled yet
+        assert publisher.settled_maps(tmp_path, sizes, closed) == []
+        outstream.write(' and more')
+        outstream.flush()
+        assert publisher.settled_maps(tmp_path, sizes, closed) == []
+    assert publisher.settled_maps(tmp_path, sizes, closed) == ['a.map']
+
+    # a file the watcher saw closed is claimed right away, empty files never are
+    (tmp_path / 'b.map').write_text('done')
+    (tmp_path / 'c.map').touch()
+    closed.update(['b.map', 'c.map'])
+    assert publisher.settled_maps(tmp_path, sizes, closed) == ['a.map', 'b.map']
+    assert closed == {'c.map'}
+
+
+@pytest.mark.skipif(publisher.Observer is None, reason="watchdog isnt installed")
+def test_watch_maps_reports_closed_files(tmp_path):
+    wake, closed = threading.Event(), set()
+    observer = publisher.watch_maps(str(tmp_path), wake, closed)
+    try:
+        with open(tmp_path / 'a.map', 'w') as outstream:
+            outstream.write('partial')
+            outstream.flush()
+            assert not wake.wait(timeout=1)
+        assert wake.wait(timeout=5)
+        assert closed == {'a.map'}
+    finally:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+xr = pytest.importorskip('xarray')
+
+from esgfpub import reductions
+
+
+def write_dataset(path, values, lat):
+    times = np.arange(values.shape[0], dtype=float)
+    ds = xr.Dataset(
+        {'ts': (('time', 'lat', 'lon'), values, {'units': 'K'})},
+        coords={'time': ('time', times, {'units': 'days since 1850-01-01'}), 'lat': lat, 'lon': [0.0, 180.0]})
+    ds.to_netcdf(path)
+
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    path = tmp_path / 'v20190719'
+    path.mkdir()
+    lat = np.array([0.0, 60.0])
+    # the equator is 1 and 60 degrees north is 3, so the plain mean is 2 and the weighted mean is 5/3
+    values = np.empty((5, 2, 2))
+    values[:, 0, :] = 1
+    values[:, 1, :] = 3
+    write_dataset(path / 'ts_185001-185003.nc', values[:3], lat)
+    write_dataset(path / 'ts_185004-185005.nc', values[3:], lat)
+    return path
+
+
+def test_reduce_file_weights_only_the_weighted_mean(dataset_dir):
+    reduction = reductions.reduce_file(str(dataset_dir / 'ts_185001-185003.nc'), 'ts', block=2)
+    assert reduction['units'] == 'K'
+    assert len(reduction['time']) == 3
+    np.testing.assert_allclose(reduction['mean'], 2)
+    np.testing.assert_allclose(reduction['weighted_mean'], 5 / 3)
+    np.testing.assert_allclose(reduction['min'], 1)
+    np.testing.assert_allclose(reduction['max'], 3)
+    np.testing.assert_allclose(reduction['std'], 1)
+
+
+def test_store_keeps_every_reduction(dataset_dir, tmp_path):
+    cache_path = str(tmp_path / 'cache' / 'reductions.sqlite')
+    first = reductions.dataset_reductions(str(dataset_dir), 'ts', dataset_id='ts', cache_path=cache_path)
+    store = reductions.ReductionStore(cache_path)
+    stored = store.get_many('ts', 'ts', reductions.dataset_files(str(dataset_dir)))
+    assert store.hits == 2
+    for name in reductions.REDUCTIONS:
+        np.testing.assert_allclose(np.concatenate([x[name] for x in stored]), first[name])
+    np.testing.assert_allclose(first['weighted_mean'], 5 / 3)
+    assert stored[0]['time'] == first['time'][:3]
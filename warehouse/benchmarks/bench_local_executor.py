@@ -0,0 +1,59 @@
+"""
+Measure the job throughput of the local executor.
+
+A number of short job scripts are rendered the same way workflow jobs render
+theirs, with an output path and a cpu request, and are run to completion on
+the local executor. The jobs are submitted one at a time and then again as a
+single job array.
+
+    python benchmarks/bench_local_executor.py -n 200 --cpus 8 --job-workers 2 --cmd "sleep 0.1"
+"""
+import sys
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from warehouse.executor import LocalExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local job executor")
+    parser.add_argument("-n", "--jobs", type=int, default=200, help="number of jobs to run, default is 200")
+    parser.add_argument("--cpus", type=int, help="number of cpus the executor can use, default is all of them")
+    parser.add_argument("--job-workers", type=int, default=1, help="number of cpus each job reserves, default is 1")
+    parser.add_argument("--cmd", type=str, default="true", help="the command each job runs, default is 'true'")
+    args = parser.parse_args()
+
+    executor = LocalExecutor(cpus=args.cpus)
+    with tempfile.TemporaryDirectory() as tmp:
+        scripts = []
+        outputs = []
+        for i in range(args.jobs):
+            script = Path(tmp, f"job-{i}.sh")
+            output = Path(tmp, f"job-{i}.out")
+            executor.render_script(args.cmd, str(script), [("-o", str(output)), ("-N", 1), ("-c", args.job_workers)])
+            scripts.append(script)
+            outputs.append(output)
+
+        start = perf_counter()
+        for script in scripts:
+            executor.sbatch(str(script))
+        executor.wait()
+        single_time = perf_counter() - start
+
+        array_script = Path(tmp, "array.sh")
+        executor.render_array_script(scripts, outputs, str(array_script), [("-N", 1), ("-c", args.job_workers)])
+        start = perf_counter()
+        executor.sbatch(str(array_script))
+        executor.wait()
+        array_time = perf_counter() - start
+
+    print(f"{args.jobs} jobs on {executor.cpus} cpus, {args.job_workers} cpus per job")
+    print(f"submitted one at a time: {single_time:.3f}s ({args.jobs / single_time:,.1f} jobs/s)")
+    print(f"submitted as one array:  {array_time:.3f}s ({args.jobs / array_time:,.1f} jobs/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
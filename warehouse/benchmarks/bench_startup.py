@@ -0,0 +1,75 @@
+"""
+Measure the startup time of the warehouse command line.
+
+Each command is run in a fresh interpreter several times, and the fastest, median
+and slowest wall clock times are reported. "python -m warehouse --help" is always
+measured. A report_missing run is measured too if its arguments are given, they
+should point at a small warehouse so the time is dominated by startup and not by
+the dataset scan, for example:
+
+    python benchmarks/bench_startup.py -r 5 \\
+        --report-missing-args "-w /tmp/warehouse -p /tmp/publication --status-path /tmp/status -d E3SM.1_0.piControl.*"
+
+With --imports the slowest imports made by --help are listed as well.
+"""
+import sys
+import shlex
+import argparse
+import statistics
+import subprocess
+from time import perf_counter
+
+
+def time_command(args, repeats):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    print(f"{name}: min {min(times):.3f}s, median {statistics.median(times):.3f}s, max {max(times):.3f}s over {len(times)} runs")
+
+
+def slowest_imports(count):
+    """
+    Returns the (cumulative microseconds, module) of the slowest imports made by "python -m warehouse --help"
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "warehouse", "--help"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark warehouse startup time")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="number of runs of each command, default is 5")
+    parser.add_argument("--report-missing-args", type=str, help="arguments for an 'auto --report-missing' run to also measure")
+    parser.add_argument("--imports", action="store_true", help="list the slowest imports made during --help")
+    args = parser.parse_args()
+
+    report("warehouse --help", time_command([sys.executable, "-m", "warehouse", "--help"], args.repeats))
+
+    if args.report_missing_args:
+        command = [sys.executable, "-m", "warehouse", "auto", "--report-missing"] + shlex.split(args.report_missing_args)
+        report("warehouse auto --report-missing", time_command(command, args.repeats))
+
+    if args.imports:
+        for cumulative, module in slowest_imports(15):
+            print(f"{cumulative / 1e6:8.3f}s  {module}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Measure how quickly the workflow resolves dataset state transitions.
+
+A set of synthetic state events is built from every state in the compiled
+transition table, paired with a spread of dataset data types, and each one is
+resolved with Workflow.next_state. For comparison the same events are also
+resolved by walking the workflow tree for every event, which is what
+next_state did before the transitions were compiled.
+
+    python benchmarks/bench_transitions.py -n 100000
+"""
+import sys
+import random
+import argparse
+import logging
+from time import perf_counter
+from types import SimpleNamespace
+
+from warehouse.workflows import Workflow
+
+DATA_TYPES = [
+    ("native", "atmos", "model-output", "3hr"),
+    ("native", "atmos", "model-output", "mon"),
+    ("native", "land", "model-output", "mon"),
+    ("native", "ocean", "model-output", "mon"),
+    ("native", "sea-ice", "model-output", "mon"),
+    ("180x360", "atmos", "time-series", "mon"),
+    ("180x360", "atmos", "climo", "mon"),
+    ("gr", "atmos", "cmip", "day"),
+]
+
+
+def make_events(workflow, count, seed=0):
+    rng = random.Random(seed)
+    states = sorted(workflow.transition_table)
+    datasets = [
+        SimpleNamespace(dataset_id=f"bench.{i}", grid=grid, realm=realm, data_type=data_type, freq=freq)
+        for i, (grid, realm, data_type, freq) in enumerate(DATA_TYPES)
+    ]
+    # drop the pairs that would exit because theres no default transition
+    pairs = [
+        (dataset, state)
+        for state in states
+        for dataset in datasets
+        if Workflow.get_data_type(dataset) in workflow.transition_table[state]
+        or "default" in workflow.transition_table[state]
+    ]
+    return [rng.choice(pairs) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark workflow state transition lookups")
+    parser.add_argument("-n", "--events", type=int, default=100_000, help="number of synthetic state events, default is 100000")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    start = perf_counter()
+    workflow = Workflow(slurm_scripts="temp")
+    workflow.load_children()
+    workflow.load_transitions()
+    load_time = perf_counter() - start
+
+    events = make_events(workflow, args.events)
+
+    start = perf_counter()
+    for dataset, state in events:
+        workflow.next_state(dataset, state, {})
+    compiled_time = perf_counter() - start
+
+    start = perf_counter()
+    for dataset, state in events:
+        entry = workflow.compile_state(state)
+        entry.get(Workflow.get_data_type(dataset), entry.get("default"))
+    walk_time = perf_counter() - start
+
+    print(f"loaded and compiled {len(workflow.transition_table)} states in {load_time:.3f}s")
+    print(f"{len(events)} events, compiled table: {compiled_time:.3f}s ({len(events) / compiled_time:,.0f} events/s)")
+    print(f"{len(events)} events, tree walk:      {walk_time:.3f}s ({len(events) / walk_time:,.0f} events/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,7 @@
 """
 Setup for the E3SM warehouse
 """
-from setuptools import find_packages
-from distutils.core import setup
+from setuptools import find_packages, setup
 from warehouse.version import __version__
 
 import distutils.cmd
@@ -44,6 +43,9 @@ setup(
             ['warehouse = warehouse.__main__:main' ]},
     packages=find_packages(),
     package_dir={'warehouse': 'warehouse'},
+    # the file name parsers, completeness checks, dataset reductions and
+    # the copy engine are shared with esgfpub rather than duplicated here
+    install_requires=['esgfpub'],
     include_package_data=True,
     cmdclass={
         'clean': CleanCommand,
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+
+import pytest
+
+import warehouse.resources as resources
+from warehouse import warehouse as auto
+from warehouse.archive_map import ArchiveMap, parse_archive_map_line
+from warehouse.dataset import DatasetStatus
+
+RESOURCE_MAP = os.path.join(os.path.dirname(resources.__file__), 'Archive_Map')
+DATASET_ID = 'E3SM.1_0.piControl.1deg_atm_60-30km_ocean.atmos.native.model-output.mon.ens1'
+
+
+def write_index(archive_path, members):
+    """
+    Write a zstash index.db holding the given (name, size, tar) members
+    """
+    archive_path.mkdir(parents=True)
+    con = sqlite3.connect(archive_path / 'index.db')
+    with con:
+        con.execute(
+            "CREATE TABLE files (id INTEGER PRIMARY KEY, name TEXT, size INTEGER, "
+            "mtime TIMESTAMP, md5 TEXT, tar TEXT, offset INTEGER)")
+        con.executemany(
+            "INSERT INTO files (name, size, mtime, md5, tar, offset) VALUES (?, ?, 0, '', ?, 0)", members)
+    con.close()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive_path = tmp_path / 'archive' / '1_0' / 'piControl'
+    write_index(archive_path, [
+        ('atm/hist/piControl.cam.h0.0001-01.nc', 100, '000000.tar'),
+        ('atm/hist/piControl.cam.h0.0001-02.nc', 200, '000001.tar'),
+        ('atm/hist/piControl.cam.h1.0001-01-01.nc', 400, '000001.tar'),
+        ('ocn/hist/piControl.mpaso.hist.am.timeSeriesStatsMonthly.0001-01-01.nc', 800, '000002.tar'),
+    ])
+    map_path = tmp_path / 'Archive_Map'
+    map_path.write_text(
+        f"DECK-v1,1_0,piControl,1deg_atm_60-30km_ocean,ens1,atm_nat_mon,{archive_path},atm/hist/*cam.h0*.nc,monthly, h0\n"
+        f"DECK-v1,1_0,piControl,1deg_atm_60-30km_ocean,ens1,atm_nat_day,{tmp_path / 'missing'},atm/hist/*cam.h1*.nc,\n")
+    return map_path
+
+
+def test_resource_archive_map_parses():
+    archive_map = ArchiveMap(RESOURCE_MAP)
+    with open(RESOURCE_MAP) as instream:
+        lines = [x for x in instream if x.strip() and not x.startswith('#')]
+    assert sum(len(archive_map.entries(x)) for x in archive_map.dataset_ids()) == len(lines)
+    assert all(x.startswith('E3SM.') and len(x.split('.')) == 9 for x in archive_map.dataset_ids())
+
+    entry = parse_archive_map_line(lines[0])
+    assert entry.dataset_id in archive_map
+    assert entry in archive_map.entries(entry.dataset_id)
+
+
+def test_snapshot_dataset_type():
+    entry = parse_archive_map_line(
+        "BGC-v1,1_1_ECA,hist-BCRC,1deg_atm_60-30km_ocean,ens1,atm_nat_3hr_snap,/archive,atm/hist/*cam.h2*.nc,h2 = 3hr_snap")
+    assert entry.dataset_id == 'E3SM.1_1_ECA.hist-BCRC.1deg_atm_60-30km_ocean.atmos.native.model-output.3hr_snap.ens1'
+    assert entry.notes == 'h2 = 3hr_snap'
+
+
+def test_members_from_index(archive, tmp_path):
+    cache_path = tmp_path / 'cache' / 'archive_cache.sqlite'
+    archive_map = ArchiveMap(archive, cache_path=cache_path)
+    assert archive_map.entries(DATASET_ID)[0].notes == 'monthly, h0'
+    assert archive_map.size(DATASET_ID) == (2, 300)
+    assert [os.path.basename(x) for x in archive_map.tars(DATASET_ID)] == ['000000.tar', '000001.tar']
+    # the daily entry's archive doesnt exist, so it has nothing to extract
+    assert archive_map.size(DATASET_ID.replace('.mon.', '.day.')) == (0, 0)
+
+    # a second run reads the parsed map and the listing from the cache
+    cached = ArchiveMap(archive, cache_path=cache_path)
+    assert cached.size(DATASET_ID) == (2, 300)
+    assert cached.map_cache.hits == 1
+    assert cached.manifest_cache.hits == 1
+
+
+class FakeDataset(object):
+
+    def __init__(self, dataset_id):
+        self.dataset_id = dataset_id
+        self.project = dataset_id.split('.')[0]
+        self.status = DatasetStatus.UNITITIALIZED.value
+        self.missing = None
+
+
+def test_report_missing_reads_the_archive_map(archive, monkeypatch):
+    messages = []
+    monkeypatch.setattr(auto, 'log_message', lambda level, message, *args: messages.append(message))
+    warehouse = auto.AutoWarehouse.__new__(auto.AutoWarehouse)
+    warehouse.archive_map_path = archive
+    warehouse.archive_cache_path = None
+    warehouse.archive_map = None
+    other = DATASET_ID.replace('piControl', 'historical')
+    warehouse.datasets = {x: FakeDataset(x) for x in [DATASET_ID, other]}
+
+    warehouse.print_missing()
+    assert messages == [
+        f"No files in dataset {DATASET_ID}, 2 files (300 bytes) can be extracted from 1 Archive_Map entries",
+        f"No files in dataset {other}, and it isnt in the Archive_Map",
+    ]
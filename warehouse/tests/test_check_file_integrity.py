@@ -0,0 +1,45 @@
+import sys
+
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+from warehouse.scripts import check_file_integrity
+
+DATASET_ID = 'E3SM.1_0.piControl.1deg_atm_60-30km_ocean.atmos.180x360.climo.ens1'
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    caches = tmp_path / 'cache'
+    monkeypatch.setattr(
+        check_file_integrity, 'dataset_cache_path', lambda name, dataset_id: caches / name / f'{dataset_id}.sqlite')
+    return caches
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['check_file_integrity.py', '-p', '1'] + [str(x) for x in args])
+    return check_file_integrity.main()
+
+
+def test_results_are_cached_outside_the_warehouse(tmp_path, monkeypatch, caches):
+    version_dir = tmp_path / 'warehouse' / 'v0'
+    version_dir.mkdir(parents=True)
+    with netCDF4.Dataset(version_dir / 'a.nc', 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createVariable('time', 'f8', ('time',))[:] = [0.0, 1.0]
+
+    assert run(monkeypatch, '--dataset-id', DATASET_ID, version_dir) == 0
+    assert [x.name for x in (tmp_path / 'warehouse').iterdir()] == ['v0']
+    assert (caches / 'integrity' / f'{DATASET_ID}.sqlite').exists()
+
+    # without a dataset id the results are kept under the path of the dataset directory
+    assert run(monkeypatch, version_dir) == 0
+    key = '.'.join((tmp_path / 'warehouse').resolve().parts[1:])
+    assert (caches / 'integrity' / f'{key}.sqlite').exists()
+
+
+def test_broken_file_fails(tmp_path, monkeypatch, caches):
+    (tmp_path / 'v0').mkdir()
+    (tmp_path / 'v0' / 'a.nc').write_bytes(b'not a netCDF file')
+    assert run(monkeypatch, '--dataset-id', DATASET_ID, tmp_path / 'v0') == 1
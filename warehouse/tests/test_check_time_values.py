@@ -0,0 +1,85 @@
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+from warehouse.scripts import check_time_values
+from warehouse.time_catalog import TimeCatalog
+
+
+def write_times(path, times):
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.createDimension('time', None)
+        var = ds.createVariable('time', 'f8', ('time',))
+        var.units = 'days since 0001-01-01'
+        var.calendar = 'noleap'
+        var[:] = times
+
+
+def facts(**kwargs):
+    base = {
+        'path': 'test.nc', 'length': 4, 'first': 0.0, 'last': 3.0, 'step': 1.0,
+        'zero_step': None, 'irregular': [],
+    }
+    base.update(kwargs)
+    return base
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    messages = []
+    monkeypatch.setattr(
+        check_time_values, 'con_message', lambda level, message: messages.append((level, message)))
+    return messages
+
+
+def test_regular_file(warnings):
+    assert check_time_values.check_file(facts(), 1.0, 3) == (0.0, 3.0, 3)
+    assert warnings == []
+
+
+def test_empty_file(warnings):
+    assert check_time_values.check_file(facts(length=0, first=None, last=None), 1.0, 0) == (None, None, 0)
+    assert warnings == []
+
+
+def test_discontinuity_is_reported(warnings):
+    result = check_time_values.check_file(facts(last=4.0, irregular=[[2, 3.0, 2.0]]), 1.0, 0)
+    assert result == (0.0, 4.0, 0)
+    assert len(warnings) == 1
+    assert warnings[0][0] == 'warning'
+    assert 'at 3.0, delta was 2.0' in warnings[0][1]
+
+
+def test_zero_step_itself_isnt_reported(warnings):
+    zero = facts(last=2.0, zero_step=[3, 2.0], irregular=[[3, 2.0, 0.0]])
+    assert check_time_values.check_file(zero, 1.0, 0) == (2.0, 2.0, 0)
+    assert warnings == []
+
+
+def test_only_steps_before_the_zero_step_are_reported(warnings):
+    zero = facts(last=5.0, zero_step=[3, 4.0], irregular=[[2, 3.0, 2.0], [3, 4.0, 0.0], [4, 5.0, 1.0]])
+    check_time_values.check_file(zero, 1.0, 0)
+    assert len(warnings) == 1
+    assert 'at 3.0' in warnings[0][1]
+
+
+def test_check_file_with_catalog_facts(tmp_path, warnings):
+    regular, monthly = str(tmp_path / 'regular.nc'), str(tmp_path / 'monthly.nc')
+    write_times(regular, [0.0, 1.0, 2.0, 4.0])
+    write_times(monthly, [15.0, 31.0, 31.0])
+    catalog = TimeCatalog(tmp_path / 'catalog.sqlite')
+    catalog.load([regular, monthly], workers=1)
+
+    # the second load comes from the catalog rather than the files
+    catalog = TimeCatalog(tmp_path / 'catalog.sqlite')
+    found = catalog.load([regular, monthly], workers=1)
+    assert catalog.cache.hits == 2
+
+    assert check_time_values.check_file(found[regular], 1.0, 0) == (0.0, 4.0, 0)
+    assert len(warnings) == 1
+    assert 'at 4.0, delta was 2.0' in warnings[0][1]
+
+    warnings.clear()
+    # the first step of the monthly file is its frequency, only the zero step follows it
+    assert check_time_values.check_file(found[monthly], 16.0, 1) == (31.0, 31.0, 1)
+    assert warnings == []
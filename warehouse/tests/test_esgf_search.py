@@ -0,0 +1,130 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+import pytest
+
+from warehouse import util
+from warehouse.esgf_cache import ESGFSearchCache
+
+PROJECT = 'E3SM'
+
+
+def master_id(i):
+    return f'E3SM.1_0.piControl.1deg_atm_60-30km_ocean.atmos.180x360.climo.ens{i}'
+
+
+class Index(object):
+    """
+    The Dataset and File documents of a fake ESGF index, and the queries it was sent
+    """
+
+    def __init__(self):
+        self.publish([])
+
+    def publish(self, published):
+        self.datasets = []
+        self.files = []
+        self.requests = []
+        for i in published:
+            # each dataset has a replica on a second data node
+            for node in ['aims3.llnl.gov', 'esgf-data2.llnl.gov']:
+                instance = f'{master_id(i)}.v1|{node}'
+                self.datasets.append({'id': instance, 'master_id': master_id(i), 'number_of_files': 2})
+                self.files.extend({'dataset_id': instance, 'title': f'file{i}_{x}.nc'} for x in range(2))
+
+    def search(self, params):
+        self.requests.append(params)
+        values = {}
+        for key, value in params:
+            values.setdefault(key, []).append(value)
+        if values['type'] == ['Dataset']:
+            docs = [x for x in self.datasets if x['master_id'] in values['master_id']]
+        else:
+            docs = [x for x in self.files if x['dataset_id'] in values['dataset_id']]
+        offset, limit = int(values['offset'][0]), int(values['limit'][0])
+        return {'response': {'numFound': len(docs), 'docs': docs[offset: offset + limit]}}
+
+    def queries(self, kind):
+        return [x for x in self.requests if ('type', kind) in x]
+
+
+@pytest.fixture
+def index():
+    index = Index()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = json.dumps(index.search(parse_qsl(urlparse(self.path).query))).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    index.url = f'http://127.0.0.1:{server.server_address[1]}/esg-search/search/'
+    yield index
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ESGFSearchCache(tmp_path / 'esgf_cache.sqlite')
+    util.set_search_cache(cache)
+    yield cache
+    util.set_search_cache(None)
+
+
+def test_pages_follow_the_offset(index):
+    index.publish(range(3))
+    params = [('type', 'Dataset')] + [('master_id', master_id(i)) for i in range(3)]
+    docs = list(util.search_esgf_pages(index.url, params, page_size=4))
+    assert [x['id'] for x in docs] == [x['id'] for x in index.datasets]
+    assert [dict(x)['offset'] for x in index.requests] == ['0', '4']
+    assert all(dict(x)['limit'] == '4' for x in index.requests)
+
+
+def test_batches_of_more_than_50_ids(index):
+    index.publish(range(0, 120, 2))
+    ids = [master_id(i) for i in range(120)]
+    files = util.search_esgf_batch(PROJECT, ids, index_url=index.url, page_size=30)
+
+    assert sorted(files) == sorted(master_id(i) for i in range(0, 120, 2))
+    # only the first instance of each dataset is used, so replicas dont double the file list
+    assert all(files[master_id(i)] == [f'file{i}_0.nc', f'file{i}_1.nc'] for i in range(0, 120, 2))
+
+    # the first two batches each have 50 dataset instances and 50 files, so both of their searches take two pages
+    assert [dict(x)['offset'] for x in index.queries('Dataset')] == ['0', '30', '0', '30', '0']
+    assert [dict(x)['offset'] for x in index.queries('File')] == ['0', '30', '0', '30', '0']
+    batches = [[v for k, v in x if k == 'master_id'] for x in index.queries('Dataset') if ('offset', '0') in x]
+    assert [len(x) for x in batches] == [50, 50, 20]
+    assert [x for batch in batches for x in batch] == ids
+
+
+def test_empty_results_are_cached(index, cache):
+    index.publish([0])
+    ids = [master_id(0), master_id(1)]
+    assert util.search_esgf_batch(PROJECT, ids, index_url=index.url) == {master_id(0): ['file0_0.nc', 'file0_1.nc']}
+    searched = len(index.requests)
+
+    # the unpublished dataset was cached as having no files, so neither is searched again
+    assert util.search_esgf_batch(PROJECT, ids, index_url=index.url) == {master_id(0): ['file0_0.nc', 'file0_1.nc']}
+    assert len(index.requests) == searched
+    assert cache.hits == 2
+
+    # once the empty result expires the dataset is searched for again, and only it is
+    facets = {'_search': 'files', '_url': index.url, '_project': PROJECT, '_latest': 'true', 'master_id': master_id(1)}
+    assert cache.get(facets) == []
+    cache.put(facets, [], ttl=-1)
+    index.publish([0, 1])
+    assert sorted(util.search_esgf_batch(PROJECT, ids, index_url=index.url)) == ids
+    assert [[v for k, v in x if k == 'master_id'] for x in index.queries('Dataset')] == [[master_id(1)]]
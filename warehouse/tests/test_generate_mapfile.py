@@ -0,0 +1,32 @@
+import hashlib
+import sys
+
+from warehouse import util
+from warehouse.scripts import generate_mapfile
+
+DATASET_ID = 'E3SM.1_0.piControl.1deg_atm_60-30km_ocean.atmos.180x360.climo.ens1'
+
+
+def test_dataset_cache_path():
+    path = util.dataset_cache_path('checksums', DATASET_ID)
+    assert path.name == f'{DATASET_ID}.sqlite'
+    assert path.parent.name == 'checksums'
+
+
+def test_checksum_cache_is_kept_out_of_the_dataset(tmp_path, monkeypatch):
+    version_dir = tmp_path / 'warehouse' / 'v0'
+    version_dir.mkdir(parents=True)
+    (version_dir / 'a.nc').write_bytes(b'a' * 100)
+    outpath = tmp_path / 'warehouse' / f'{DATASET_ID}.map'
+    caches = tmp_path / 'cache'
+    monkeypatch.setattr(
+        generate_mapfile, 'dataset_cache_path', lambda name, dataset_id: caches / name / f'{dataset_id}.sqlite')
+    monkeypatch.setattr(
+        sys, 'argv', ['generate_mapfile.py', str(version_dir), DATASET_ID, '1', '--outpath', str(outpath), '-p', '1', '--quiet'])
+
+    assert generate_mapfile.main() == 0
+    assert sorted(x.name for x in (tmp_path / 'warehouse').iterdir()) == [outpath.name, 'v0']
+    assert (caches / 'checksums' / f'{DATASET_ID}.sqlite').exists()
+    line = outpath.read_text()
+    assert line.startswith(f'{DATASET_ID}#1 | ')
+    assert f"checksum={hashlib.sha256(b'a' * 100).hexdigest()}" in line
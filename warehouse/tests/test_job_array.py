@@ -0,0 +1,181 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from warehouse.job_array import JobArrayBatcher
+from warehouse.slurm import Slurm, QueuePoller
+from warehouse.warehouse import AutoWarehouse
+
+DATASET_ID = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.piControl.r1i1p1f1.Amon.ts.gr'
+
+# sbatch numbers its jobs from 1001 and logs each script it was given, squeue prints the queue file
+SBATCH = """#!/bin/sh
+count=$(wc -l < "{log}")
+echo "$1" >> "{log}"
+echo "Submitted batch job $((1001 + count))"
+"""
+SQUEUE = """#!/bin/sh
+echo "JOBID|NAME|ST|TIME|PARTITION|USER|COMMAND"
+cat "{queue}"
+"""
+
+
+def write_script(path, text):
+    path.write_text(text)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def slurm(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    log, queue = tmp_path / 'sbatch.log', tmp_path / 'queue'
+    log.touch()
+    queue.touch()
+    write_script(bin_dir / 'sbatch', SBATCH.format(log=log))
+    write_script(bin_dir / 'squeue', SQUEUE.format(queue=queue))
+    write_script(bin_dir / 'sinfo', '#!/bin/sh\n')
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('USER', 'e3sm')
+    slurm = Slurm(queue_interval=60)
+    slurm.log, slurm.queue_path = log, queue
+    yield slurm
+    slurm.poller.stop()
+
+
+class FakeJob(object):
+
+    def __init__(self, name, output_path, partition='debug'):
+        self.name = name
+        self.output_path = output_path
+        self.slurm_opts = [('-o', output_path), ('-N', 1), ('--partition', partition)]
+        self.job_id = None
+
+    def submitted(self, job_id):
+        self.job_id = job_id
+
+
+def make_jobs(tmp_path, name, count, **kwargs):
+    jobs = []
+    for i in range(count):
+        script = tmp_path / f'{name}-{i}.sh'
+        script.write_text('#!/bin/bash\n')
+        jobs.append((FakeJob(name, str(tmp_path / f'{name}-{i}.out'), **kwargs), script))
+    return jobs
+
+
+def submitted_scripts(slurm):
+    return slurm.log.read_text().split()
+
+
+def wait_for(predicate, timeout=5):
+    end = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_window_flush(tmp_path, slurm):
+    batcher = JobArrayBatcher(slurm, tmp_path, window=0.2)
+    jobs = make_jobs(tmp_path, 'CheckFileIntegrity', 3)
+    for job, script in jobs:
+        batcher.add(job, script)
+    assert submitted_scripts(slurm) == []
+
+    assert wait_for(lambda: all(job.job_id for job, _ in jobs))
+    assert [job.job_id for job, _ in jobs] == ['1001_0', '1001_1', '1001_2']
+    scripts = submitted_scripts(slurm)
+    assert len(scripts) == 1
+    array_script = open(scripts[0]).read()
+    assert '#SBATCH --array=0-2' in array_script
+    assert '#SBATCH --partition debug' in array_script
+    assert all(str(script) in array_script for _, script in jobs)
+
+
+def test_max_size_split(tmp_path, slurm):
+    batcher = JobArrayBatcher(slurm, tmp_path, window=60, max_size=2)
+    jobs = make_jobs(tmp_path, 'GenerateMapfile', 3)
+    other = make_jobs(tmp_path, 'GenerateMapfile', 1, partition='long')
+    for job, script in jobs + other:
+        batcher.add(job, script)
+
+    # the first two filled an array and were submitted right away
+    assert [job.job_id for job, _ in jobs] == ['1001_0', '1001_1', None]
+    assert len(submitted_scripts(slurm)) == 1
+
+    # the rest are submitted together on exit, one array per set of slurm options
+    batcher.flush()
+    assert jobs[2][0].job_id == '1002_0'
+    assert other[0][0].job_id == '1003_0'
+    assert len(submitted_scripts(slurm)) == 3
+
+
+class FakeDataset(object):
+
+    def __init__(self, latest, second_latest):
+        self.latest_warehouse_dir = None
+        self.statuses = (latest, second_latest)
+
+    def update_from_status_file(self):
+        pass
+
+    def unlock(self, path):
+        pass
+
+    def get_latest_status(self):
+        return self.statuses
+
+
+class FakeScheduler(object):
+
+    def __init__(self):
+        self.done = []
+
+    def finished(self, job):
+        self.done.append(job)
+
+
+def test_status_update_maps_array_task_to_job(tmp_path, slurm):
+    batcher = JobArrayBatcher(slurm, tmp_path, window=60)
+    pairs = make_jobs(tmp_path, 'Validation', 2)
+    for job, script in pairs:
+        batcher.add(job, script)
+    batcher.flush()
+    jobs = [job for job, _ in pairs]
+    assert jobs[1].job_id == '1001_1'
+
+    warehouse = AutoWarehouse.__new__(AutoWarehouse)
+    warehouse.lock = threading.RLock()
+    warehouse.job_pool = list(jobs)
+    warehouse.scheduler = FakeScheduler()
+    warehouse.start_datasets = lambda datasets: None
+    warehouse.datasets = {DATASET_ID: FakeDataset(
+        'STAT:20230101_000001_000000:VALIDATION:Validation:Pass:',
+        f'STAT:20230101_000000_000000:VALIDATION:Validation:Engaged:slurm_id={jobs[1].job_id}')}
+
+    warehouse.status_was_updated('status', dataset_id=DATASET_ID)
+    assert warehouse.job_pool == [jobs[0]]
+    assert warehouse.scheduler.done == [jobs[1]]
+
+
+def test_queue_poller_expands_arrays(slurm):
+    slurm.queue_path.write_text(
+        "1001_[0-2,5%2]|Validation|PD|0:00|debug|e3sm|/scripts/array.sh\n"
+        "1001_3|Validation|R|1:00|debug|e3sm|/scripts/array.sh\n"
+        "1002|Publication|R|2:00|debug|e3sm|/scripts/job.sh\n")
+    poller = QueuePoller(interval=60)
+    poller.refresh()
+    jobs = poller.jobs()
+    poller.stop()
+    assert sorted(jobs) == ['1001_0', '1001_1', '1001_2', '1001_3', '1001_5', '1002']
+    assert jobs['1001_5']['STATE'] == 'PD'
+    assert jobs['1001_3']['STATE'] == 'R'
+    assert jobs['1002']['COMMAND'] == '/scripts/job.sh'
+
+    assert slurm.showjob('1001_1').state == 'PENDING'
+    assert slurm.showjob('1001_3').state == 'RUNNING'
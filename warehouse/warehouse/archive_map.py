@@ -0,0 +1,204 @@
+import os
+import sqlite3
+from fnmatch import fnmatch
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+from warehouse.file_cache import FileCache
+
+# the columns of an Archive_Map line, in order
+ARCHIVE_MAP_FIELDS = [
+    "campaign",
+    "model",
+    "experiment",
+    "resolution",
+    "ensemble",
+    "dataset_type",
+    "archive_path",
+    "pattern",
+    "notes",
+]
+
+REALM_NAMES = {"atm": "atmos", "lnd": "land", "ocn": "ocean"}
+
+
+@dataclass
+class ArchiveMapEntry:
+    campaign: str
+    model: str
+    experiment: str
+    resolution: str
+    ensemble: str
+    dataset_type: str
+    archive_path: str
+    pattern: str
+    notes: str = ""
+
+    @property
+    def dataset_id(self):
+        """
+        The E3SM dataset id the entry extracts, the archive only holds native model-output
+        """
+        realm, grid, freq = self.dataset_type.split("_", 2)
+        if grid == "nat":
+            grid = "native"
+        return ".".join([
+            "E3SM",
+            self.model,
+            self.experiment,
+            self.resolution,
+            REALM_NAMES.get(realm, realm),
+            grid,
+            "model-output",
+            freq,
+            self.ensemble,
+        ])
+
+
+def parse_archive_map_line(line):
+    """
+    Parse a line of the Archive_Map into an ArchiveMapEntry, the notes column may itself contain commas.
+    The fields after the dataset type are left empty if the line is missing them
+    """
+    values = line.strip().split(",", len(ARCHIVE_MAP_FIELDS) - 1)
+    if len(values) < 6:
+        raise ValueError(f"Archive_Map line has too few fields: {line}")
+    values += [""] * (len(ARCHIVE_MAP_FIELDS) - len(values))
+    return ArchiveMapEntry(*values)
+
+
+def read_zstash_index(archive_path):
+    """
+    Read the member listing of a zstash archive straight from its index.db, which is
+    what "zstash ls -l" reports, without running zstash or touching HPSS
+
+    Returns:
+        a list of [name, size, tar] for each member of the archive
+    """
+    index = Path(archive_path, "index.db")
+    con = sqlite3.connect(f"file:{index}?mode=ro", uri=True)
+    try:
+        rows = con.execute("SELECT name, size, tar FROM files").fetchall()
+    finally:
+        con.close()
+    return [list(row) for row in rows]
+
+
+class ArchiveMap(object):
+    """
+    An index of the Archive_Map from dataset id to the archive entries that hold it,
+    together with the member listing of each of the zstash archives.
+
+    With a cache path, both the parsed Archive_Map and the archive listings are kept
+    in a sqlite FileCache and are only redone when the Archive_Map, or an archives
+    index.db, has changed.
+    """
+
+    def __init__(self, path, cache_path=None):
+        """
+        Parameters:
+            path (str): the path to the Archive_Map
+            cache_path (str): the path to the sqlite cache file, if not given nothing is cached between runs
+        """
+        self.path = Path(path)
+        self.map_cache = FileCache(cache_path, table="archive_map") if cache_path else None
+        self.manifest_cache = FileCache(cache_path, table="zstash_manifests") if cache_path else None
+        self._manifests = {}
+        self.index = self.load()
+
+    def load(self):
+        """
+        Returns a dict of dataset id to the list of its ArchiveMapEntry
+        """
+        st = os.stat(self.path)
+        lines = None
+        if self.map_cache is not None:
+            lines = self.map_cache.get(self.path, st)
+        if lines is None:
+            with open(self.path, "r") as instream:
+                lines = [
+                    asdict(parse_archive_map_line(line))
+                    for line in instream
+                    if line.strip() and not line.startswith("#")
+                ]
+            if self.map_cache is not None:
+                self.map_cache.put(self.path, lines, st)
+
+        index = {}
+        for values in lines:
+            entry = ArchiveMapEntry(**values)
+            index.setdefault(entry.dataset_id, []).append(entry)
+        return index
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def dataset_ids(self):
+        return list(self.index.keys())
+
+    def entries(self, dataset_id):
+        """
+        Returns the list of ArchiveMapEntry for the dataset, empty if its not in the archive
+        """
+        return self.index.get(dataset_id, [])
+
+    def manifest(self, archive_path):
+        """
+        Returns the [name, size, tar] member listing of a zstash archive
+        """
+        archive_path = str(archive_path)
+        if (members := self._manifests.get(archive_path)) is not None:
+            return members
+        index = Path(archive_path, "index.db")
+        st = os.stat(index)
+        if self.manifest_cache is not None:
+            members = self.manifest_cache.get(index, st)
+        if members is None:
+            members = read_zstash_index(archive_path)
+            if self.manifest_cache is not None:
+                self.manifest_cache.put(index, members, st)
+        self._manifests[archive_path] = members
+        return members
+
+    def members(self, dataset_id):
+        """
+        Returns the [name, size, tar] of every archive member that an extraction of the dataset
+        would produce, archives that are missing or have no index.db are skipped
+        """
+        found = []
+        for entry in self.entries(dataset_id):
+            if not entry.pattern:
+                continue
+            try:
+                manifest = self.manifest(entry.archive_path)
+            except (OSError, sqlite3.Error):
+                continue
+            found.extend(x for x in manifest if fnmatch(x[0], entry.pattern))
+        return found
+
+    def tars(self, dataset_id):
+        """
+        Returns the sorted paths of the tar files holding the datasets members
+        """
+        tars = set()
+        for entry in self.entries(dataset_id):
+            if not entry.pattern:
+                continue
+            try:
+                manifest = self.manifest(entry.archive_path)
+            except (OSError, sqlite3.Error):
+                continue
+            tars.update(
+                str(Path(entry.archive_path, x[2]))
+                for x in manifest if fnmatch(x[0], entry.pattern))
+        return sorted(tars)
+
+    def size(self, dataset_id):
+        """
+        Returns the number of members and their total size in bytes for the dataset
+        """
+        members = self.members(dataset_id)
+        return len(members), sum(x[1] for x in members)
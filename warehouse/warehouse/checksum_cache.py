@@ -0,0 +1,72 @@
+import hashlib
+
+from esgfpub.sqlite_store import SqliteStore
+from esgfpub.transfer import BLOCK_SIZE
+
+
+def hash_file(filepath, block_size=BLOCK_SIZE):
+    """
+    Returns the SHA256 hex digest of a file, and the path as a string
+    """
+    sha256 = hashlib.sha256()
+    fullpath = str(filepath)
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(fullpath, "rb", buffering=0) as instream:
+        while size := instream.readinto(buffer):
+            sha256.update(view[:size])
+    return sha256.hexdigest(), fullpath
+
+
+def file_key(stat_result):
+    """
+    The identity of a file's contents for caching purposes. Renaming a file within the
+    same filesystem keeps its device, inode, size and mtime, so moving a dataset from
+    the warehouse to the publication directory doesnt invalidate its checksums
+    """
+    return (
+        str(stat_result.st_dev),
+        str(stat_result.st_ino),
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    )
+
+
+class ChecksumCache(SqliteStore):
+    """
+    A persistent sqlite table of file checksums keyed by (device, inode, size, mtime)
+    """
+
+    def __init__(self, path):
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS checksums ("
+            "device TEXT, inode TEXT, size INTEGER, mtime INTEGER, "
+            "checksum TEXT, checksum_type TEXT, "
+            "PRIMARY KEY (device, inode, size, mtime, checksum_type))",
+        )
+
+    def get(self, stat_result, checksum_type="SHA256"):
+        """
+        Returns the cached checksum for a file given its os.stat() result, or None
+        """
+        return self.get_many([stat_result], checksum_type)[0]
+
+    def get_many(self, stat_results, checksum_type="SHA256"):
+        return self.select_many(
+            "SELECT checksum FROM checksums WHERE device = ? AND inode = ? "
+            "AND size = ? AND mtime = ? AND checksum_type = ?",
+            [file_key(stat_result) + (checksum_type,) for stat_result in stat_results],
+        )
+
+    def put(self, stat_result, checksum, checksum_type="SHA256"):
+        self.put_many([(stat_result, checksum)], checksum_type)
+
+    def put_many(self, items, checksum_type="SHA256"):
+        """
+        Store a list of (os.stat() result, checksum) pairs in a single transaction
+        """
+        rows = [file_key(st) + (checksum, checksum_type) for st, checksum in items]
+        self.replace_many(
+            "checksums", ["device", "inode", "size", "mtime", "checksum", "checksum_type"], rows)
+
@@ -1,20 +1,18 @@
 import os
-import re
 import sys
 from enum import Enum
 
 from pathlib import Path
 from datetime import datetime
+from time import perf_counter
 from pytz import UTC
 
-import ipdb
-
 from warehouse.util import (
-    load_file_lines,
+    load_new_file_lines,
     search_esgf,
-    get_last_status_line,
     log_message,
 )
+from esgfpub import completeness, filenames
 
 
 class DatasetStatus(Enum):
@@ -43,15 +41,6 @@ class DatasetStatusMessage(Enum):
 non_binding_status = ["Blocked:", "Unblocked:", "Approved:", "Unapproved:"]
 
 
-SEASONS = [
-    {"name": "ANN", "start": "01", "end": "12"},
-    {"name": "DJF", "start": "01", "end": "12"},
-    {"name": "MAM", "start": "03", "end": "05"},
-    {"name": "JJA", "start": "06", "end": "08"},
-    {"name": "SON", "start": "09", "end": "11"},
-]
-
-
 class Dataset(object):
     def get_status_from_archive(self):
         ...
@@ -95,8 +84,27 @@ class Dataset(object):
         self.stat = stat if stat else {}
         self.comm = comm if comm else []
 
+        # the status file is append-only, so we remember how far into it we've read
+        # and keep the latest two binding messages and an index of the blocking messages
+        # so that lookups dont need to rescan the whole history
+        self._status_offset = 0
+        self._status_inode = None
+        self._latest_statuses = []
+        self._block_index = {}
+        self._last_status_line = None
+        for major, minors in self.stat.items():
+            for minor, messages in minors.items():
+                for timestamp, message in messages:
+                    self.index_status(timestamp, major, minor, message)
+
         self.versions = versions
 
+        # seconds spent in each phase of the last find_status call
+        self.timings = {}
+
+        # path -> (mtime, versions, version dir mtimes), see scan_versions
+        self._version_cache = {}
+
         facets = self.dataset_id.split(".")
         
         if facets[0] == "CMIP6":
@@ -240,7 +248,7 @@ class Dataset(object):
     # Anyone care to explain the logic here? This is fragile!
     def update_from_status_file(self, update=True):
         self.load_dataset_status_file()
-        if latest := get_last_status_line(self.status_path):
+        if latest := self._last_status_line:
             latest = latest.split(":")
             if len(latest) == 5:
                 new_status = ":".join(latest[2:]).strip()
@@ -254,6 +262,49 @@ class Dataset(object):
         else:
             return False
 
+    def scan_versions(self, path):
+        """
+        Returns a list of (name, version number, is non-empty) for each of the version
+        directories under path. The listing is cached and only redone when the mtime of
+        the path, or of one of its version directories, has changed, so repeated lookups
+        cost a handful of stat calls instead of a directory walk
+
+        Directories whose names dont look like "v0.#" or "v#" are skipped
+        """
+        if not path:
+            return []
+        path = str(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            self._version_cache.pop(path, None)
+            return []
+
+        if (cached := self._version_cache.get(path)) is not None and cached[0] == mtime:
+            try:
+                if all(os.stat(x).st_mtime_ns == m for x, m in cached[2]):
+                    return cached[1]
+            except FileNotFoundError:
+                pass
+
+        versions = []
+        stamps = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                try:
+                    number = float(entry.name[1:])
+                except ValueError:
+                    continue
+                with os.scandir(entry.path) as contents:
+                    nonempty = next(contents, None) is not None
+                versions.append((entry.name, number, nonempty))
+                stamps.append((entry.path, entry.stat().st_mtime_ns))
+
+        self._version_cache[path] = (mtime, versions, stamps)
+        return versions
+
     @property
     def latest_warehouse_dir(self):
         if self.warehouse_path is None or (
@@ -271,16 +322,12 @@ class Dataset(object):
         # import ipdb; ipdb.set_trace()
 
         # we assume that the warehouse directory contains only directories named "v0.#" or "v#"
-        try:
-            latest_version = sorted(
-                [
-                    float(str(x.name)[1:])
-                    for x in self.warehouse_path.iterdir()
-                    if x.is_dir() and any(x.iterdir()) and "tmp" not in x.name
-                ]
-            ).pop()
-        except IndexError:
-            latest_version = 0
+        versions = [
+            number
+            for name, number, nonempty in self.scan_versions(self.warehouse_path)
+            if nonempty and "tmp" not in name
+        ]
+        latest_version = max(versions) if versions else 0
 
         if not isinstance(latest_version, int) and latest_version.is_integer():
             latest_version = int(latest_version)
@@ -296,16 +343,8 @@ class Dataset(object):
     @property
     def latest_pub_dir(self):
         # we assume that the publication directory contains only directories named "v0.#" or "v#"
-        try:
-            latest_version = sorted(
-                [
-                    float(str(x.name)[1:])
-                    for x in self.publication_path.iterdir()
-                    if x.is_dir()
-                ]
-            ).pop()
-        except IndexError:
-            latest_version = "0"
+        versions = [number for _, number, _ in self.scan_versions(self.publication_path)]
+        latest_version = max(versions) if versions else "0"
         if not isinstance(latest_version, str) and latest_version.is_integer():
             latest_version = int(latest_version)
         return str(Path(self.publication_path, f"v{latest_version}").resolve())
@@ -316,21 +355,11 @@ class Dataset(object):
         Returns the latest version number in the publication directory. If not version exists
         then it returns 0
         """
-        if not self.publication_path or not self.publication_path.exists():
-            return 0
-
         # we assume that the publication directory contains only directories named "v0.#" or "v#"
-        try:
-            latest_version = sorted(
-                [
-                    float(str(x.name)[1:])
-                    for x in self.publication_path.iterdir()
-                    if x.is_dir()
-                ]
-            ).pop()
-        except IndexError:
+        versions = [number for _, number, _ in self.scan_versions(self.publication_path)]
+        if not versions:
             return 0
-        return int(latest_version)
+        return int(max(versions))
     
     @property
     def warehouse_version(self):
@@ -338,21 +367,11 @@ class Dataset(object):
         Returns the latest version number in the warehouse directory. If not version exists
         then it returns 0
         """
-        if not self.warehouse_path or not self.warehouse_path.exists():
-            return 0
-
         # we assume that the warehouse directory contains only directories named "v0.#" or "v#"
-        try:
-            latest_version = sorted(
-                [
-                    float(str(x.name)[1:])
-                    for x in self.warehouse_path.iterdir()
-                    if x.is_dir()
-                ]
-            ).pop()
-        except IndexError:
+        versions = [number for _, number, _ in self.scan_versions(self.warehouse_path)]
+        if not versions:
             return 0
-        return int(latest_version)
+        return int(max(versions))
 
     @property
     def publication_path(self):
@@ -458,17 +477,15 @@ class Dataset(object):
         return ".".join(facets[4:7])
 
     def get_latest_status(self):
-        latest = "0"
-        latest_val = None
-        second_latest = None
-        for major in self.stat.keys():
-            for minor in self.stat[major].keys():
-                for item in self.stat[major][minor]:
-                    if item[0] >= latest and item[1] not in non_binding_status:
-                        latest = item[0]
-                        second_latest = latest_val
-                        latest_val = f"{major}:{minor}:{item[1]}"
-        return latest_val, second_latest
+        """
+        Returns the latest and second latest binding status messages, as tracked
+        by index_status while the status file is read
+        """
+        latest = self._latest_statuses
+        return (
+            latest[-1][1] if latest else None,
+            latest[-2][1] if len(latest) > 1 else None,
+        )
 
     def check_dataset_is_complete(self, files):
         # TODO: full pass on this to make sure its working for all data types
@@ -491,15 +508,7 @@ class Dataset(object):
         # self.versions[latest_version] = len(files)
 
         if not self.start_year or not self.end_year:
-            if self.project == "CMIP6":
-                self.start_year, self.end_year = self.infer_start_end_cmip(files)
-            else:
-                if self.data_type == "time-series":
-                    self.start_year, self.end_year = self.get_ts_start_end(files[0])
-                elif self.data_type == "climo":
-                    self.start_year, self.end_year = self.infer_start_end_climo(files)
-                else:
-                    self.start_year, self.end_year = self.infer_start_end_e3sm(files)
+            self.start_year, self.end_year = filenames.infer_start_end(files)
 
         if self.data_type == "cmip":
             if "fx" in self.dataset_id:
@@ -529,14 +538,27 @@ class Dataset(object):
         else:
             return True
 
-    def get_esgf_status(self):
+    def get_esgf_status(self, esgf_files=None):
         """
         Check ESGF to see of the dataset has already been published,
         if it exists check that the dataset is complete
+
+        Parameters:
+            esgf_files (list): the published file names for this dataset, as found by
+                a batched search. If given ESGF isnt queried again for this dataset
         """
         # import ipdb; ipdb.set_trace()
         # TODO: fix this at some point
 
+        if esgf_files is not None:
+            if not esgf_files:
+                log_message("info", f"dataset.py get_esgf_status: batched search found no files for {self.dataset_id}")
+                return DatasetStatus.UNITITIALIZED.value
+            if self.check_dataset_is_complete(esgf_files):
+                return DatasetStatus.PUBLISHED.value
+            else:
+                return DatasetStatus.PARTIAL_PUBLISHED.value
+
         if "CMIP6" in self.dataset_id:
             project = "CMIP6"
         else:
@@ -610,16 +632,23 @@ class Dataset(object):
             else:
                 return DatasetStatus.NOT_IN_WAREHOUSE.value
 
-    def find_status(self):
+    def find_status(self, esgf_files=None):
         """
         Lookup the datasets status in ESGF, or on the filesystem
+
+        Parameters:
+            esgf_files (list): the published file names for this dataset from a batched
+                ESGF search, if None then ESGF is searched for this dataset alone
         """
         # import ipdb; ipdb.set_trace()
+        self.timings = {}
 
         # if the dataset is UNITITIALIZED, then we need to build up the status from scratch
         if self.status not in [DatasetStatus.SUCCESS.value, DatasetStatus.IN_PUBLICATION.value]:
             # returns either NOT_PUBLISHED or SUCCESS or PARTIAL_PUBLISHED or UNITITIALIZED
-            self.status = self.get_esgf_status()
+            start = perf_counter()
+            self.status = self.get_esgf_status(esgf_files)
+            self.timings["esgf"] = perf_counter() - start
 
             print(f"ESGF said {self.dataset_id} was in status {self.status}")
 
@@ -633,7 +662,9 @@ class Dataset(object):
             DatasetStatus.UNITITIALIZED.value
         ]:
             # returns IN_PUBLICATION or NOT_IN_PUBLICATION
+            start = perf_counter()
             self.status = self.get_status_from_pub_dir()
+            self.timings["publication"] = perf_counter() - start
 
         if (
             self.status in [
@@ -643,7 +674,9 @@ class Dataset(object):
             and self.project != 'CMIP6'
         ):
             # returns IN_WAREHOUSE or NOT_IN_WAREHOUSE
+            start = perf_counter()
             self.status = self.get_status_from_warehouse()
+            self.timings["warehouse"] = perf_counter() - start
 
         if (
             self.status in [
@@ -660,42 +693,19 @@ class Dataset(object):
         return self.dataset_id, self.status, self.missing
 
     def check_submonthly(self, files):
-
-        missing = list()
-        files = sorted(files)
-
-        first = files[0]
-        pattern = re.compile(r"\d{4}-\d{2}.*nc")
-        if not (idx := pattern.search(first)):
-            log_message("error", f"Unexpected file format: {first}")
+        """
+        Given a list of high frequency files, find the years that dont have any
+        """
+        try:
+            return completeness.check_submonthly(files, self.start_year, self.end_year)
+        except ValueError as e:
+            log_message("error", str(e))
             sys.exit(1)
 
-        prefix = first[: idx.start()]
-        # TODO: Come up with a way of doing this check more
-        # robustly. Its hard because the high-freq files arent consistant
-        # from case to case, using different 'h' codes and different frequencies
-        # for the time being, if there's at least one file per year it'll get marked as correct
-        for year in range(self.start_year, self.end_year):
-            found = None
-            pattern = re.compile(f"{year:04d}" + r"-\d{2}.*.nc")
-            for idx, file in enumerate(files):
-                if pattern.search(file):
-                    found = idx
-                    break
-            if found is not None:
-                files.pop(idx)
-            else:
-                name = f"{prefix}{year:04d}"
-                missing.append(name)
-
-        return missing
-
     def check_time_series(self, files):
-
-        missing = []
-        files = [x.split("/")[-1] for x in sorted(files)]
-        files_found = []
-
+        """
+        Given a list of time-series files, find the years each of the datavars are missing
+        """
         # DEBUG not self.datavasrs
         if not self.datavars:
             log_message(
@@ -704,130 +714,43 @@ class Dataset(object):
             )
             sys.exit(1)
 
-        for var in self.datavars:
-
-            # depending on the mapping file used to regrid the time-series
-            # they may have different names, so we start by finding
-            # all the files for each variable
-            v_files = list()
-            for x in files:
-                idx = -36 if "cmip6_180x360_aave" in x else -17
-                if var in x and x[:idx] == var:
-                    v_files.append(x)
-
-            if not v_files:
-                missing.append(
-                    f"{self.dataset_id}-{var}-{self.start_year:04d}-{self.end_year:04d}"
-                )
-                continue
-
-            v_files = sorted(v_files)
-            v_start, v_end = self.get_ts_start_end(v_files[0])
-            if self.start_year != v_start:
-                missing.append(
-                    f"{self.dataset_id}-{var}-{self.start_year:04d}-{v_start:04d}"
-                )
-
-            prev_end = self.start_year
-            for file in v_files:
-                file_start, file_end = self.get_ts_start_end(file)
-                if file_start == self.start_year:
-                    prev_end = file_end
-                    continue
-                if file_start == prev_end + 1:
-                    prev_end = file_end
-                else:
-                    missing.append(
-                        f"{self.dataset_id}-{var}-{prev_end:04d}-{file_start:04d}"
-                    )
-
-            file_start, file_end = self.get_ts_start_end(files[-1])
-            if file_end != self.end_year:
-                missing.append(
-                    f"{self.dataset_id}-{var}-{file_start:04d}-{self.end_year:04d}"
-                )
-
+        missing, _ = completeness.check_time_series(
+            files, self.datavars, self.start_year, self.end_year, self.dataset_id)
         return missing
 
     def check_monthly(self, files):
         """
         Given a list of monthly files, find any that are missing
         """
-        missing = []
-        files = sorted(files)
-
-        pattern = r"\d{4}-\d{2}.*nc"
         try:
-            idx = re.search(pattern=pattern, string=files[0])
-        except Exception as e:
-            log_message(
-                "error",
-                f"file {files[0]} does not match expected pattern for monthly files",
-            )
-            sys.exit(1)
-
-        if not idx:
-            log_message("error", f"Unexpected file format: {files[0]}")
+            missing, _ = completeness.check_monthly(files, self.start_year, self.end_year)
+        except ValueError as e:
+            log_message("error", str(e))
             sys.exit(1)
-
-        prefix = files[0][: idx.start()]
-        suffix = files[0][idx.start() + 7 :]
-
-        for year in range(self.start_year, self.end_year + 1):
-            for month in range(1, 13):
-                name = f"{prefix}{year:04d}-{month:02d}{suffix}"
-                if name not in files:
-                    missing.append(name)
-
         return missing
 
     def check_climos(self, files):
         """
         Given a list of climo files, find any that are missing
         """
-        missing = []
-
-        pattern = r"_\d{6}_\d{6}_climo.nc"
-        files = sorted(files)
-        idx = re.search(pattern=pattern, string=files[0])
-        if not idx:
-            log_message("error", f"Unexpected file format: {files[0]}")
+        try:
+            missing, _ = completeness.check_climos(files, self.start_year, self.end_year)
+        except ValueError as e:
+            log_message("error", str(e))
             sys.exit(1)
-        prefix = files[0][: idx.start() - 2]
-
-        for month in range(1, 13):
-            name = f"{prefix}{month:02d}_{self.start_year:04d}{month:02d}_{self.end_year:04d}{month:02d}_climo.nc"
-            if name not in files:
-                missing.append(name)
-
-        for season in SEASONS:
-            name = f'{prefix}{season["name"]}_{self.start_year:04d}{season["start"]}_{self.end_year:04d}{season["end"]}_climo.nc'
-            if name not in files:
-                missing.append(name)
-
         return missing
 
     @staticmethod
     def get_file_start_end(filename):
-        if "clim" in filename:
-            return int(filename[-21:-17]), int(filename[-14:-10])
-        elif '_day_' in filename:
-            return int(filename[-20:-16]), int(filename[-11:-7])
-        elif '_3hr_' in filename:
-            return int(filename[-28:-24]), int(filename[-15:-11])
-        else:
-            return int(filename[-16:-12]), int(filename[-9:-5])
+        return filenames.get_start_end(filename, filenames.CMIP6)
 
     @staticmethod
     def get_ts_start_end(filename):
-        p = re.compile(r"_\d{6}_\d{6}.*nc")
-        idx = p.search(filename)
-        if not idx:
-            log_message("error", f"Unexpected file format: {filename}")
+        try:
+            return filenames.get_start_end(filename, filenames.E3SM_TIME_SERIES)
+        except ValueError as e:
+            log_message("error", str(e))
             sys.exit(1)
-        start = int(filename[idx.start() + 1 : idx.start() + 5])
-        end = int(filename[idx.start() + 8 : idx.start() + 12])
-        return start, end
 
     def check_spans(self, files):
         """
@@ -835,8 +758,11 @@ class Dataset(object):
         """
         # import ipdb; ipdb.set_trace()
         missing = []
-        files = sorted(files)
-        file_start, file_end = self.get_file_start_end(files[0])
+        spans = filenames.parse_listing(sorted(files), filenames.CMIP6)
+        if not spans:
+            log_message("error", f"dataset.py: check_spans: no file names with a time span found for {self.dataset_id}")
+            return [self.dataset_id]
+        file_start, file_end = spans.start[0], spans.end[0]
 
         if file_start != self.start_year:
             msg = f"{self.dataset_id}-{self.start_year:04d}-{file_start:04d} -> expected case start doesnt match files start"
@@ -845,8 +771,7 @@ class Dataset(object):
         else:
             prev_end = self.start_year
 
-        for file in files:
-            file_start, file_end = self.get_file_start_end(file)
+        for file_start, file_end in zip(spans.start, spans.end):
             if file_start == self.start_year:
                 prev_end = file_end
                 continue
@@ -855,68 +780,12 @@ class Dataset(object):
                 missing.append(msg)
             prev_end = file_end
 
-        file_start, file_end = self.get_file_start_end(files[-1])
+        file_start, file_end = spans.start[-1], spans.end[-1]
         if file_end != self.end_year:
             msg = f"{self.dataset_id}-{file_end:04d}-{self.end_year:04d} -> expected case end doesnt match files end"
             missing.append(msg)
         return missing
 
-    def infer_start_end_cmip(self, files):
-        """
-        From a list of files with the given naming convention
-        return the start year of the first file and the end year of the
-        last file
-
-        A typical CMIP6 file will have a name like:
-        pbo_Omon_E3SM-1-1-ECA_hist-bgc_r1i1p1f1_gr_185001-185412.nc'
-        """
-        files = sorted(files)
-        first, last = files[0], files[-1]
-        if self.table == '3hr':
-            p = r"\d{12}-\d{12}"
-            end_offset = (13, 17)
-        elif self.table  == 'day':
-            p = r"\d{8}-\d{8}"
-            end_offset = (9, 13)
-        else:
-            p = r"\d{6}-\d{6}"
-            end_offset = (7, 11)
-        idx = re.search(pattern=p, string=first)
-        if not idx:
-            return None, None
-        start = int(first[idx.start() : idx.start() + 4])
-        idx = re.search(pattern=p, string=last)
-        end = int(last[idx.start() + end_offset[0] : idx.start() + end_offset[1]])
-        return start, end
-
-    def infer_start_end_e3sm(self, files):
-        """
-        From a list of files with the given naming convention
-        return the start year of the first file and the end year of the
-        last file
-        """
-        f = sorted(files)
-        p = r"\.\d{4}-\d{2}"
-        idx = re.search(pattern=p, string=f[0])
-        if not idx:
-            return None, None
-        start = int(f[0][idx.start() + 1 : idx.start() + 5])
-        idx = re.search(pattern=p, string=f[-1])
-        end = int(f[-1][idx.start() + 1 : idx.start() + 5])
-        return start, end
-
-    @staticmethod
-    def infer_start_end_climo(files):
-        f = sorted(files)
-        p = r"_\d{6}_\d{6}_"
-        idx = re.search(pattern=p, string=f[0])
-        start = int(f[0][idx.start() + 1 : idx.start() + 5])
-
-        idx = re.search(pattern=p, string=f[-1])
-        end = int(f[-1][idx.start() + 8 : idx.start() + 12])
-
-        return start, end
-
     def is_blocked(self, state):
         if not self.status_path or not self.status_path.exists():
             log_message("error", f"Status file for {self.dataset_id} cannot be found")
@@ -927,20 +796,13 @@ class Dataset(object):
 
         status_attrs = state.split(":")
         blocked = False
-        if status_attrs[0] in self.stat["WAREHOUSE"].keys():
-            state_messages = sorted(self.stat["WAREHOUSE"][status_attrs[0]])
-            for ts, message in state_messages:
-                if "Blocked" not in message and "Unblocked" not in message:
-                    continue
-                message_items = message.split(":")
-                if len(message_items) < 2:
-                    continue
-                if message_items[0] not in state:
-                    continue
-                if "Blocked" in message_items[1]:
-                    blocked = True
-                elif "Unblocked" in message_items[1]:
-                    blocked = False
+        latest = None
+        for name, (timestamp, is_blocked) in self._block_index.get(status_attrs[0], {}).items():
+            if name not in state:
+                continue
+            if latest is None or timestamp >= latest:
+                latest = timestamp
+                blocked = is_blocked
         return blocked
 
     def __str__(self):
@@ -955,18 +817,30 @@ comm: {self.comm}"""
         read status file, convert lines "STAT:ts:PROCESS:status1:status2:..."
         into dictionary, key = STAT, rows are tuples (ts,'PROCESS:status1:status2:...')
         and for comments, key = COMM, rows are comment lines
-        """
-        self.comm = list()
 
+        Only the lines appended since the last call are parsed, if the file
+        has been replaced or truncated its re-read from the beginning
+        """
         if path is None:
             path = self.status_path
 
         if not path.exists():
             return dict()
+        file_stat = path.stat()
+        if self._status_inode is not None and (
+            path != self.status_path
+            or file_stat.st_ino != self._status_inode
+            or file_stat.st_size < self._status_offset
+        ):
+            self.reset_status_index()
+        self._status_inode = file_stat.st_ino
         self.status_path = path
 
-        statbody = load_file_lines(path.resolve())
+        statbody, self._status_offset = load_new_file_lines(
+            path.resolve(), self._status_offset)
         for line in statbody:
+            if "STAT" in line:
+                self._last_status_line = line
             line_info = line.split(":")
             # forge tuple (timestamp,residual_string), add to STAT list
             if line_info[0] == "STAT":
@@ -978,13 +852,51 @@ comm: {self.comm}"""
                     self.stat[major] = {}
                 if minor not in self.stat[major]:
                     self.stat[major][minor] = []
-                # if len(line_info) == 5:
-                #     message = (timestamp, ":".join(line_info[3:]))
-                # elif len(line_info) > 5:
                 message = (timestamp, ":".join(line_info[4:]))
-                # make sure not to load duplicate messages
-                if message not in self.stat[major][minor]:
-                    self.stat[major][minor].append(message)
+                self.stat[major][minor].append(message)
+                self.index_status(timestamp, major, minor, message[1])
             else:
                 self.comm.append(line)
         return
+
+    def reset_status_index(self):
+        self.stat = {}
+        self.comm = []
+        self._status_offset = 0
+        self._latest_statuses = []
+        self._block_index = {}
+        self._last_status_line = None
+
+    def index_status(self, timestamp, major, minor, message):
+        """
+        Record a single STAT message in the latest statuses and the blocked index
+        """
+        if message not in non_binding_status:
+            # the two latest (timestamp, status) entries, oldest first. Of two messages
+            # with the same timestamp, the one read last is taken as the later
+            latest = self._latest_statuses
+            entry = (timestamp, f"{major}:{minor}:{message}")
+            if not latest or timestamp >= latest[-1][0]:
+                latest.append(entry)
+            elif len(latest) == 1 or timestamp >= latest[0][0]:
+                latest.insert(-1, entry)
+            if len(latest) > 2:
+                latest.pop(0)
+
+        if major != "WAREHOUSE":
+            return
+        if "Blocked" not in message and "Unblocked" not in message:
+            return
+        message_items = message.split(":")
+        if len(message_items) < 2:
+            return
+        if "Blocked" in message_items[1]:
+            is_blocked = True
+        elif "Unblocked" in message_items[1]:
+            is_blocked = False
+        else:
+            return
+        blocks = self._block_index.setdefault(minor, {})
+        previous = blocks.get(message_items[0])
+        if previous is None or timestamp >= previous[0]:
+            blocks[message_items[0]] = (timestamp, is_blocked)
@@ -0,0 +1,97 @@
+import json
+import time
+import hashlib
+
+from esgfpub.sqlite_store import SqliteStore
+from warehouse.util import log_message
+
+# published datasets very rarely change, but a dataset that wasnt found
+# may be published at any time, so empty results are kept for much less time
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_EMPTY_TTL = 60 * 60
+
+
+class ESGFSearchCache(SqliteStore):
+    """
+    An on-disk cache of ESGF search results, stored in sqlite so that it can be
+    shared between warehouse runs and between the processes of a single run.
+    Entries are keyed by a hash of the normalized search facets and each has its own expiration time.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, empty_ttl=DEFAULT_EMPTY_TTL):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS search ("
+            "key TEXT PRIMARY KEY, facets TEXT, value TEXT, expires REAL)"
+        )
+
+    @staticmethod
+    def make_key(facets):
+        """
+        Normalize a set of search facets into a stable key, the order of the facets
+        and the type of their values (e.g. True vs "true") shouldnt matter
+        """
+        normalized = {
+            str(k): sorted(str(x) for x in v) if isinstance(v, (list, tuple, set)) else str(v)
+            for k, v in facets.items()
+        }
+        normalized = json.dumps(normalized, sort_keys=True)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest(), normalized
+
+    def get(self, facets):
+        """
+        Returns the cached value for the facets, or None if there isnt an unexpired entry
+        """
+        return self.get_many([facets])[0]
+
+    def get_many(self, facets_list):
+        """
+        Look up several searches with a single connection, returns a list with
+        the cached value, or None, for each of the given facets
+        """
+        now = time.time()
+        return self.select_many(
+            "SELECT value, expires FROM search WHERE key = ?",
+            [(self.make_key(facets)[0],) for facets in facets_list],
+            convert=lambda row: json.loads(row[0]),
+            valid=lambda row: row[1] >= now,
+        )
+
+    def put(self, facets, value, ttl=None):
+        """
+        Store a search result, if no ttl is given empty results use
+        the empty_ttl and everything else uses the default ttl
+        """
+        self.put_many([(facets, value)], ttl)
+
+    def put_many(self, items, ttl=None):
+        """
+        Store a list of (facets, value) search results in a single transaction
+        """
+        now = time.time()
+        rows = []
+        for facets, value in items:
+            key, normalized = self.make_key(facets)
+            if ttl is not None:
+                expires = now + ttl
+            else:
+                expires = now + (self.ttl if value else self.empty_ttl)
+            rows.append((key, normalized, json.dumps(value), expires))
+        self.replace_many("search", ["key", "facets", "value", "expires"], rows)
+
+    def invalidate(self, facets=None):
+        """
+        Remove the entry for the given facets, or every entry if no facets are given
+        """
+        with self.connect() as con:
+            if facets is None:
+                con.execute("DELETE FROM search")
+            else:
+                key, _ = self.make_key(facets)
+                con.execute("DELETE FROM search WHERE key = ?", (key,))
+
+    def report(self):
+        log_message(
+            "info", f"ESGF search cache {self.path}: {self.hits} hits, {self.misses} misses")
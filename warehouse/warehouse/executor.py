@@ -0,0 +1,243 @@
+import os
+import re
+import shlex
+import stat
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from itertools import count
+from subprocess import Popen, STDOUT, DEVNULL
+
+from warehouse.util import log_message
+
+EXECUTORS = ["slurm", "local"]
+
+
+class Executor(ABC):
+    """
+    The interface the warehouse uses to run rendered job scripts.
+    Job scripts are bash scripts with their resource requests given as
+    "#SBATCH" lines, so they can be run by any of the executors.
+    """
+
+    def render_script(self, cmd, script_path, slurm_opts=[], **kwargs):
+        """
+        Write out an executable bash script
+        Parameters:
+            cmd (string) : a bash command to run
+            script_path (string) : the path to where to store the sbatch script
+            slurm_opts List[(str, str)] : a list of slurm argument key value pairs
+        """
+
+        with open(script_path, "w") as outstream:
+            outstream.write("#!/bin/bash\n\n")
+            for key, val in slurm_opts:
+                outstream.write(f"#SBATCH {key} {val}\n")
+            outstream.write(cmd + "\n")
+        st = os.stat(script_path)
+        os.chmod(script_path, st.st_mode | stat.S_IEXEC)
+
+    def render_array_script(self, scripts, outputs, script_path, slurm_opts=[]):
+        """
+        Write out a job array script that runs one of the given scripts for each
+        task in the array, with the task's output going to its own file
+
+        Parameters:
+            scripts List[str] : paths to the scripts to run, one per array task
+            outputs List[str] : paths to the output file for each of the scripts
+            script_path (string) : the path to where to store the array script
+            slurm_opts List[(str, str)] : a list of slurm argument key value pairs shared by every task
+        """
+        with open(script_path, "w") as outstream:
+            outstream.write("#!/bin/bash\n\n")
+            for key, val in slurm_opts:
+                outstream.write(f"#SBATCH {key} {val}\n")
+            # each task redirects its own output below
+            outstream.write("#SBATCH -o /dev/null\n")
+            outstream.write(f"#SBATCH --array=0-{len(scripts) - 1}\n\n")
+            outstream.write("scripts=(\n")
+            for path in scripts:
+                outstream.write(f"    {shlex.quote(str(path))}\n")
+            outstream.write(")\noutputs=(\n")
+            for path in outputs:
+                outstream.write(f"    {shlex.quote(str(path))}\n")
+            outstream.write(")\n\n")
+            outstream.write('exec > "${outputs[$SLURM_ARRAY_TASK_ID]}" 2>&1\n')
+            outstream.write('bash "${scripts[$SLURM_ARRAY_TASK_ID]}"\n')
+        st = os.stat(script_path)
+        os.chmod(script_path, st.st_mode | stat.S_IEXEC)
+
+    @abstractmethod
+    def sbatch(self, cmd, sbatch_args=None):
+        """
+        Submit a rendered script to be run
+
+        Parameters:
+            cmd (str): The path to the run script that should be submitted
+            sbatch_args (str): The additional arguments to pass to the executor
+        Returns:
+            job id of the new job, or 0 if the submission failed
+        """
+
+    @abstractmethod
+    def queue(self, newer_than=None):
+        """
+        Returns: list of dicts with the JOBID, NAME, STATE and COMMAND of the submitted jobs that havent finished
+        """
+
+    @abstractmethod
+    def cancel(self, job_id):
+        """
+        Stop a submitted job, whether its still waiting or already running
+        """
+
+
+class LocalExecutor(Executor):
+    """
+    Runs job scripts as subprocesses on the current node instead of submitting
+    them to a scheduler.
+
+    Each job reserves the number of cpus given by the "#SBATCH -c" line of its script
+    (the jobs job_workers), and jobs are started in submission order whenever
+    enough of the executors cpus are free. Job output goes to the "#SBATCH -o" path
+    of the script, the same .out file slurm would have written, and job array
+    scripts are run once per task with SLURM_ARRAY_TASK_ID set.
+    """
+
+    def __init__(self, cpus=None):
+        """
+        Parameters:
+            cpus (int): the number of cpus jobs can reserve, default is all of the cpus on the node
+        """
+        self.cpus = cpus or len(os.sched_getaffinity(0))
+        self._free = self.cpus
+        self._ids = count(1)
+        self._pending = deque()
+        self._running = {}
+        self._cond = threading.Condition()
+        self._dispatcher = None
+
+    @staticmethod
+    def read_options(script_path):
+        """
+        Returns the "#SBATCH" options of a script as a dict
+        """
+        options = {}
+        with open(script_path, "r") as instream:
+            for line in instream:
+                if not line.startswith("#SBATCH"):
+                    continue
+                option = line[len("#SBATCH"):].strip()
+                key, _, val = option.replace("=", " ", 1).partition(" ")
+                options[key] = val.strip()
+        return options
+
+    def sbatch(self, cmd, sbatch_args=None):
+        options = self.read_options(cmd)
+        cpus = min(int(options.get("-c", 1)), self.cpus)
+        output = options.get("-o", os.devnull)
+
+        job_id = next(self._ids)
+        tasks = [(str(job_id), {})]
+        if array := options.get("--array"):
+            match = re.fullmatch(r"(\d+)-(\d+)", array.split("%")[0])
+            if match is None:
+                log_message("error", f"Unsupported job array specification {array} in {cmd}")
+                return 0
+            first, last = map(int, match.groups())
+            tasks = [
+                (f"{job_id}_{i}", {"SLURM_ARRAY_JOB_ID": str(job_id), "SLURM_ARRAY_TASK_ID": str(i)})
+                for i in range(first, last + 1)
+            ]
+
+        with self._cond:
+            for task_id, env in tasks:
+                env = dict(os.environ, SLURM_JOB_ID=task_id, SLURM_CPUS_PER_TASK=str(cpus), **env)
+                self._pending.append((task_id, str(cmd), output, cpus, env))
+            self._start_dispatcher()
+            self._cond.notify_all()
+        return job_id
+
+    def _start_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        """
+        Start pending jobs, in order, as cpus become free
+        """
+        while True:
+            with self._cond:
+                while not self._pending or self._pending[0][3] > self._free:
+                    self._cond.wait()
+                task_id, script, output, cpus, env = self._pending.popleft()
+                self._free -= cpus
+                try:
+                    with open(output, "w") as outstream:
+                        proc = Popen(["bash", script], stdout=outstream, stderr=STDOUT, stdin=DEVNULL, env=env)
+                except OSError as e:
+                    log_message("error", f"Unable to start local job {task_id} for {script}: {e}")
+                    self._free += cpus
+                    continue
+                self._running[task_id] = (proc, script, cpus)
+            threading.Thread(target=self._wait, args=(task_id, proc, cpus), daemon=True).start()
+
+    def _wait(self, task_id, proc, cpus):
+        returncode = proc.wait()
+        if returncode != 0:
+            log_message("debug", f"Local job {task_id} exited with code {returncode}")
+        with self._cond:
+            self._running.pop(task_id, None)
+            self._free += cpus
+            self._cond.notify_all()
+
+    def queue(self, newer_than=None):
+        with self._cond:
+            jobs = [
+                {"JOBID": task_id, "NAME": os.path.basename(script), "STATE": "PD", "COMMAND": script}
+                for task_id, script, *_ in self._pending
+            ]
+            jobs.extend(
+                {"JOBID": task_id, "NAME": os.path.basename(script), "STATE": "R", "COMMAND": script}
+                for task_id, (_, script, _) in self._running.items()
+            )
+        return jobs
+
+    def cancel(self, job_id):
+        job_id = str(job_id)
+        with self._cond:
+            self._pending = deque(
+                job for job in self._pending
+                if job[0] != job_id and not job[0].startswith(f"{job_id}_"))
+            running = [
+                proc for task_id, (proc, *_) in self._running.items()
+                if task_id == job_id or task_id.startswith(f"{job_id}_")]
+        for proc in running:
+            proc.terminate()
+        return True
+
+    def wait(self):
+        """
+        Block until every submitted job has finished
+        """
+        with self._cond:
+            while self._pending or self._running:
+                self._cond.wait()
+
+
+def get_executor(name="slurm", **kwargs):
+    """
+    Create the executor used to run job scripts
+
+    Parameters:
+        name (str): one of EXECUTORS
+        queue_interval (float): the slurm executors squeue snapshot interval
+        cpus (int): the number of cpus the local executor can use
+    """
+    if name == "slurm":
+        from warehouse.slurm import Slurm
+        return Slurm(queue_interval=kwargs.get("queue_interval", 10))
+    elif name == "local":
+        return LocalExecutor(cpus=kwargs.get("cpus"))
+    raise ValueError(f"{name} is not a known executor, it should be one of {', '.join(EXECUTORS)}")
@@ -0,0 +1,70 @@
+import os
+import json
+
+from esgfpub.sqlite_store import SqliteStore
+
+
+class FileCache(SqliteStore):
+    """
+    A persistent sqlite table of per-file results keyed by (path, size, mtime). If a file
+    has been modified since its result was stored the lookup is a miss, so callers only
+    need to redo the work for new or changed files
+    """
+
+    def __init__(self, path, table="files"):
+        if not table.isidentifier():
+            raise ValueError(f"{table} is not a valid cache table name")
+        self.table = table
+        super().__init__(
+            path,
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, value TEXT)",
+        )
+
+    def get(self, filepath, stat_result=None):
+        """
+        Returns the stored value for the file, or None if there isnt one or the file has changed
+        """
+        return self.get_many([(filepath, stat_result)])[0]
+
+    def get_many(self, items):
+        """
+        Parameters:
+            items (list): (path, os.stat() result) pairs, if the stat result is None the file is stat'd here
+        Returns:
+            a list of the stored value, or None, for each item
+        """
+        params = []
+        for filepath, stat_result in items:
+            if stat_result is None:
+                stat_result = os.stat(filepath)
+            params.append((str(filepath), stat_result.st_size, stat_result.st_mtime_ns))
+        return self.select_many(
+            f"SELECT value FROM {self.table} WHERE path = ? AND size = ? AND mtime = ?",
+            params,
+            lambda row: json.loads(row[0]),
+        )
+
+    def put(self, filepath, value, stat_result=None):
+        self.put_many([(filepath, stat_result, value)])
+
+    def put_many(self, items):
+        """
+        Store a list of (path, os.stat() result, value) entries in a single transaction,
+        the value must be json serializable
+        """
+        rows = []
+        for filepath, stat_result, value in items:
+            if stat_result is None:
+                stat_result = os.stat(filepath)
+            rows.append(
+                (str(filepath), stat_result.st_size, stat_result.st_mtime_ns, json.dumps(value)))
+        self.replace_many(self.table, ["path", "size", "mtime", "value"], rows)
+
+    def items(self):
+        """
+        Returns a dict of path -> (size, mtime, value) for every stored file
+        """
+        with self.connect() as con:
+            rows = con.execute(f"SELECT path, size, mtime, value FROM {self.table}").fetchall()
+        return {row[0]: (row[1], row[2], json.loads(row[3])) for row in rows}
@@ -0,0 +1,119 @@
+import threading
+from pathlib import Path
+from datetime import datetime
+
+from warehouse.util import log_message
+
+
+class JobArrayBatcher(object):
+    """
+    Collects rendered workflow jobs of the same type and submits them to the executor
+    together as a single job array.
+
+    Jobs are grouped by their job name and slurm options (other than their output path),
+    a group is submitted once its been collecting jobs for `window` seconds or once it
+    reaches `max_size` jobs. Each array task runs the jobs own run script, so the status
+    file epilogue of the script is what reports the tasks Pass/Fail, and each job is
+    given the slurm id "ARRAYID_TASKID" of its task.
+
+    Groups that fill up are submitted from the thread that added the last job, and the rest
+    from their timer's thread, so every submission holds `lock` while it records the jobs
+    as submitted. Pass the lock the warehouse holds while it changes dataset states, so the
+    timer never updates a dataset at the same time as the status file listener.
+    """
+
+    def __init__(self, executor, script_path, window=5.0, max_size=1000, lock=None):
+        """
+        Parameters:
+            executor (Executor): the executor used to render and submit the array scripts
+            script_path (str): the directory to write the array scripts into
+            window (float): the number of seconds to collect jobs before submitting them
+            max_size (int): the largest number of tasks to put in a single array
+            lock (RLock): held while a group is submitted, a new one is made if its not given
+        """
+        self.executor = executor
+        self.script_path = Path(script_path)
+        self.window = window
+        self.max_size = max_size
+        self._groups = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self.lock = lock if lock is not None else threading.RLock()
+
+    @staticmethod
+    def group_key(job):
+        options = tuple((key, str(value)) for key, value in job.slurm_opts if key != "-o")
+        return job.name, options
+
+    def add(self, job, script_path):
+        """
+        Queue a job whose run script has already been rendered
+
+        Parameters:
+            job (WorkflowJob): the job to submit
+            script_path (Path): the path to the jobs run script
+        """
+        key = self.group_key(job)
+        full = None
+        with self._lock:
+            group = self._groups.setdefault(key, [])
+            group.append((job, script_path))
+            if len(group) >= self.max_size:
+                full = self._pop(key)
+            elif key not in self._timers:
+                timer = threading.Timer(self.window, self.flush, args=(key,))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+        if full:
+            self.submit(key, full)
+
+    def flush(self, key=None):
+        """
+        Submit the jobs collected so far, for a single group or for every group if no key is given
+        """
+        with self._lock:
+            keys = [key] if key is not None else list(self._groups.keys())
+            groups = [(k, self._pop(k)) for k in keys]
+        for k, group in groups:
+            if group:
+                self.submit(k, group)
+
+    def _pop(self, key):
+        if (timer := self._timers.pop(key, None)) is not None:
+            timer.cancel()
+        return self._groups.pop(key, [])
+
+    def submit(self, key, group):
+        """
+        Render and submit the array script for a group of jobs, and record the
+        array task id for each job
+
+        Parameters:
+            key (tuple): the group key, the job name and the shared slurm options
+            group List[(WorkflowJob, Path)]: the jobs and their run scripts
+        Returns:
+            The slurm id of the job array, or 0 if the submission failed
+        """
+        with self.lock:
+            return self._submit(key, group)
+
+    def _submit(self, key, group):
+        name, options = key
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        array_script = Path(self.script_path, f"{name}-array-{timestamp}.sh")
+        self.executor.render_array_script(
+            [script for _, script in group],
+            [job.output_path for job, _ in group],
+            str(array_script),
+            list(options))
+
+        array_id = self.executor.sbatch(str(array_script))
+        if not array_id:
+            log_message("error", f"Unable to submit job array {array_script} for {len(group)} {name} jobs")
+        else:
+            log_message("info", f"Submitted {len(group)} {name} jobs as job array {array_id}")
+
+        for idx, (job, _) in enumerate(group):
+            job.submitted(f"{array_id}_{idx}" if array_id else 0)
+        return array_id
@@ -1,45 +1,122 @@
-from time import sleep
+import os
+from queue import Queue
+from threading import Condition, Thread
+from time import monotonic
 from watchdog.observers import Observer
-from watchdog.events import RegexMatchingEventHandler
+from watchdog.events import FileSystemEventHandler
 from warehouse.util import setup_logging, log_message
 
 
 class Listener(object):
-    def __init__(self, warehouse, file_path, **kwargs):
+    """
+    A single filesystem observer for the status directory. Events for registered
+    status files are debounced, so a burst of appends turns into a single update,
+    and then handed to a bounded queue of worker threads which call back into the warehouse
+    """
+
+    def __init__(self, warehouse, file_path, debounce=0.5, workers=1, queue_size=1024, **kwargs):
         super().__init__(**kwargs)
         self.warehouse = warehouse
         self.file_path = file_path
         self.observer = None
+        self.debounce = debounce
+        self.num_workers = workers
+
+        # status file path -> dataset_id
+        self.status_files = {}
 
-        patterns = str(self.file_path)
-        ignore_patterns = ""
-        ignore_directories = True
-        case_sensitive = True
-        self.my_event_handler = RegexMatchingEventHandler(
-            patterns, ignore_patterns, ignore_directories, case_sensitive
-        )
+        # status file path -> time at which its pending event should be dispatched
+        self._pending = {}
+        self._condition = Condition()
+        self._queue = Queue(maxsize=queue_size)
+        self._threads = []
+        self._running = False
 
+        self.my_event_handler = FileSystemEventHandler()
         self.my_event_handler.on_created = self.on_created
         self.my_event_handler.on_modified = self.on_modified
         setup_logging("debug", f"listener.log")
 
+    def add_path(self, path, dataset_id):
+        """
+        Register a status file so that changes to it are routed to its dataset
+        """
+        self.status_files[os.path.abspath(path)] = dataset_id
+
     def start(self):
         # log_message("info", "Starting up filesystem listener")
+        self._running = True
+        self._threads = [Thread(target=self.dispatch, daemon=True)]
+        self._threads.extend(
+            [Thread(target=self.work, daemon=True) for _ in range(self.num_workers)])
+        for thread in self._threads:
+            thread.start()
+
         self.observer = Observer()
-        self.observer.schedule(self.my_event_handler, self.file_path, recursive=False)
+        self.observer.schedule(
+            self.my_event_handler, os.path.abspath(self.file_path), recursive=False)
         self.observer.start()
 
     def stop(self):
         log_message("info", "Shutting down filesystem listener")
         self.observer.stop()
         self.observer.join()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for _ in range(self.num_workers):
+            self._queue.put(None)
 
     def on_created(self, event):
+        if event.is_directory:
+            return
         log_message("info", f"{event.src_path} has been created")
 
     def on_modified(self, event):
         # log_message("info", f"{event.src_path} has been changed")
-        self.warehouse.status_was_updated(event.src_path)
+        if event.is_directory:
+            return
+        path = os.path.abspath(event.src_path)
+        if path not in self.status_files:
+            return
+        with self._condition:
+            # only the first event in a burst sets the deadline, everything
+            # that arrives before it fires is folded into the same update
+            if path not in self._pending:
+                self._pending[path] = monotonic() + self.debounce
+                self._condition.notify()
+
+    def dispatch(self):
+        """
+        Move status files whose debounce window has closed onto the worker queue
+        """
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                now = monotonic()
+                ready = [path for path, deadline in self._pending.items() if deadline <= now]
+                if not ready:
+                    self._condition.wait(timeout=min(self._pending.values()) - now)
+                    continue
+                for path in ready:
+                    del self._pending[path]
+            for path in ready:
+                self._queue.put(path)
+
+    def work(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                self.warehouse.status_was_updated(path, self.status_files.get(path))
+            except Exception as e:
+                log_message("error", f"Error handling status update for {path}: {repr(e)}")
+            finally:
+                self._queue.task_done()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import os
+import heapq
+import fnmatch
+import threading
+from itertools import count
+from time import monotonic
+
+from warehouse.util import log_message
+
+
+def parse_job_limits(items):
+    """
+    Parse job concurrency limits given as "PATTERN=N" strings, where PATTERN
+    is a job name or a glob over job names like "GenerateAtm*CMIP"
+
+    Parameters:
+        items List[str]: the limit strings
+    Returns:
+        dict of pattern to the maximum number of matching jobs to run at once
+    """
+    limits = {}
+    for item in items or []:
+        pattern, _, limit = item.rpartition("=")
+        if not pattern or not limit.isdigit() or int(limit) < 1:
+            raise ValueError(f"Job limit {item} should look like JobName=N, with N a positive number")
+        limits[pattern] = int(limit)
+    return limits
+
+
+def dataset_size(dataset):
+    """
+    Returns the total size in bytes of the files in the datasets latest warehouse
+    directory, or 0 if it doesnt have one yet
+    """
+    if dataset.warehouse_path is None or not dataset.warehouse_path.exists():
+        return 0
+    try:
+        with os.scandir(dataset.latest_warehouse_dir) as entries:
+            return sum(x.stat().st_size for x in entries if x.is_file())
+    except (OSError, TypeError):
+        return 0
+
+
+class JobScheduler(object):
+    """
+    Decides when workflow jobs are submitted.
+
+    Jobs that are still waiting on input datasets are kept in an index keyed by
+    (name, experiment, model_version, ensemble), so a new job for another of their
+    inputs can be merged into them without scanning every job. Jobs that are ready
+    go into a priority queue, smallest dataset first so cheap jobs arent held up
+    behind the heavy ones, and then oldest first. They are released as long as
+    their job type is under its concurrency limit.
+    """
+
+    def __init__(self, limits=None, largest_first=False):
+        """
+        Parameters:
+            limits (dict): job name pattern to the max number of matching jobs running at once
+            largest_first (bool): start the jobs of the largest datasets first instead of the smallest
+        """
+        self.limits = limits or {}
+        self.largest_first = largest_first
+        # (dataset_id, warehouse version dir) -> size, so each version is only listed once
+        self._sizes = {}
+        self._waiting = {}
+        self._ready = []
+        self._running = {}
+        self._counts = {pattern: 0 for pattern in self.limits}
+        self._seq = count()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def job_key(job):
+        return (job.name, job.dataset.experiment, job.dataset.model_version, job.dataset.ensemble)
+
+    def find_matching_job(self, searchjob):
+        """
+        Find a job waiting on its input datasets that the searching job could be
+        merged into, they have the same key and each matches the others requirements
+
+        Parameters:
+            searchjob (WorkflowJob): the job to search for
+        Returns:
+            WorkflowJob: the matching job, or None
+        """
+        if searchjob.meets_requirements():
+            return None
+        with self._lock:
+            for job in self._waiting.get(self.job_key(searchjob), []):
+                if (
+                    not job.meets_requirements()
+                    and job.matches_requirement(searchjob.dataset)
+                    and searchjob.matches_requirement(job.dataset)
+                ):
+                    return job
+        return None
+
+    def wait(self, job):
+        """
+        Index a job that doesnt have all of its input datasets yet
+        """
+        with self._lock:
+            jobs = self._waiting.setdefault(self.job_key(job), [])
+            if job not in jobs:
+                jobs.append(job)
+
+    def push(self, job):
+        """
+        Queue a job that meets its requirements to be submitted
+        """
+        with self._lock:
+            key = self.job_key(job)
+            if job in (jobs := self._waiting.get(key, [])):
+                jobs.remove(job)
+                if not jobs:
+                    del self._waiting[key]
+            size = self.size_of(job.dataset)
+            priority = (-size if self.largest_first else size, monotonic(), next(self._seq))
+            heapq.heappush(self._ready, (priority, job))
+
+    def size_of(self, dataset):
+        """
+        The size of the datasets latest warehouse version, listed the first time it's needed
+        """
+        if dataset.warehouse_path is None or not dataset.warehouse_path.exists():
+            return 0
+        key = (dataset.dataset_id, str(dataset.latest_warehouse_dir))
+        if (size := self._sizes.get(key)) is None:
+            size = self._sizes[key] = dataset_size(dataset)
+        return size
+
+    def limits_for(self, job):
+        return [pattern for pattern in self.limits if fnmatch.fnmatch(job.name, pattern)]
+
+    def pop_ready(self):
+        """
+        Remove and return the queued jobs that can start now, in priority order.
+        Each returned job is counted against its limits until finished() is called
+        """
+        with self._lock:
+            ready = []
+            blocked = []
+            while self._ready:
+                priority, job = heapq.heappop(self._ready)
+                patterns = self.limits_for(job)
+                if any(self._counts[x] >= self.limits[x] for x in patterns):
+                    blocked.append((priority, job))
+                    continue
+                for pattern in patterns:
+                    self._counts[pattern] += 1
+                self._running[id(job)] = patterns
+                ready.append(job)
+            for item in blocked:
+                heapq.heappush(self._ready, item)
+            if blocked:
+                log_message("debug", f"{len(blocked)} jobs are held back by the job limits")
+            return ready
+
+    def finished(self, job):
+        """
+        Release the job limit slots held by a job that has finished, or failed to start
+        """
+        with self._lock:
+            for pattern in self._running.pop(id(job), []):
+                self._counts[pattern] -= 1
+
+    @property
+    def num_waiting(self):
+        with self._lock:
+            return sum(len(x) for x in self._waiting.values())
+
+    @property
+    def num_ready(self):
+        with self._lock:
+            return len(self._ready)
@@ -0,0 +1,77 @@
+import sys
+import os
+import argparse
+import fnmatch
+import yaml
+import warehouse.resources as resources
+from warehouse.archive_map import ArchiveMap
+from warehouse.util import con_message
+
+resource_path, _ = os.path.split(resources.__file__)
+with open(os.path.join(resource_path, "warehouse_config.yaml"), "r") as instream:
+    warehouse_conf = yaml.load(instream, Loader=yaml.SafeLoader)
+DEFAULT_ARCHIVE_MAP_PATH = warehouse_conf.get(
+    "DEFAULT_ARCHIVE_MAP_PATH", os.path.join(resource_path, "Archive_Map"))
+DEFAULT_ARCHIVE_CACHE_PATH = warehouse_conf.get("DEFAULT_ARCHIVE_CACHE_PATH")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Report which zstash archives hold a dataset, and how much data extracting it would produce"
+    )
+    parser.add_argument(
+        "dataset_id",
+        nargs="+",
+        help="Dataset ids to look up, these can be globs such as E3SM.1_0.piControl.*",
+    )
+    parser.add_argument(
+        "--archive-map",
+        type=str,
+        default=DEFAULT_ARCHIVE_MAP_PATH,
+        help=f"Path to the Archive_Map, default is {DEFAULT_ARCHIVE_MAP_PATH}",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=DEFAULT_ARCHIVE_CACHE_PATH,
+        help=f"Path to the sqlite file caching the parsed Archive_Map and the archive listings, default is {DEFAULT_ARCHIVE_CACHE_PATH}",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Read the Archive_Map and every archive index, and dont read or update the cache",
+    )
+    parser.add_argument(
+        "--tars",
+        action="store_true",
+        help="Also list the tar files holding each dataset",
+    )
+    return parser.parse_args()
+
+
+def main():
+    parsed_args = parse_args()
+    archive_map = ArchiveMap(
+        parsed_args.archive_map,
+        cache_path=None if parsed_args.no_cache else parsed_args.cache)
+
+    dataset_ids = []
+    for pattern in parsed_args.dataset_id:
+        if matches := fnmatch.filter(archive_map.dataset_ids(), pattern):
+            dataset_ids.extend(x for x in matches if x not in dataset_ids)
+        else:
+            con_message("warning", f"No Archive_Map entries for {pattern}")
+
+    print("dataset_id,archive_paths,files,bytes")
+    for dataset_id in dataset_ids:
+        entries = archive_map.entries(dataset_id)
+        count, size = archive_map.size(dataset_id)
+        print(f"{dataset_id},{len(entries)},{count},{size}")
+        if parsed_args.tars:
+            for tar in archive_map.tars(dataset_id):
+                print(f"    {tar}")
+    return 0 if dataset_ids else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
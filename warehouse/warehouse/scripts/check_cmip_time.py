@@ -1,40 +1,29 @@
 import os
 import sys
 import argparse
-import xarray as xr
 
 from tqdm import tqdm
 from datetime import datetime
 from pytz import UTC
+from warehouse.time_catalog import TimeCatalog, default_catalog_path, find_discontinuities
 
 def put_message(message):
     print(f'{UTC.localize(datetime.utcnow()).strftime("%Y%m%d_%H%M%S_%f")}:{message}')
 
 
-def check_file(file, freq, time_name="time"):
+def check_file(facts, freq):
     """
-    Step through the file checking that each step in time is exactly how long it should be
-    and that the time index is monotonically increasing
+    Check that each step in time is exactly how long it should be and that the time
+    index is monotonically increasing, using the time facts from the catalog
     """
-    prevtime = None
-    first, last = None, None
-    with xr.open_dataset(file, decode_times=False) as ds:
-        if len(ds[time_name]) == 0:
-            return None, None
-        for step in ds[time_name]:
-            time = step.values.item()
-            if not prevtime:
-                prevtime = time
-                first = time
-                continue
-            delta = time - prevtime
-            if delta != freq:
-                put_message(
-                    f"time discontinuity in {file} at {time}, delta was {delta} when it should have been {freq}"
-                )
-            prevtime = time
-        last = time
-    return first, last, file
+    file = facts["path"]
+    if facts["length"] == 0:
+        return None, None, file
+    for _, time, delta in find_discontinuities(facts, freq):
+        put_message(
+            f"time discontinuity in {file} at {time}, delta was {delta} when it should have been {freq}"
+        )
+    return facts["first"], facts["last"], file
 
 
 def main():
@@ -42,6 +31,23 @@ def main():
         description="Check a directory of CMIP6 timeseries files for discontinuities in the time index"
     )
     parser.add_argument("input", help="Directory path containing dataset")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=8,
+        type=int,
+        help="the number of processes used to read files, default is 8",
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        help="Path to the time index catalog, by default its .time_catalog.sqlite in the parent of the input directory",
+    )
+    parser.add_argument(
+        "--no-catalog",
+        action="store_true",
+        help="Read every file, and dont read or update the time index catalog",
+    )
     args = parser.parse_args()
     inpath = args.input
 
@@ -56,16 +62,19 @@ def main():
         ]
     )
 
-    freq = None
-    # find the time frequency by checking the delta from the 0th to the 1st step
-    with xr.open_dataset(files[0], decode_times=False) as ds:
-        time_units = ds["time"].attrs["units"]
+    if args.no_catalog:
+        catalog = TimeCatalog()
+    else:
+        catalog = TimeCatalog(args.catalog or default_catalog_path(inpath))
+    facts = catalog.load(files, time_name="time", workers=args.jobs, quiet=False)
 
-        freq = ds["time"][1].values.item() - ds["time"][0].values.item()
-        put_message(f"Detected frequency: {freq}, with units: {time_units}")
+    # find the time frequency by checking the delta from the 0th to the 1st step
+    time_units = facts[files[0]]["units"]
+    freq = facts[files[0]]["step"]
+    put_message(f"Detected frequency: {freq}, with units: {time_units}")
 
-    # iterate over each of the files and get the first and last index from each file
-    indices = [check_file(file, freq) for file in tqdm(files)]
+    # get the first and last index from each file
+    indices = [check_file(facts[file], freq) for file in tqdm(files)]
 
     prev = None
     issue = False
@@ -1,16 +1,20 @@
 import sys
 import os
 import argparse
+import netCDF4
 from tqdm import tqdm
 from pathlib import Path
 from concurrent.futures import ProcessPoolExecutor, as_completed
-from subprocess import Popen, PIPE
-from warehouse.util import con_message
+from warehouse.file_cache import FileCache
+from warehouse.util import con_message, dataset_cache_path
+
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+CLASSIC_SIGNATURES = [b"CDF\x01", b"CDF\x02", b"CDF\x05"]
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description="Check that the contents of two files are identical"
+        description="Check that every netCDF file in a directory can be opened and its metadata read"
     )
     parser.add_argument("input", type=str, help="Path a directory full of netCDF files")
     parser.add_argument(
@@ -20,21 +24,76 @@ def parse_args():
         default=8,
         help="Number of parallel jobs, default is 8",
     )
+    parser.add_argument(
+        "--deep",
+        action="store_true",
+        help="Also read the last record of every record variable, to catch files that were truncated",
+    )
+    parser.add_argument(
+        "--dataset-id",
+        type=str,
+        help="The dataset id the results are cached under, by default its made from the path of the "
+        "input directory's parent",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Path to the sqlite file holding results from previous runs, files that passed and "
+        "havent changed since are not checked again. By default its the dataset's integrity cache "
+        "under the DEFAULT_CACHE_PATH of the warehouse config",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Check every file, and dont read or update the results cache",
+    )
     return parser.parse_args()
 
 
-def check_file(path):
-    # import ipdb;ipdb.set_trace()
-    cmd = f"ncdump -h {path}".split()
-    proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate()
-    out = out.decode("utf-8")
-    err = err.decode("utf-8")
+def check_signature(path):
+    """
+    Check the file starts with a netCDF classic or HDF5 superblock signature. The HDF5
+    superblock may be preceded by a user block, in which case its found at 512, 1024, 2048...
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return "file is empty"
+    with open(path, "rb") as instream:
+        head = instream.read(8)
+        if head[:4] in CLASSIC_SIGNATURES or head == HDF5_SIGNATURE:
+            return None
+        offset = 512
+        while offset + 8 <= size:
+            instream.seek(offset)
+            if instream.read(8) == HDF5_SIGNATURE:
+                return None
+            offset *= 2
+    return "no netCDF or HDF5 signature found"
 
-    if not out or "NetCDF: HDF error" in err:
-        con_message("error", f"Error loading {path}")
-        return 1
-    return 0
+
+def check_file(path, deep=False):
+    """
+    Open the file in process and read the metadata for every variable, if deep is set then also
+    read the last record of each variable along the unlimited dimension
+
+    Returns:
+        (path, None) if the file is ok, or (path, error message)
+    """
+    try:
+        if error := check_signature(path):
+            return path, error
+        with netCDF4.Dataset(path, "r") as ds:
+            unlimited = [name for name, dim in ds.dimensions.items() if dim.isunlimited()]
+            for name, var in ds.variables.items():
+                var.ncattrs()
+                shape = var.shape
+                if not deep or not var.dimensions or var.dimensions[0] not in unlimited:
+                    continue
+                if shape[0] > 0:
+                    var[-1, ...]
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+    return path, None
 
 
 def main():
@@ -45,21 +104,47 @@ def main():
     if not input_path.exists() or not input_path.is_dir():
         con_message("error", f"Input directory does not exist or is not a directory")
         return 1
+
+    paths = [str(x.resolve()) for x in input_path.glob("*.nc")]
+    stats = {x: os.stat(x) for x in paths}
+
+    # only files that passed are cached, so failures are always checked again
+    cache = None
+    to_check = paths
+    if not parsed_args.no_cache:
+        dataset_id = parsed_args.dataset_id or ".".join(input_path.resolve().parent.parts[1:])
+        cache_path = parsed_args.cache or dataset_cache_path("integrity", dataset_id)
+        cache = FileCache(cache_path, table="integrity")
+        results = cache.get_many([(x, stats[x]) for x in paths])
+        to_check = [
+            path
+            for path, result in zip(paths, results)
+            if result is None or (parsed_args.deep and not result.get("deep"))
+        ]
+        con_message("info", f"{len(paths) - len(to_check)} of {len(paths)} files unchanged since they were last checked")
+
     futures = []
     pool = ProcessPoolExecutor(max_workers=parsed_args.processes)
-    for path in input_path.glob("*.nc"):
-        realpath = str(path.resolve())
-        futures.append(pool.submit(check_file, realpath))
+    for path in to_check:
+        futures.append(pool.submit(check_file, path, parsed_args.deep))
 
     error = False
+    passed = []
     try:
         for future in tqdm(as_completed(futures), total=len(futures)):
-            result = future.result()
-            if result == 1:
+            path, result = future.result()
+            if result is not None:
+                con_message("error", f"Error loading {path}: {result}")
                 error = True
+            else:
+                passed.append((path, stats[path], {"deep": parsed_args.deep}))
     except KeyboardInterrupt:
         for future in futures:
             future.cancel()
+        error = True
+    finally:
+        if cache is not None and passed:
+            cache.put_many(passed)
 
     if error:
         return 1
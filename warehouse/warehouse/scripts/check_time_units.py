@@ -1,12 +1,10 @@
 import sys
 import os
 import argparse
-import xarray as xr
-from tqdm import tqdm
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import operator
 from warehouse.util import con_message
+from warehouse.time_catalog import TimeCatalog, default_catalog_path
 
 from dataclasses import dataclass
 
@@ -33,18 +31,19 @@ def parse_args():
     parser.add_argument(
         "-p", "--processes", type=int, default=8, help="number of parallel processes"
     )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        help="Path to the time index catalog, by default its .time_catalog.sqlite in the parent of the input directory",
+    )
+    parser.add_argument(
+        "--no-catalog",
+        action="store_true",
+        help="Read every file, and dont read or update the time index catalog",
+    )
     return parser.parse_args()
 
 
-def check_file(idx, filepath, timename):
-    """
-    Return the time units from the file at the path
-    """
-    with xr.open_dataset(filepath, decode_times=False) as ds:
-        # will return None if there aren't any units
-        return idx, ds[timename].attrs.get("units")
-
-
 @dataclass
 class FileItem:
     units: str
@@ -56,7 +55,6 @@ def main():
 
     # populate and sort the list of FileItems
     # the list will be sorted based on its name
-    futures = []
     files = sorted(
         [
             FileItem(units=None, path=str(x.resolve()))
@@ -65,23 +63,21 @@ def main():
         key=operator.attrgetter("path"),
     )
 
-    # setup a process pool, then iterate of all the files
-    # for each file submit a job, and get a future, for its units
-
-    # once the future returns, stick its output into its
-    # corresponding position in the output array
-    with ProcessPoolExecutor(max_workers=parsed_args.processes) as pool:
-        for idx, item in enumerate(files):
-            futures.append(
-                pool.submit(check_file, idx, item.path, parsed_args.time_name)
-            )
-
-        pbar = tqdm(disable=parsed_args.quiet, total=len(files))
-        for future in as_completed(futures):
-            pbar.update(1)
-            idx, units = future.result()
-            files[idx].units = units
-        pbar.close()
+    # get the time facts for every file from the catalog, only
+    # the files that are new or have changed since the last run are opened
+    if parsed_args.no_catalog:
+        catalog = TimeCatalog()
+    else:
+        catalog = TimeCatalog(parsed_args.catalog or default_catalog_path(parsed_args.input))
+    facts = catalog.load(
+        [x.path for x in files],
+        time_name=parsed_args.time_name,
+        workers=parsed_args.processes,
+        quiet=parsed_args.quiet,
+    )
+    for item in files:
+        # will be None if there aren't any units
+        item.units = facts[item.path]["units"]
 
     # walk through the files in order
     # the first file we find that doesnt match the expected units
@@ -91,13 +87,11 @@ def main():
     expected_units = files[0].units
     for idx, info in enumerate(files):
         if expected_units != files[idx].units:
-            # we load the values of the previous file
-            with xr.open_dataset(files[idx - 1].path, decode_times=False) as ds:
-                freq = ds["time_bnds"].values[0][1] - ds["time_bnds"].values[0][0]
-                prev_segment_end = ds["time"].values[-1] + freq
-            # now we load the current file to get its first time value
-            with xr.open_dataset(files[idx].path, decode_times=False) as ds:
-                cur_segment_start = ds["time"].values[0]
+            # the end of the previous file, and the first time value of the current file
+            prev_bounds = facts[files[idx - 1].path]["bounds"]["first"]
+            freq = prev_bounds[1] - prev_bounds[0]
+            prev_segment_end = facts[files[idx - 1].path]["last"] + freq
+            cur_segment_start = facts[files[idx].path]["first"]
 
             # we assume that the second file is always going to have a LOWER time value
             offset = prev_segment_end - cur_segment_start
@@ -2,12 +2,9 @@ import os
 import sys
 import re
 import argparse
-import xarray as xr
-import numpy as np
-import netCDF4
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from warehouse.util import con_message
+from warehouse.time_catalog import TimeCatalog, default_catalog_path, find_discontinuities
 
 calendars = {
     "noleap": {
@@ -27,17 +24,6 @@ calendars = {
 }
 
 
-def get_time_units(path):
-    time_names = ["Time", "time"]
-    time_name = ""
-    with xr.open_dataset(path, decode_times=False) as ds:
-        for name in time_names:
-            if name in ds.dims:
-                time_name = name
-                break
-        return ds[time_name].attrs["units"], time_name
-
-
 def get_month(path):
     pattern = r"\d{4}-\d{2}"
     s = re.search(pattern, path)
@@ -47,34 +33,29 @@ def get_month(path):
     return int(path[s.start() + 5 : s.start() + 7])
 
 
-def check_file(file, freq, idx, time_name="time"):
+def check_file(facts, freq, idx):
     """
-    Step through the file checking that each step in time is exactly how long it should be
-    and that the time index is monotonically increasing
+    Check that each step in time is exactly how long it should be and that the time
+    index is monotonically increasing, using the time facts from the catalog
     """
-    prevtime = None
-    first, last = None, None
-    with xr.open_dataset(file, decode_times=False) as ds:
-        if len(ds[time_name]) == 0:
-            return None, None, idx
-        for step in ds[time_name]:
-            time = step.values.item()
-            if not prevtime:
-                prevtime = time
-                first = time
-                continue
-            delta = time - prevtime
-            if delta == 0:
-                # monthly data
-                return time, time, idx
-            elif delta != freq:
-                con_message(
-                    "warning",
-                    f"time discontinuity in {file} at {time}, delta was {delta} when it should have been {freq}",
-                )
-            prevtime = time
-        last = time
-    return first, last, idx
+    file = facts["path"]
+    if facts["length"] == 0:
+        return None, None, idx
+
+    # a zero length step means this is monthly data, nothing after it is checked
+    zero_step = facts["zero_step"]
+    # monthly data has no fixed step length
+    if isinstance(freq, (int, float)):
+        for i, time, delta in find_discontinuities(facts, freq):
+            if zero_step and i >= zero_step[0]:
+                break
+            con_message(
+                "warning",
+                f"time discontinuity in {file} at {time}, delta was {delta} when it should have been {freq}",
+            )
+    if zero_step:
+        return zero_step[1], zero_step[1], idx
+    return facts["first"], facts["last"], idx
 
 
 def main():
@@ -96,6 +77,16 @@ def main():
         default=False,
         help="Disable progress-bar for batch/background processing",
     )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        help="Path to the time index catalog, by default its .time_catalog.sqlite in the parent of the input directory",
+    )
+    parser.add_argument(
+        "--no-catalog",
+        action="store_true",
+        help="Read every file, and dont read or update the time index catalog",
+    )
     args = parser.parse_args()
     inpath = args.input
 
@@ -121,51 +112,43 @@ def main():
     files = [x["name"] for x in sorted(fileinfo, key=lambda i: i["suffix"])]
     del fileinfo
 
-    time_units, time_name = get_time_units(files[0])
+    if args.no_catalog:
+        catalog = TimeCatalog()
+    else:
+        catalog = TimeCatalog(args.catalog or default_catalog_path(inpath))
+    facts = catalog.load(files, workers=args.jobs, quiet=args.quiet)
+
+    first_file = facts[files[0]]
+    time_units = first_file["units"]
 
     monthly = False
-    freq = None
+    freq = first_file["time_period_freq"]
     # find the time frequency by checking the delta from the 0th to the 1st step
-    # import ipdb; ipdb.set_trace()
-    with xr.open_dataset(files[0], decode_times=False) as ds:
-        freq = ds.attrs.get("time_period_freq")
-
-        if freq == "month_1":
+    if freq == "month_1":
+        monthly = True
+        con_message("info", "Found monthly data")
+        calendar = first_file["calendar"]
+        if calendar not in calendars:
+            con_message("error", f"Unsupported calendar type {calendar}")
+            sys.exit(1)
+    elif freq is None:
+        if first_file["title"] == "CLM History file information":
             monthly = True
-            con_message("info", "Found monthly data")
-            calendar = ds[time_name].attrs["calendar"]
-            if calendar not in calendars:
-                con_message("error", f"Unsupported calendar type {calendar}")
-                sys.exit(1)
-        elif freq is None:
-            if ds.attrs.get("title") == "CLM History file information":
-                monthly = True
-            calendar = ds[time_name].attrs["calendar"]
-            if calendar not in calendars:
-                con_message("error", f"Unsupported calendar type {calendar}")
-                sys.exit(1)
-        else:
-            con_message("info", "Found sub-monthly data")
-            freq = ds[time_name][1].values.item() - ds[time_name][0].values.item()
-            con_message("info", f"Detected frequency: {freq}, with units: {time_units}")
+        calendar = first_file["calendar"]
+        if calendar not in calendars:
+            con_message("error", f"Unsupported calendar type {calendar}")
+            sys.exit(1)
+    else:
+        con_message("info", "Found sub-monthly data")
+        freq = first_file["step"]
+        con_message("info", f"Detected frequency: {freq}, with units: {time_units}")
 
-    # iterate over each of the files and get the first and last index from each file
+    # get the first and last index from each file
     issues = list()
-    prevtime = None
-    indices = [None for _ in range(len(files))]
-    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
-        futures = [
-            pool.submit(check_file, file, freq, idx) for idx, file in enumerate(files)
-        ]
-
-        for future in tqdm(
-            as_completed(futures),
-            total=len(futures),
-            desc="Checking time indices",
-            disable=args.quiet,
-        ):
-            first, last, idx = future.result()
-            indices[idx] = (first, last, idx)
+    indices = [
+        check_file(facts[file], freq, idx)
+        for idx, file in enumerate(tqdm(files, desc="Checking time indices", disable=args.quiet))
+    ]
 
     prev = None
     for first, last, idx in indices:
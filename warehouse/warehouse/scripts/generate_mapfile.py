@@ -13,9 +13,11 @@ import argparse
 from tqdm import tqdm
 from pathlib import Path
 from concurrent.futures import ProcessPoolExecutor, as_completed
-from subprocess import Popen, PIPE
-import hashlib
-from warehouse.util import con_message
+from warehouse.checksum_cache import ChecksumCache, hash_file
+from warehouse.util import con_message, write_atomic, dataset_cache_path
+
+# how many new checksums to collect before writing them to the cache
+CACHE_FLUSH_SIZE = 64
 
 
 def parse_args():
@@ -50,6 +52,18 @@ def parse_args():
         default=8,
         help="Number of parallel jobs, default is 8",
     )
+    parser.add_argument(
+        "--checksum-cache",
+        type=str,
+        help="Path to the sqlite checksum cache, files whose inode, size and mtime "
+        "are already in the cache are not hashed again. By default its the dataset's "
+        "checksum cache under the DEFAULT_CACHE_PATH of the warehouse config",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Hash every file, and dont read or update the checksum cache",
+    )
     parser.add_argument(
         "--quiet",
         action="store_true",
@@ -58,18 +72,6 @@ def parse_args():
     return parser.parse_args()
 
 
-def hash_file(filepath: Path):
-
-    sha256 = hashlib.sha256()
-    fullpath = str(filepath)
-    # handle content in binary form
-    with open(fullpath, "rb") as instream:
-        while chunk := instream.read(4096):
-            sha256.update(chunk)
-
-    return sha256.hexdigest(), fullpath
-
-
 def main():
     parsed_args = parse_args()
 
@@ -89,39 +91,67 @@ def main():
     else:
         outpath = Path(f"{dataset_id}.map")
     
-    if not outpath.exists():
-        outpath.touch(0o664)
-    else:
-        outpath.chmod(0o664)
-
     con_message("info", f"Generate_Mapfile: ({numberproc} processes) to {outpath}")
 
+    cache = None
+    if not parsed_args.no_cache:
+        cache_path = parsed_args.checksum_cache or dataset_cache_path("checksums", dataset_id)
+        cache = ChecksumCache(cache_path)
+
+    paths = [str(x) for x in input_path.glob("*.nc")]
+    stats = {x: os.stat(x) for x in paths}
+    checksums = {}
+    if cache is not None:
+        for path, checksum in zip(paths, cache.get_many([stats[x] for x in paths])):
+            if checksum is not None:
+                checksums[path] = checksum
+        con_message("info", f"Generate_Mapfile: {len(checksums)} of {len(paths)} checksums found in {cache.path}")
+
+    # checksums are saved to the cache as they complete, so if this is
+    # interrupted the next run only has to hash the files that were left
     futures = []
     pool = ProcessPoolExecutor(max_workers=numberproc)
-    for path in input_path.glob("*.nc"):
-        futures.append(pool.submit(hash_file, path))
-
-    with open(outpath, "w") as outstream:
-        try:
-            for future in tqdm(as_completed(futures), total=len(futures), disable=quiet):
-                filehash, pathstr = future.result()
-                filestat = Path(pathstr).stat()
-                line = f"{dataset_id}#{version_nm} | {pathstr} | {filestat.st_size} | mod_time={filestat.st_mtime} | checksum={filehash} | checksum_type=SHA256\n"
-                outstream.write(line)
-
-        except KeyboardInterrupt:
-            con_message(
-                "warning",
-                "Cause keyboard interrupt, exiting. Mapfile will be incomplete",
-            )
-            for future in futures:
-                future.cancel()
-            return 1
-        except Exception as e:
-            con_message("error", e)
+    for path in paths:
+        if path not in checksums:
+            futures.append(pool.submit(hash_file, path))
+
+    pending = []
+    try:
+        for future in tqdm(as_completed(futures), total=len(futures), disable=quiet):
+            filehash, pathstr = future.result()
+            checksums[pathstr] = filehash
+            pending.append((stats[pathstr], filehash))
+            if cache is not None and len(pending) >= CACHE_FLUSH_SIZE:
+                cache.put_many(pending)
+                pending = []
+
+    except KeyboardInterrupt:
+        con_message(
+            "warning",
+            "Cause keyboard interrupt, exiting. Mapfile has not been written",
+        )
+        for future in futures:
+            future.cancel()
+        return 1
+    except Exception as e:
+        con_message("error", e)
+        return 1
+    finally:
+        if cache is not None and pending:
+            cache.put_many(pending)
+        pool.shutdown(wait=False)
+
+    # if a file changed while it was being hashed, its checksum cant be trusted
+    for path in paths:
+        if os.stat(path).st_mtime_ns != stats[path].st_mtime_ns:
+            con_message("error", f"{path} was modified while the mapfile was being generated")
             return 1
 
-    outpath.chmod(0o664)
+    lines = []
+    for path in sorted(paths):
+        filestat = stats[path]
+        lines.append(f"{dataset_id}#{version_nm} | {path} | {filestat.st_size} | mod_time={filestat.st_mtime} | checksum={checksums[path]} | checksum_type=SHA256\n")
+    write_atomic(outpath, lines, mode=0o664)
 
     con_message("info", f"Generate_Mapfile: Completed")
 
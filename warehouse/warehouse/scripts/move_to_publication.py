@@ -3,9 +3,11 @@ import os
 import argparse
 import re
 from pathlib import Path
-from shutil import rmtree
+from shutil import rmtree, move
 from subprocess import Popen, PIPE
-from warehouse.util import con_message
+from warehouse.util import con_message, dataset_cache_path
+from warehouse.checksum_cache import ChecksumCache
+from warehouse.transfer import transfer_files, same_device, staged_directory
 
 
 def parse_args():
@@ -27,13 +29,27 @@ def parse_args():
         required=True,
         help="destination directory for netCDF files to be moved",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of files to copy at once when the source and destination are on different filesystems, default is 8",
+    )
+    parser.add_argument(
+        "--checksum-cache",
+        type=str,
+        help="Path to the sqlite checksum cache that the checksums of copied files are saved to, so the "
+        "mapfile generation doesnt hash them again. By default its the dataset's checksum cache "
+        "under the DEFAULT_CACHE_PATH of the warehouse config",
+    )
     return parser.parse_args()
 
 
 def validate_args(args):
     """
     Ensure the src path exists and is not empty.
-    Ensure the dst path exists and is empty.
+    Ensure the dst path is empty if it exists, it's created when the move completes.
     """
     src_path = Path(args.src)
     dst_path = Path(args.dst)
@@ -44,9 +60,7 @@ def validate_args(args):
         con_message("error", "Source directory is empty")
         return False
 
-    if not dst_path.exists() or not dst_path.is_dir():
-        dst_path.mkdir(parents=True, exist_ok=True)
-    if any(dst_path.iterdir()):
+    if dst_path.exists() and (not dst_path.is_dir() or any(dst_path.iterdir())):
         con_message("error", "Destination directory is not empty")
         return False
 
@@ -80,6 +94,35 @@ def collision_free_name(apath, abase):
     return ret_file
 
 
+def read_mapfile_checksums(mapfile):
+    """
+    Returns a dict of file name to the SHA256 checksum listed for it in the mapfile
+    """
+    checksums = {}
+    with open(mapfile, "r") as instream:
+        for line in instream:
+            items = [x.strip() for x in line.split("|")]
+            if len(items) < 5 or not items[4].startswith("checksum="):
+                continue
+            checksums[Path(items[1]).name] = items[4].split("=", 1)[1]
+    return checksums
+
+
+def verify_checksums(checksums, mapfile):
+    """
+    Compare the checksums computed while copying files against the mapfile that lists them
+    """
+    if not checksums:
+        return True
+    expected = read_mapfile_checksums(mapfile)
+    good = True
+    for path, checksum in checksums.items():
+        if (listed := expected.get(path.name)) is not None and listed != checksum:
+            con_message("error", f"{path.name} was copied with checksum {checksum}, but the mapfile lists {listed}")
+            good = False
+    return good
+
+
 def conduct_move(args, move_method="none"):
     if move_method == "none":
         con_message("error","Move_to_Publication: Must set move_method to 'move' or to 'link'")
@@ -98,7 +141,7 @@ def conduct_move(args, move_method="none"):
         dataset_id = instream.readline().split("|")[0].strip().split("#")[0]    # just the first line, to obtain the dataset_id
     dst = Path(dst_path.parent, f"{dataset_id}.map")
     con_message("info", f"Moving the mapfile to {dst}")
-    mapfile.replace(dst)
+    move(str(mapfile), str(dst))
 
     message = f"mapfile_path={dst},pub_name={dst_path.name},ware_name={src_path.name}"
     if messages_path := os.environ.get("message_file"):
@@ -112,25 +155,35 @@ def conduct_move(args, move_method="none"):
     # return 1
 
     # NOW move the files
-
-    file_count = 0
-    for sfile in src_path.glob("*.nc"):  # all .nc files
-        destination = dst_path / sfile.name
-        if destination.exists():
-            con_message(
-                "error",
-                f"Trying to move file {sfile} to {destination}, but the destination already exists",
-            )
-            sys.exit(1)
-        if move_method == "move":
-            tfile = sfile.resolve()
-            destination = dst_path / tfile.name
-            tfile.replace(destination)
-        else:
-            src_target = src_path / sfile.name
-            # make symlink like ln -s src_target destination, but with Path('the-link-you-want-to-create').symlink_to('the-original-file')
-            Path(destination).symlink_to(src_target)
-        file_count += 1
+    # they go into a staging directory that is renamed to the destination once every file
+    # is in place, so the publication version directory never appears partially filled
+
+    sfiles = sorted(src_path.glob("*.nc"))  # all .nc files
+    checksum = move_method == "move" and not same_device(src_path, dst_path.parent)
+    if checksum:
+        con_message("info", f"{src_path} and {dst_path} are on different filesystems, copying with {args.workers} workers")
+    try:
+        with staged_directory(dst_path) as staging:
+            if move_method == "move":
+                pairs = [(sfile.resolve(), staging / sfile.resolve().name) for sfile in sfiles]
+            else:
+                # make symlink like ln -s src_target destination
+                pairs = [(src_path / sfile.name, staging / sfile.name) for sfile in sfiles]
+            # copies across filesystems are checked against the mapfile before the sources are removed
+            checksums = transfer_files(pairs, mode="copy" if checksum else move_method, workers=args.workers, checksum=checksum)
+            if not verify_checksums(checksums, dst):
+                raise ValueError(f"Files copied from {src_path} do not match the checksums in the mapfile {dst}")
+            if checksums:
+                cache_path = args.checksum_cache or dataset_cache_path("checksums", dataset_id)
+                # a rename keeps the inode, so these are still valid once the staging directory is committed
+                ChecksumCache(cache_path).put_many([(os.stat(x), y) for x, y in checksums.items()])
+    except (OSError, ValueError) as e:
+        con_message("error", f"Failed to move files from {src_path} to {dst_path}: {repr(e)}")
+        sys.exit(1)
+    if checksum:
+        for src, _ in pairs:
+            src.unlink()
+    file_count = len(sfiles)
 
     con_message("info", f"moved {file_count} files from {src_path} to {dst_path}")
 
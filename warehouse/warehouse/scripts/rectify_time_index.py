@@ -2,14 +2,17 @@ import os
 import sys
 import argparse
 import xarray as xr
+import netCDF4
+import numpy as np
 from pathlib import Path
 from tqdm import tqdm
 from shutil import move as move_file
 from shutil import copyfile
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import combinations
 from warehouse.util import con_message
+from warehouse.time_index import read_variable
+from warehouse.time_catalog import TimeCatalog, default_catalog_path
 
 
 def filter_files(file_info):
@@ -40,39 +43,28 @@ def filter_files(file_info):
                 break
 
 
-def monotonic_check(path, idx, bndsname):
-    _, name = os.path.split(path)
-    with xr.open_dataset(path, decode_times=False) as ds:
-        # start at -1 so that the 0th time step doesnt trigger
-        try:
-            start_bound = ds[bndsname][0].values[0]
-            end_bound = ds[bndsname][-1].values[-1]
-        except IndexError as e:
-            con_message(
-                "info", "printing index error"
-            )  # only to escape progress-bar prepend
-            con_message("error", f"{name} doesnt have expect time_bnds variable shape")
-            return None, None, idx
-        l1, l2 = -1.0, -1.0
-        for bounds in ds[bndsname]:
-            b1, b2 = bounds.values
-            if (l1 == -1.0 and b1 == 0.0) or (b1 == b2):
-                # the daily files have a 0 width time step at the start
-                continue
-            if b1 > l1 and b2 > l2:
-                l1 = b1
-                l2 = b2
-            else:
-                con_message(
-                    "error",
-                    f"{name} has failed the monotonically-increaseing time bounds check, {(b1, b2)} isn't greater than {(l1, l2)}",
-                )
-                return None, None, idx
+def monotonic_check(facts, idx):
+    _, name = os.path.split(facts["path"])
+    bounds = facts["bounds"]
+    if not bounds or not bounds["valid"]:
+        con_message(
+            "info", "printing index error"
+        )  # only to escape progress-bar prepend
+        con_message("error", f"{name} doesnt have expect time_bnds variable shape")
+        return None, None, idx
+
+    if bounds["violation"]:
+        _, step, previous = bounds["violation"]
+        con_message(
+            "error",
+            f"{name} has failed the monotonically-increaseing time bounds check, {tuple(step)} isn't greater than {tuple(previous)}",
+        )
+        return None, None, idx
 
-        return start_bound, end_bound, idx
+    return bounds["first"][0], bounds["last"][-1], idx
 
 
-def collect_segments(inpath, num_jobs, timename, bndsname):
+def collect_segments(inpath, num_jobs, timename, bndsname, catalog):
 
     con_message("info", "starting segment collection")
     # collect all the files and sort them by their date stamp
@@ -83,25 +75,20 @@ def collect_segments(inpath, num_jobs, timename, bndsname):
             con_message("warning", f"File {n} is zero bytes, skipping it")
             paths.pop(idx)
 
-    with ProcessPoolExecutor(max_workers=num_jobs) as pool:
-        futures = [
-            pool.submit(monotonic_check, path, idx, bndsname)
-            for idx, path in enumerate(paths)
-        ]
-        file_info = []
-        for future in tqdm(
-            as_completed(futures),
-            desc="Checking files for monotonically increasing time indices",
-            total=len(futures)
-        ):
-            b1, b2, idx = future.result()
-            # if the first value is None, then the file failed its check
-            # and the second value is the index of the file that failed
-            if not b1:
-                # we can simply not add the entry to the file_info list
-                pass
-            else:
-                file_info.append({"name": paths[idx], "start": b1, "end": b2})
+    facts = catalog.load(paths, timename, bndsname, workers=num_jobs, quiet=False)
+    file_info = []
+    # the bounds of the last step in each file, used to find the truncation point
+    last_bounds = {}
+    for idx, path in enumerate(tqdm(paths, desc="Checking files for monotonically increasing time indices")):
+        b1, b2, idx = monotonic_check(facts[path], idx)
+        # if the first value is None, then the file failed its check
+        # and the second value is the index of the file that failed
+        if not b1:
+            # we can simply not add the entry to the file_info list
+            pass
+        else:
+            file_info.append({"name": paths[idx], "start": b1, "end": b2})
+            last_bounds[path] = facts[path]["bounds"]["last"]
 
     file_info.sort(key=lambda i: i["start"])
 
@@ -162,7 +149,7 @@ def collect_segments(inpath, num_jobs, timename, bndsname):
             segments.pop(combo[0])
         elif combo[1][0] > combo[0][0] and combo[1][1] < combo[0][1]:
             segments.pop(combo[1])
-    return segments
+    return segments, last_bounds
 
 
 def update_history(ds):
@@ -179,13 +166,13 @@ def update_history(ds):
 
 
 def get_time_units(path):
-    with xr.open_dataset(path, decode_times=False) as ds:
-        return ds["time"].attrs["units"]
+    with netCDF4.Dataset(path, "r") as ds:
+        return ds.variables["time"].getncattr("units")
 
 
 def get_time_names(path):
-    with xr.open_dataset(path, decode_times=False) as ds:
-        if (tb := ds.get("time_bounds")) and tb.any():
+    with netCDF4.Dataset(path, "r") as ds:
+        if "time_bounds" in ds.variables and read_variable(ds, "time_bounds").any():
             return "time", "time_bounds"
         else:
             return "time", "time_bnds"
@@ -236,6 +223,16 @@ def main():
     parser.add_argument(
         "-q", "--quiet", action="store_true", help="Suppress progress bars"
     )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        help="Path to the time index catalog, by default its .time_catalog.sqlite in the parent of the input directory",
+    )
+    parser.add_argument(
+        "--no-catalog",
+        action="store_true",
+        help="Read every file, and dont read or update the time index catalog",
+    )
 
     args = parser.parse_args()
     inpath = args.input
@@ -257,7 +254,11 @@ def main():
 
     timename, bndsname = get_time_names(next(Path(inpath).glob("*")).as_posix())
 
-    segments = collect_segments(inpath, num_jobs, timename, bndsname)
+    if args.no_catalog:
+        catalog = TimeCatalog()
+    else:
+        catalog = TimeCatalog(args.catalog or default_catalog_path(inpath))
+    segments, last_bounds = collect_segments(inpath, num_jobs, timename, bndsname, catalog)
 
     if len(segments) == 1:
         con_message("info", "No overlapping segments found")
@@ -331,12 +332,11 @@ def main():
         # the index in the file list of segment 1
         truncate_index = len(s1["files"])
         for file in tqdm(s1["files"][::-1], disable=quiet, desc="Stepping backwards to find truncation point"):
-            with xr.open_dataset(file, decode_times=False) as ds:
-                if ds[bndsname][-1].values[1] > s2["start"]:
-                    truncate_index -= 1
-                    continue
-                else:
-                    break
+            if last_bounds[file][1] > s2["start"]:
+                truncate_index -= 1
+                continue
+            else:
+                break
 
         con_message(
             "info",
@@ -346,12 +346,10 @@ def main():
         new_ds = xr.Dataset()
         to_truncate = s1["files"][truncate_index]
         with xr.open_dataset(to_truncate, decode_times=False) as ds:
-            target_index = 0
-            for i in range(0, len(ds[bndsname])):
-                if ds[bndsname][i].values[1] == s2["start"]:
-                    target_index += 1
-                    break
-                target_index += 1
+            # keep every step up to and including the one that ends where the next segment starts
+            upper = ds[bndsname].values[:, 1]
+            matches = np.flatnonzero(upper == s2["start"])
+            target_index = matches[0] + 1 if matches.size else len(upper)
 
             con_message(
                 "info",
@@ -10,6 +10,7 @@ from matplotlib import pyplot as plt
 import statsmodels.api as sm
 import xarray as xr
 import numpy as np
+from esgfpub.reductions import dataset_reductions
 
 def plot_global(dataset, variable, pngpath, dataset_id, debug=False):
     
@@ -28,32 +29,24 @@ def plot_global(dataset, variable, pngpath, dataset_id, debug=False):
     plt.plot(variable)
     plt.savefig(pngpath, dpi=100)
 
-def plot_seasonal_decomp(dataset_path, dataset_id, outpath, debug=False):
-
-    contents = os.listdir(dataset_path)
-    if not contents:
-        raise ValueError(f"Empty dataset directory {dataset_path}")
-    
-    # open the multi-file dataset, combining the files by their coords
-    ds = xr.open_mfdataset(f'{dataset_path}/*.nc', combine='by_coords')
+def plot_seasonal_decomp(dataset_path, dataset_id, outpath, debug=False, cache_path=None):
 
     variable = dataset_id.split('.')[-2]
     pngpath = f"{outpath}{os.sep}{dataset_id}.png"
+    reductions = dataset_reductions(dataset_path, variable, dataset_id=dataset_id, cache_path=cache_path)
 
     # if the variable doesn't have a time axis, just plot whatever's there
-    if 'time' not in ds[variable].coords and 'time' not in ds[variable].dims:
-        plot_global(ds, variable, pngpath, debug)
+    if reductions['time'] is None:
+        with xr.open_mfdataset(f'{dataset_path}/*.nc', combine='by_coords') as ds:
+            plot_global(ds, variable, pngpath, debug)
         return []
 
-    # find the dimensions to average over
-    possible_dims = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']    
-    dims = tuple(x if x != 'sector' else 'basin' for x in ds.dims if x in possible_dims)
-
-    meanvalues = ds[variable].mean(dims).compute()
-    mpd = meanvalues.to_pandas()
+    # the spatial means come from the reduction store, only files that are new since the last run are read
+    times = reductions['time']
+    meanvalues = reductions['mean']
 
     # compute the seasonal decomposition
-    decomposition = sm.tsa.seasonal_decompose(mpd, model='additive', period=12)
+    decomposition = sm.tsa.seasonal_decompose(meanvalues, model='additive', period=12)
 
     # produce the plot
     fig, axes = plt.subplots(3)
@@ -62,8 +55,8 @@ def plot_seasonal_decomp(dataset_path, dataset_id, outpath, debug=False):
     fig.set_size_inches(15, 10)
     fig.tight_layout(pad=5.0)
 
-    xtick_positions = [i for i, t in enumerate(ds['time']) if i % (120) == 0]
-    xtick_values = [t.values.item().strftime('%Y') for i, t in enumerate(ds['time']) if i % (120) == 0]
+    xtick_positions = [i for i in range(len(times)) if i % (120) == 0]
+    xtick_values = [times[i][:4] for i in xtick_positions]
     # plt.xticks(xtick_positions, xtick_values)
     plt.setp(axes, xticks=xtick_positions, xticklabels=xtick_values)
     plt.xlabel('year')
@@ -73,22 +66,22 @@ def plot_seasonal_decomp(dataset_path, dataset_id, outpath, debug=False):
     axes[0].plot(meanvalues)
 
     # second plot is seasonality - mean
-    trend = decomposition.trend[:].to_xarray()
+    trend = decomposition.trend
     axes[1].set_title('trend')
     axes[1].plot(trend)
 
     # thrid plot is the residual
-    resid = decomposition.resid[:].to_xarray()
+    resid = decomposition.resid
     axes[2].set_title('residual')
     axes[2].plot(resid, 'o')
 
     plt.savefig(pngpath, dpi=100)
 
-    rstd = np.std(resid)
-    rmean = np.mean(resid)
+    rstd = np.nanstd(resid)
+    rmean = np.nanmean(resid)
     diff = rstd * 5
     # flag anything thats outside 5x away from the std as a potential issue
-    issues = [f"{variable} - {r.time.values.item().strftime('%Y-%m')}" for r in resid if r > rmean + diff or r < rmean - diff]
+    issues = [f"{variable} - {times[i][:7]}" for i, r in enumerate(resid) if r > rmean + diff or r < rmean - diff]
     if issues:
         print("Potential issues found")
         for issue in issues:
@@ -101,12 +94,13 @@ def main():
     p.add_argument('input', help="Path to dataset directory, the directory should be filled with netCDF files that belong to the dataset")
     p.add_argument('output', help="Path to where generated plots should be saved")
     p.add_argument('dataset_id', help="The dataset_id of the variable being validated")
+    p.add_argument('--reduction-cache', help="Path to the sqlite store of per-file spatial means, files already in it arent read again")
     args = p.parse_args()
 
     # FIXME elided plotting due to unfathomable errors in imports
     # NOTE also, a failure in graphics here should be a caught exception and generate a warning - NOT lead to process abort.
     #   This should not be on the critical path. 
-    # plot_seasonal_decomp(args.input, args.dataset_id, args.output)
+    # plot_seasonal_decomp(args.input, args.dataset_id, args.output, cache_path=args.reduction_cache)
     return 0
 
     
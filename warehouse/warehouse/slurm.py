@@ -1,48 +1,47 @@
 import logging
 import os
+import re
+import threading
 from pathlib import Path
 from subprocess import Popen, PIPE
-from time import sleep
+from time import sleep, monotonic
 import json
-import os
-import stat
 from warehouse.util import print_debug
+from warehouse.executor import Executor
+
+# the squeue fields read into the queue table, in order
+QUEUE_FIELDS = [
+    ("JOBID", "%i"),
+    ("NAME", "%j"),
+    ("STATE", "%t"),
+    ("RUNTIME", "%M"),
+    ("PARTITION", "%P"),
+    ("USER", "%u"),
+    ("COMMAND", "%o"),
+]
 
 
-class Slurm(object):
+class Slurm(Executor):
     """
     A python interface for slurm using subprocesses
     """
 
-    def __init__(self):
+    def __init__(self, queue_interval=10):
         """
         Check if the system has Slurm installed
+
+        Parameters:
+            queue_interval (float): the number of seconds between squeue snapshots
         """
         if not any(
             os.access(os.path.join(path, "sinfo"), os.X_OK)
             for path in os.environ["PATH"].split(os.pathsep)
         ):
             raise Exception("Unable to find slurm, is it installed on this system?")
+        self.poller = QueuePoller(interval=queue_interval)
 
     # -----------------------------------------------
 
-    def render_script(self, cmd, script_path, slurm_opts=[], **kwargs):
-        """
-        Write out an executable bash script
-        Parameters:
-            cmd (string) : a bash command to run
-            script_path (string) : the path to where to store the sbatch script
-            slurm_opts List[(str, str)] : a list of slurm argument key value pairs
-        """
-
-        with open(script_path, "w") as outstream:
-            outstream.write("#!/bin/bash\n\n")
-            for key, val in slurm_opts:
-                outstream.write(f"#SBATCH {key} {val}\n")
-            outstream.write(cmd + "\n")
-        st = os.stat(script_path)
-        os.chmod(script_path, st.st_mode | stat.S_IEXEC)
-
     def sbatch(self, cmd, sbatch_args=None):
         """
         Submit to the batch queue in non-interactive mode
@@ -81,6 +80,7 @@ class Slurm(object):
         cmd = [subtype, cmd, sargs] if sargs is not None else [subtype, cmd]
         tries = 0
         while tries != 10:
+            submit_time = monotonic()
             proc = Popen(cmd, shell=False, stderr=PIPE, stdout=PIPE)
             out, err = proc.communicate()
             out = out.decode("utf-8")
@@ -91,7 +91,9 @@ class Slurm(object):
                 tries += 1
                 sleep(tries * 2)
 
-                qinfo = self.queue()
+                # the job may have been queued anyway, look for it in
+                # a queue snapshot taken after the submission
+                qinfo = self.queue(newer_than=submit_time)
                 for job in qinfo:
                     if job.get("COMMAND") == cmd[1]:
                         return "Submitted batch job {}".format(job["JOBID"]), None
@@ -106,7 +108,8 @@ class Slurm(object):
 
     def showjob(self, jobid):
         """
-        A wrapper around scontrol show job
+        Get information about a job, from the queue snapshot if the job is still in the
+        queue, otherwise from scontrol show job
 
         Parameters:
             jobid (str): the job id to get information about
@@ -115,28 +118,35 @@ class Slurm(object):
         """
         if not isinstance(jobid, str):
             jobid = str(jobid)
-        success = False
-        while not success:
-            try:
-                proc = Popen(
-                    ["scontrol", "show", "job", jobid],
-                    shell=False,
-                    stderr=PIPE,
-                    stdout=PIPE,
-                )
-                out, err = proc.communicate()
-                out = out.decode("utf-8")
-                if err:
-                    err = err.decode("utf-8")
-                    print_debug(err, status="err")
-                    if err == "slurm_load_jobs error: Invalid job id specified":
-                        raise ValueError(f"Unable to find slurm job with id {jobid}")
-                    sleep(1)
-                else:
-                    success = True
-            except:
-                success = False
-                sleep(1)
+
+        if (job := self.poller.get(jobid)) is not None:
+            job_info = JobInfo()
+            for attribute, val in job.items():
+                job_info.set_attr(attr=attribute, val=val)
+            return job_info
+
+        # jobs that have finished are no longer in the queue
+        tries = 0
+        while tries != 10:
+            proc = Popen(
+                ["scontrol", "show", "job", jobid],
+                shell=False,
+                stderr=PIPE,
+                stdout=PIPE,
+            )
+            out, err = proc.communicate()
+            out = out.decode("utf-8")
+            if err:
+                err = err.decode("utf-8")
+                logging.error(err)
+                if "Invalid job id specified" in err:
+                    raise ValueError(f"Unable to find slurm job with id {jobid}")
+                tries += 1
+                sleep(tries)
+            else:
+                break
+        if tries == 10:
+            raise Exception("SLURM ERROR: Unable to communicate with scontrol")
 
         job_info = JobInfo()
         for item in out.split("\n"):
@@ -191,69 +201,159 @@ class Slurm(object):
 
     # -----------------------------------------------
 
-    def queue(self):
+    def queue(self, newer_than=None):
         """
-        Get job queue status
+        Get job queue status from the latest queue snapshot
 
+        Parameters:
+            newer_than (float): a time.monotonic() value, if the snapshot is older than this
+                a new one is taken, subject to the pollers rate limit
         Returns: list of jobs in the queue
         """
+        return list(self.poller.jobs(newer_than).values())
+
+    # -----------------------------------------------
+
+    def cancel(self, job_id):
         tries = 0
         while tries != 10:
             try:
-                cmd = ["squeue", "-u", os.environ["USER"], "-o", "%i|%j|%o|%t"]
+                cmd = ["scancel", str(job_id)]
                 proc = Popen(cmd, shell=False, stderr=PIPE, stdout=PIPE)
                 out, err = proc.communicate()
                 out = out.decode("utf-8")
                 err = err.decode("utf-8")
-                if err or not out:
+                if err:
+                    print(err)
                     tries += 1
                     sleep(tries)
-                    print(err)
                 else:
-                    break
-            except:
+                    return True
+            except Exception as e:
+                print_debug(e)
                 sleep(1)
-        if tries == 10:
-            raise Exception("SLURM ERROR: Unable to communicate with squeue")
-
-        queueinfo = []
-        for item in out.split(b"\n")[1:]:
-            if not item:
-                break
-            line = [x for x in item.split(b"|") if x]
-            queueinfo.append(
-                {
-                    "JOBID": line[0],
-                    "NAME": line[1],
-                    "COMMAND": line[2],
-                    "STATE": line[3],
-                }
-            )
-        return queueinfo
+        return False
 
     # -----------------------------------------------
 
-    def cancel(self, job_id):
+
+class QueuePoller(object):
+    """
+    Takes snapshots of the users slurm queue in a background thread, so that
+    every caller reads the queue from memory instead of running squeue itself.
+    The snapshot is a table of job information keyed by job id, with pending
+    job array tasks expanded to one entry per task id.
+    """
+
+    def __init__(self, interval=10, min_interval=1):
+        """
+        Parameters:
+            interval (float): the number of seconds between snapshots
+            min_interval (float): the shortest time allowed between two calls to squeue,
+                no matter how often a fresh snapshot is asked for
+        """
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self._jobs = {}
+        self._updated = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep the last good snapshot and try again next interval
+                print_debug(e)
+
+    def jobs(self, newer_than=None):
+        """
+        Returns a copy of the latest snapshot, a dict of job id to job information
+
+        Parameters:
+            newer_than (float): take a new snapshot if the current one is older than this time.monotonic() value
+        """
+        self.start()
+        if self._updated is None or (newer_than is not None and self._updated < newer_than):
+            self.refresh()
+        return dict(self._jobs)
+
+    def get(self, job_id, newer_than=None):
+        return self.jobs(newer_than).get(str(job_id))
+
+    def refresh(self):
+        """
+        Take a new snapshot of the queue, unless one was taken less than min_interval seconds ago
+        """
+        with self._lock:
+            if self._updated is not None and monotonic() - self._updated < self.min_interval:
+                return
+            out = self._squeue()
+            jobs = {}
+            for line in out.split("\n")[1:]:
+                if not line:
+                    continue
+                values = line.split("|", len(QUEUE_FIELDS) - 1)
+                if len(values) != len(QUEUE_FIELDS):
+                    continue
+                job = {key: val for (key, _), val in zip(QUEUE_FIELDS, values)}
+                for job_id in expand_job_ids(job["JOBID"]):
+                    jobs[job_id] = dict(job, JOBID=job_id)
+            self._jobs = jobs
+            self._updated = monotonic()
+
+    def _squeue(self):
+        fmt = "|".join(code for _, code in QUEUE_FIELDS)
+        cmd = ["squeue", "-u", os.environ["USER"], "-o", fmt]
         tries = 0
         while tries != 10:
             try:
-                cmd = ["scancel", str(job_id)]
                 proc = Popen(cmd, shell=False, stderr=PIPE, stdout=PIPE)
                 out, err = proc.communicate()
                 out = out.decode("utf-8")
                 err = err.decode("utf-8")
-                if err:
-                    print(err)
+                if err or not out:
                     tries += 1
                     sleep(tries)
+                    print(err)
                 else:
-                    return True
-            except Exception as e:
-                print_debug(e)
+                    return out
+            except:
+                tries += 1
                 sleep(1)
-        return False
+        raise Exception("SLURM ERROR: Unable to communicate with squeue")
 
-    # -----------------------------------------------
+
+def expand_job_ids(job_id):
+    """
+    Expand a pending job array entry like 1234_[0-3,7%2] into its task
+    ids 1234_0 ... 1234_3 and 1234_7, any other job id is returned as is
+    """
+    if not (match := re.fullmatch(r"(\d+)_\[([^\]]+)\]", job_id)):
+        return [job_id]
+    array_id, tasks = match.groups()
+    tasks = tasks.split("%")[0]
+    ids = []
+    for item in tasks.split(","):
+        if "-" in item:
+            first, last = item.split("-")[:2]
+            ids.extend(f"{array_id}_{i}" for i in range(int(first), int(last.split(":")[0]) + 1))
+        else:
+            ids.append(f"{array_id}_{item}")
+    return ids
 
 
 class JobInfo(object):
@@ -322,21 +422,21 @@ class JobInfo(object):
 
     @property
     def state(self):
-        return self.state
+        return self._state
 
     # -----------------------------------------------
 
     @state.setter
     def state(self, state):
         if state in ["Q", "W", "PD", "PENDING"]:
-            self.state = "PENDING"
+            self._state = "PENDING"
         elif state in ["R", "RUNNING"]:
-            self.state = "RUNNING"
+            self._state = "RUNNING"
         elif state in ["E", "CD", "CG", "COMPLETED", "COMPLETING"]:
-            self.state = "COMPLETED"
+            self._state = "COMPLETED"
         elif state in ["FAILED", "F"]:
-            self.state = "FAILED"
+            self._state = "FAILED"
         else:
-            self.state = state
+            self._state = state
 
     # -----------------------------------------------
@@ -0,0 +1,198 @@
+import os
+import netCDF4
+import numpy as np
+
+from tqdm import tqdm
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from warehouse.file_cache import FileCache
+from warehouse.time_index import (
+    find_time_name,
+    find_bounds_name,
+    read_variable,
+    find_bounds_violations,
+)
+
+CATALOG_NAME = ".time_catalog.sqlite"
+
+
+def default_catalog_path(version_dir):
+    """
+    The catalog is kept in the dataset directory next to its version directories, so that
+    every version of the dataset (including the output of RectifyTimeIndex) shares it
+    """
+    return Path(version_dir).resolve().parent / CATALOG_NAME
+
+
+def read_time_facts(path, time_name=None, bnds_name=None):
+    """
+    Open a file and collect everything the time checking scripts need to know about its time axis
+
+    Parameters:
+        path (str): path to the netCDF file
+        time_name (str): name of the time variable, by default the first of "time" or "Time" found in the file
+        bnds_name (str): name of the time bounds variable, by default the first of "time_bnds" or "time_bounds" with data
+    Returns:
+        a json serializable dict of the file's time facts
+    """
+    with netCDF4.Dataset(path, "r") as ds:
+        if time_name is None:
+            time_name = find_time_name(ds)
+        if bnds_name is None:
+            bnds_name = find_bounds_name(ds)
+        facts = {
+            "path": str(path),
+            "time_name": time_name,
+            "bnds_name": bnds_name,
+            "time_period_freq": getattr(ds, "time_period_freq", None),
+            "title": getattr(ds, "title", None),
+            "units": None,
+            "calendar": None,
+            "length": 0,
+            "first": None,
+            "last": None,
+            "step": None,
+            "zero_step": None,
+            "irregular": [],
+            "bounds": None,
+        }
+        if time_name is None or time_name not in ds.variables:
+            return facts
+
+        var = ds.variables[time_name]
+        facts["units"] = getattr(var, "units", None)
+        facts["calendar"] = getattr(var, "calendar", None)
+        times = read_variable(ds, time_name)
+        bounds = None
+        if bnds_name is not None and bnds_name in ds.variables:
+            bounds = read_variable(ds, bnds_name)
+
+    facts["length"] = int(times.size)
+    if times.size:
+        facts["first"] = times[0].item()
+        facts["last"] = times[-1].item()
+    if times.size > 1:
+        deltas = np.diff(times)
+        step = deltas[0]
+        facts["step"] = step.item()
+        # the index and value of the first step that didnt advance the time
+        if (zeros := np.flatnonzero(deltas == 0)).size:
+            facts["zero_step"] = [int(zeros[0]) + 1, times[zeros[0] + 1].item()]
+        # the steps that dont match the first one, almost always empty
+        facts["irregular"] = [
+            [int(i) + 1, times[i + 1].item(), deltas[i].item()]
+            for i in np.flatnonzero(deltas != step)
+        ]
+
+    if bounds is not None:
+        facts["bounds"] = summarize_bounds(bounds)
+    return facts
+
+
+def summarize_bounds(bounds):
+    if bounds.ndim != 2 or bounds.shape[0] == 0 or bounds.shape[1] != 2:
+        return {"valid": False}
+    summary = {
+        "valid": True,
+        "first": bounds[0].tolist(),
+        "last": bounds[-1].tolist(),
+        "violation": None,
+    }
+    if (violations := find_bounds_violations(bounds)).size:
+        i = violations[0]
+        checked = np.flatnonzero((bounds[:i, 0] != bounds[:i, 1]) & (bounds[:i, 0] != 0.0))
+        previous = bounds[checked[-1]].tolist() if checked.size else [-1.0, -1.0]
+        summary["violation"] = [int(i), bounds[i].tolist(), previous]
+    return summary
+
+
+def find_discontinuities(facts, freq):
+    """
+    Returns a list of (index, time, delta) for the steps in a file whose delta from the
+    previous step isnt freq. The catalog only stores the steps that differ from the file's first
+    step, if that step isnt freq then the file has to be read again
+
+    Parameters:
+        facts (dict): the time facts for the file
+        freq (float): the expected step length
+    """
+    if facts["length"] < 2:
+        return []
+    if facts["step"] == freq:
+        return [tuple(x) for x in facts["irregular"]]
+
+    with netCDF4.Dataset(facts["path"], "r") as ds:
+        times = read_variable(ds, facts["time_name"])
+    deltas = np.diff(times)
+    return [(int(i) + 1, times[i + 1].item(), deltas[i].item()) for i in np.flatnonzero(deltas != freq)]
+
+
+class TimeCatalog(object):
+    """
+    A persistent catalog of per-file time facts (units, calendar, first and last
+    time values, irregular steps and bounds) keyed by file path, size and mtime.
+    Files are only opened if they're new or have changed since they were last cataloged
+    """
+
+    def __init__(self, path=None):
+        """
+        Parameters:
+            path (str): path to the sqlite file, if None nothing is stored and every file is read
+        """
+        self.path = Path(path) if path is not None else None
+        self.cache = FileCache(self.path, table="time_facts") if path is not None else None
+
+    def load(self, paths, time_name=None, bnds_name=None, workers=8, quiet=True):
+        """
+        Get the time facts for a list of files, reading the ones that arent already in the catalog
+
+        Parameters:
+            paths (list): paths to the netCDF files
+            time_name (str): name of the time variable, if None its looked up in each file
+            bnds_name (str): name of the time bounds variable, if None its looked up in each file
+            workers (int): the number of processes used to read files
+            quiet (bool): disable the progress bar
+        Returns:
+            a dict of path -> time facts
+        """
+        # keyed by the real path so links into the version directory share entries with their targets
+        resolved = {x: str(Path(x).resolve()) for x in paths}
+        stats = {x: os.stat(resolved[x]) for x in paths}
+        if self.cache is not None:
+            cached = self.cache.get_many([(resolved[x], stats[x]) for x in paths])
+        else:
+            cached = [None for _ in paths]
+
+        facts = {}
+        missing = []
+        for path, value in zip(paths, cached):
+            if value is None \
+                    or (time_name is not None and value["time_name"] != time_name) \
+                    or (bnds_name is not None and value["bnds_name"] != bnds_name):
+                missing.append(path)
+            else:
+                facts[path] = value
+
+        if not missing:
+            return facts
+
+        read = []
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(read_time_facts, resolved[x], time_name, bnds_name): x for x in missing
+                }
+                for future in tqdm(
+                    as_completed(futures),
+                    total=len(futures),
+                    desc="Reading time indices",
+                    disable=quiet,
+                ):
+                    path = futures[future]
+                    facts[path] = future.result()
+                    read.append(path)
+        finally:
+            # keep whatever was read even if one of the files couldnt be opened
+            if read and self.cache is not None:
+                self.cache.put_many([(resolved[x], stats[x], facts[x]) for x in read])
+        return facts
@@ -0,0 +1,59 @@
+import numpy as np
+
+TIME_NAMES = ["time", "Time"]
+BOUNDS_NAMES = ["time_bnds", "time_bounds"]
+
+
+def find_time_name(ds, names=TIME_NAMES):
+    """
+    Returns the name of the first of the given time dimensions found in an open netCDF4.Dataset, or None
+    """
+    for name in names:
+        if name in ds.dimensions:
+            return name
+    return None
+
+
+def find_bounds_name(ds, names=BOUNDS_NAMES):
+    """
+    Returns the name of the first of the given time bounds variables that has any data, or None
+    """
+    for name in names:
+        if name in ds.variables and ds.variables[name].size:
+            return name
+    return None
+
+
+def read_variable(ds, name):
+    """
+    Read an entire variable from an open netCDF4.Dataset as a float64 array without
+    any masking, the same values xarray gives with decode_times=False
+    """
+    var = ds.variables[name]
+    var.set_auto_mask(False)
+    return np.asarray(var[...], dtype=np.float64)
+
+
+def find_bounds_violations(bounds):
+    """
+    Check that the time bounds are monotonically increasing. Zero width steps are
+    ignored, as are steps at the start of the file with a lower bound of 0.0, the daily
+    files have a 0 width time step at the start
+
+    Returns:
+        an array of the indices of the steps whose bounds arent both greater than the
+        bounds of the previous step that was checked
+    """
+    lower, upper = bounds[:, 0], bounds[:, 1]
+    checked = lower != upper
+    nonzero = np.flatnonzero(checked & (lower != 0.0))
+    if nonzero.size == 0:
+        return np.empty(0, dtype=np.intp)
+    checked[: nonzero[0]] = False
+
+    indices = np.flatnonzero(checked)
+    # the first checked step is compared against (-1, -1)
+    lower = np.concatenate(([-1.0], lower[indices]))
+    upper = np.concatenate(([-1.0], upper[indices]))
+    increasing = (np.diff(lower) > 0) & (np.diff(upper) > 0)
+    return indices[~increasing]
@@ -6,11 +6,21 @@ import shutil
 import subprocess
 from subprocess import Popen, PIPE, check_output
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkdtemp
 from datetime import datetime
 import pytz
 from pathlib import Path
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
 gv_logname = ''
+gv_loglock = threading.Lock()
 gv_holospace = '/p/user_pub/e3sm/staging/holospace'
 
 gv_WH_root = '/p/user_pub/e3sm/warehouse'
@@ -21,7 +31,8 @@ gv_stat_root = '/p/user_pub/e3sm/staging/status'
 
 helptext = '''
 
-    usage:  nohup python archive_extraction_service.py [-h/--help] [-c/--config jobset_configfile] &
+    usage:  nohup python archive_extraction_service.py [-h/--help] [-c/--config jobset_configfile]
+                    [-w/--workers N] [--copy-workers N] &
 
     The default jobset config file is /p/user_pub/e3sm/archive/.cfg/jobset_config.  It contains
 
@@ -44,6 +55,14 @@ helptext = '''
     will produce as output the dsid-named files, each containing the Archive_Map entries that
     correspond to the given dataset id.
 
+    Up to --workers requests (default 1) are extracted at once, each in its own holodeck.  Requests
+    that name a dataset which is already being extracted wait until that extraction is done.  New
+    request files are picked up as soon as they appear if the watchdog package is available,
+    otherwise the request directory is checked every 60 seconds.
+
+    Extracted files are renamed into the warehouse when the holodeck and the destination are on the
+    same filesystem, otherwise they are copied with --copy-workers parallel copies (default 8).
+
 '''
 
 # ======== convenience ========================
@@ -58,10 +77,14 @@ def assess_args():
     required = parser.add_argument_group('required arguments')
     optional = parser.add_argument_group('optional arguments')
     optional.add_argument('-c', '--config', action='store', dest="jobset_config", type=str, required=False)
+    optional.add_argument('-w', '--workers', action='store', dest="workers", type=int, default=1,
+                          help="number of extraction requests to process at once, default is 1")
+    optional.add_argument('--copy-workers', action='store', dest="copy_workers", type=int, default=8,
+                          help="number of parallel file copies when moving across filesystems, default is 8")
 
     args = parser.parse_args()
 
-    return True
+    return args
 
 
 def print_list(prefix, items):
@@ -90,8 +113,9 @@ def logMessageInit(logtitle):
 
 def logMessage(mtype,message):
     outmessage = f'{ts("TS_")}:{mtype}:{message}\n'
-    with open(gv_logname, 'a') as f:
-        f.write(outmessage)
+    with gv_loglock:
+        with open(gv_logname, 'a') as f:
+            f.write(outmessage)
 
 def load_file_lines(file_path):
     if not file_path:
@@ -264,164 +288,228 @@ def collision_free_name(apath, abase):
 
 
 
-# Must ensure we have a DSID name for the dataset status file, before warehouse facet directory exists.
-# Must test for existence of facet dest, if augmenting.  May create to 0_extraction/init_status_files/, move later
+def same_filesystem(src_dir, dst_dir):
+    return os.stat(src_dir).st_dev == os.stat(dst_dir).st_dev
 
-def main():
+def move_one(datafile, dst, rename):
+    try:
+        if rename:
+            os.rename(datafile, dst)
+        else:
+            shutil.copy2(datafile, dst)
+            os.remove(datafile)
+    except (OSError, shutil.Error) as e:
+        logMessage('WARNING',f'cannot move file: {dst}: {e}')
+        return False
+    try:
+        os.chmod(dst,0o664)
+    except:
+        logMessage('WARNING',f'cannot chmod file: {dst}')
+    return True
 
-    assess_args()
-    logMessageInit('runlog_archive_extraction_service')
+def transfer_files(datafiles, dest_path, copy_workers):
+    ''' move the datafiles into dest_path, renaming them when both are on the
+        same filesystem and otherwise copying them copy_workers at a time.
+        Returns the number of files moved.
+    '''
+    if not datafiles:
+        return 0
+    rename = same_filesystem(os.path.dirname(datafiles[0]), dest_path)
+
+    # pick every destination name up front, so the parallel copies cant collide
+    taken = set()
+    moves = []
+    for datafile in datafiles:
+        bname = os.path.basename(datafile)
+        cname = collision_free_name(dest_path,bname)
+        alt = 0
+        while cname in taken:
+            alt += 1
+            core, dot, ext = bname.rpartition('.')
+            cname = collision_free_name(dest_path, f'{core}[{alt}]{dot}{ext}' if dot else f'{bname}[{alt}]')
+        taken.add(cname)
+        moves.append((datafile, os.path.join(dest_path,cname)))
+
+    if rename or copy_workers < 2:
+        return sum(move_one(src, dst, rename) for src, dst in moves)
+    with ThreadPoolExecutor(max_workers=copy_workers) as pool:
+        return sum(pool.map(lambda item: move_one(item[0], item[1], False), moves))
+
+def request_dsids(dataset_spec):
+    return {get_dsid_via_archline(line) for line in dataset_spec}
+
+def claim_request(request_file):
+    # move request file to gv_output_dir
+    request_file_done = os.path.join(gv_output_dir,os.path.basename(request_file))
+    if os.path.exists(request_file_done):
+        os.remove(request_file_done)
+    shutil.move(request_file,gv_output_dir)
+
+def extract_line(am_spec_line, copy_workers):
+    ''' run the setup, zstash and transfer phases for one Archive_Map line.
+        Returns the dataset status file.
+    '''
+    # BECOME SETUP:  Ensure dsidi, paths and status file are ready:
 
-    zstashversion = check_output(['zstash', 'version']).decode('utf-8').strip()
-    # print(f'zstash version: {zstashversion}')
+    logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Conducting Setup for extraction request:{am_spec_line}')
+    arch_spec = get_archspec(am_spec_line)
+    dsid = get_dsid_via_archline(am_spec_line)
+    statfile = ensureStatusFile(dsid)
+    ens_path = get_warehouse_path_via_dsid(dsid)        # intended warehouse dataset ensemble path
 
-    if not (zstashversion == 'v0.4.1' or zstashversion == 'v0.4.2' or zstashversion == 'v1.0.0' or zstashversion == 'v1.1.0' ):
-        logMessage('ERROR',f'ARCHIVE_EXTRACTION_SERVICE: zstash version ({zstashversion})is not 0.4.1 or greater, or is unavailable')
-        sys.exit(1)
+    ensureDatasetPath(ens_path)
 
-    logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Startup:zstash version = {zstashversion}')
+    setStatus(statfile,'WAREHOUSE','EXTRACTION:Engaged')
+    setStatus(statfile,'EXTRACTION','SETUP:Engaged')
 
-    # The outer request loop:
-    while True:
-        req_files = glob.glob(gv_input_dir + '/*')
-        req_files.sort(key=os.path.getmtime)
-        if not len(req_files):
-            # print(f'DEBUG: sleeping 60')
-            time.sleep(60)
-            continue
+    # negotiate for "best dest_path" here in case existing will interfere:
+    dest_path = ensureDestinationVersion(ens_path)
 
+    setStatus(statfile,'EXTRACTION','SETUP:Pass')
+    setStatus(statfile,'EXTRACTION','ZSTASH:Ready')
 
-        request_file = req_files[0]  # or req_files[-1], ensure oldest is selected
-        dataset_spec = load_file_lines(request_file) # list of Archive_Map lines for one dataset
+    # BECOME ZSTASH:  Create Holodeck and use zstash to extract files:
 
-        # move request file to gv_output_dir
-        request_file_done = os.path.join(gv_output_dir,os.path.basename(request_file))
-        if os.path.exists(request_file_done):
-            os.remove(request_file_done)
-        shutil.move(request_file,gv_output_dir)
+    logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Preparing zstash holodeck:{am_spec_line}')
 
-        # possible multiple lines for a single dataset extraction request
-        # The Inner Loop
-        statfile = ''
-        newstat = False
-        for am_spec_line in dataset_spec:
+    tm_start = time.time()
 
-            # BECOME SETUP:  Ensure dsidi, paths and status file are ready:
+    arch_path = arch_spec['apath']
+    arch_patt = arch_spec['apatt']
+    # every worker gets its own holodeck, and zstash runs inside it rather than
+    # changing the working directory of the whole service
+    holodeck = mkdtemp(prefix="holodeck-" + ts('') + "-", dir=gv_holospace)
+    holozst = os.path.join(holodeck,'zstash')
 
-            logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Conducting Setup for extraction request:{am_spec_line}')
-            arch_spec = get_archspec(am_spec_line)
-            dsid = get_dsid_via_archline(am_spec_line)
-            statfile = ensureStatusFile(dsid)
-            ens_path = get_warehouse_path_via_dsid(dsid)        # intended warehouse dataset ensemble path
+    # create holodeck and symlinks
+    os.mkdir(holozst)
+    for item in os.scandir(arch_path):
+        base = item.path.split(os.sep)[-1]      # get archive item basename
+        link = os.path.join(holozst,base)       # create full link name
+        os.symlink(item.path,link)
 
-            # logMessage('DEBUG',f'Preparing to create ens_path {ens_path}')
-
-            ensureDatasetPath(ens_path)
-
-            setStatus(statfile,'WAREHOUSE','EXTRACTION:Engaged')
-            setStatus(statfile,'EXTRACTION','SETUP:Engaged')
+    try:
+        logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Executing zstash extraction:{am_spec_line}')
+        setStatus(statfile,'EXTRACTION','ZSTASH:Engaged')
 
-            # negotiate for "best dest_path" here in case existing will interfere:
-            dest_path = ensureDestinationVersion(ens_path)
+        # call zstash and wait for return
+        cmd = ['zstash', 'extract', '--hpss=none', arch_patt]
+        proc = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=holodeck)
+        proc_out, proc_err = proc.communicate()
 
+        if not proc.returncode == 0:
+            logMessage('ERROR',f'zstash returned exitcode {proc.returncode}')
+            setStatus(statfile,'EXTRACTION',f'ZSTASH:Fail:exitcode={proc.returncode}')
+            return statfile
 
-            setStatus(statfile,'EXTRACTION','SETUP:Pass')
-            setStatus(statfile,'EXTRACTION','ZSTASH:Ready')
-            
+        logMessage('INFO','ARCHIVE_EXTRACTION_SERVICE:zstash completed.')
+        setStatus(statfile,'EXTRACTION','ZSTASH:Pass')
 
-            # BECOME ZSTASH:  Create Holodeck and use zstash to extract files:
+        proc_out = proc_out.decode('utf-8')
+        proc_err = proc_err.decode('utf-8')
+        print(f'{proc_out}',flush=True)
+        print(f'{proc_err}',flush=True)
 
-            logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Preparing zstash holodeck:{am_spec_line}')
+        # BECOME TRANSFER:  move Holodeck files to warehouse destination path:
 
-            tm_start = time.time()
+        logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Begin file transfer to warehouse: {dest_path}')
+        setStatus(statfile,'EXTRACTION','TRANSFER:Ready')
 
-            arch_path = arch_spec['apath']
-            arch_patt = arch_spec['apatt']
-            holodeck = os.path.join(gv_holospace,"holodeck-" + ts('') )
-            holozst = os.path.join(holodeck,'zstash')
+        os.makedirs(dest_path,exist_ok=True)
+        os.chmod(dest_path,0o775)
 
-            # logMessage('DEBUG',f'Preparing zstash holodeck: {holodeck}')
+        setStatus(statfile,'EXTRACTION','TRANSFER:Engaged')
+        datafiles = sorted(glob.glob(os.path.join(holodeck, arch_patt)))
+        fcount = transfer_files(datafiles, dest_path, copy_workers)
 
-            # create holodeck and symlinks
-            parentdir = os.getcwd()
-            os.mkdir(holodeck)
-            os.mkdir(holozst)
-            os.chdir(holodeck) # new PWD
-            for item in os.scandir(arch_path):
-                base = item.path.split(os.sep)[-1]      # get archive item basename
-                link = os.path.join(holozst,base)       # create full link name
-                os.symlink(item.path,link)
+        tm_final = time.time()
+        ET = tm_final - tm_start
+        logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Completed file transfer to warehouse: filecount = {fcount}, ET = {ET}')
+        setStatus(statfile,'EXTRACTION',f'TRANSFER:Pass:dstdir=v0,filecount={fcount}')
+    finally:
+        shutil.rmtree(holodeck,ignore_errors=True)
 
-            logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Executing zstash extraction:{am_spec_line}')
-            setStatus(statfile,'EXTRACTION','ZSTASH:Engaged')
+    setStatus(statfile,'WAREHOUSE',f'EXTRACTION:Pass:dstdir=v0,filecount={fcount}')
+    return statfile
 
-            # call zstash and wait for return
-            cmd = ['zstash', 'extract', '--hpss=none', arch_patt]
-            proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-            proc_out, proc_err = proc.communicate()
+def process_request(dataset_spec, copy_workers):
+    # possible multiple lines for a single dataset extraction request
+    # The Inner Loop
+    statfile = ''
+    for am_spec_line in dataset_spec:
+        statfile = extract_line(am_spec_line, copy_workers)
+    if statfile:
+        setStatus(statfile,'WAREHOUSE','VALIDATION:Ready')
 
-            if not proc.returncode == 0:
-                logMessage('ERROR',f'zstash returned exitcode {proc.returncode}')
-                setStatus(statfile,'EXTRACTION',f'ZSTASH:Fail:exitcode={proc.returncode}')
-                os.chdir(parentdir)
-                shutil.rmtree(holodeck,ignore_errors=True)
-                time.sleep(5)
-                continue
-                
-            logMessage('INFO','ARCHIVE_EXTRACTION_SERVICE:zstash completed.')
-            setStatus(statfile,'EXTRACTION','ZSTASH:Pass')
+def watch_requests(wake):
+    ''' set the wake event whenever a request file shows up in the pending directory '''
+    if Observer is None:
+        return None
+    handler = FileSystemEventHandler()
+    handler.on_created = lambda event: wake.set()
+    handler.on_moved = lambda event: wake.set()
+    observer = Observer()
+    observer.schedule(handler, gv_input_dir, recursive=False)
+    observer.start()
+    return observer
 
-            proc_out = proc_out.decode('utf-8')
-            proc_err = proc_err.decode('utf-8')
-            print(f'{proc_out}',flush=True)
-            print(f'{proc_err}',flush=True)
 
+# Must ensure we have a DSID name for the dataset status file, before warehouse facet directory exists.
+# Must test for existence of facet dest, if augmenting.  May create to 0_extraction/init_status_files/, move later
 
-            # BECOME TRANSFER:  move Holodeck files to warehouse destination path:
+def main():
 
-            logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Begin file transfer to warehouse: {dest_path}')
-            setStatus(statfile,'EXTRACTION','TRANSFER:Ready')
+    args = assess_args()
+    logMessageInit('runlog_archive_extraction_service')
 
-            os.makedirs(dest_path,exist_ok=True)
-            os.chmod(dest_path,0o775)
+    zstashversion = check_output(['zstash', 'version']).decode('utf-8').strip()
+    # print(f'zstash version: {zstashversion}')
 
-            setStatus(statfile,'EXTRACTION','TRANSFER:Engaged')
-            fcount = 0
-            for datafile in glob.glob(arch_patt):
-                bname = os.path.basename(datafile)
-                cname = collision_free_name(dest_path,bname)
-                dst = os.path.join(dest_path,cname)
+    if not (zstashversion == 'v0.4.1' or zstashversion == 'v0.4.2' or zstashversion == 'v1.0.0' or zstashversion == 'v1.1.0' ):
+        logMessage('ERROR',f'ARCHIVE_EXTRACTION_SERVICE: zstash version ({zstashversion})is not 0.4.1 or greater, or is unavailable')
+        sys.exit(1)
 
-                moved=True
-                try:
-                    shutil.move(datafile,dst)    # move all files, including .status and (if exists) .
-                except shutil.Error:
-                    logMessage('WARNING',f'shutil - cannot move file: {dst}')
-                    moved=False
-                try:
-                    os.chmod(dst,0o664)
-                except:
-                    logMessage('WARNING',f'cannot chmod file: {dst}')
+    logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Startup:zstash version = {zstashversion}')
 
-                if moved:
-                    fcount += 1
+    wake = threading.Event()
+    observer = watch_requests(wake)
+    if observer is None:
+        logMessage('INFO','ARCHIVE_EXTRACTION_SERVICE:watchdog is unavailable, checking for requests every 60 seconds')
+    logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Startup:workers = {args.workers}')
 
-            tm_final = time.time()
-            ET = tm_final - tm_start
-            logMessage('INFO',f'ARCHIVE_EXTRACTION_SERVICE:Completed file transfer to warehouse: filecount = {fcount}, ET = {ET}')
-            setStatus(statfile,'EXTRACTION',f'TRANSFER:Pass:dstdir=v0,filecount={fcount}')
-            os.chdir(parentdir)
-            shutil.rmtree(holodeck,ignore_errors=True)
+    # request future -> the dataset ids it is extracting
+    running = {}
+    pool = ThreadPoolExecutor(max_workers=args.workers)
 
-            setStatus(statfile,'WAREHOUSE',f'EXTRACTION:Pass:dstdir=v0,filecount={fcount}')
+    # The outer request loop:
+    while True:
+        wake.clear()
+        for future in [f for f in running if f.done()]:
+            if (err := future.exception()) is not None:
+                logMessage('ERROR',f'ARCHIVE_EXTRACTION_SERVICE:extraction request failed: {err}')
+            del running[future]
 
+        busy = set().union(*running.values())
+        req_files = glob.glob(gv_input_dir + '/*')
+        req_files.sort(key=os.path.getmtime)
 
-        setStatus(statfile,'WAREHOUSE','VALIDATION:Ready')
+        # start the oldest requests whose datasets arent already being extracted
+        for request_file in req_files:
+            if len(running) >= args.workers:
+                break
+            dataset_spec = load_file_lines(request_file) # list of Archive_Map lines for one dataset
+            dsids = request_dsids(dataset_spec)
+            if dsids & busy:
+                continue
+            claim_request(request_file)
+            future = pool.submit(process_request, dataset_spec, args.copy_workers)
+            future.add_done_callback(lambda f: wake.set())
+            running[future] = dsids
+            busy |= dsids
 
-        time.sleep(5)
+        # sleep until a new request arrives or a worker finishes
+        wake.wait(timeout=60)
 
 
 if __name__ == "__main__":
   sys.exit(main())
-
-
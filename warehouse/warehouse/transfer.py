@@ -0,0 +1,117 @@
+import os
+import shutil
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from esgfpub.transfer import copy_file, same_device
+
+TRANSFER_MODES = ["move", "copy", "link"]
+
+
+def transfer_files(pairs, mode="copy", workers=8, checksum=False):
+    """
+    Move, copy or link a batch of files, the destination directories must already exist.
+
+    Moves between directories on the same filesystem are done as a batch of renames,
+    with a single device check for each pair of directories. Everything else is
+    copied on a pool of workers, and for a move the sources are only removed once
+    every copy has finished. If any transfer fails, the ones that were already done
+    are undone so the sources are left as they were, and the error is raised
+
+    Parameters:
+        pairs (List[Tuple[Path, Path]]): the (source, destination) paths
+        mode (str): one of "move", "copy" or "link"
+        workers (int): the number of files to copy at once
+        checksum (bool): compute the SHA256 of each file that is copied while it is copied
+    Returns:
+        dict of destination path to SHA256 hex digest for the copied files, empty if checksum isnt set
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError(f"{mode} is not a supported transfer mode")
+    pairs = [(Path(src), Path(dst)) for src, dst in pairs]
+
+    if mode == "link":
+        linked = []
+        try:
+            for src, dst in pairs:
+                dst.symlink_to(src)
+                linked.append(dst)
+        except OSError:
+            for dst in linked:
+                dst.unlink()
+            raise
+        return {}
+
+    renames = []
+    copies = []
+    if mode == "move":
+        devices = {}
+        for src, dst in pairs:
+            key = (src.parent, dst.parent)
+            if key not in devices:
+                devices[key] = same_device(src.parent, dst.parent)
+            if devices[key]:
+                renames.append((src, dst))
+            else:
+                copies.append((src, dst))
+    else:
+        copies = pairs
+
+    renamed = []
+    copied = []
+    checksums = {}
+    try:
+        for src, dst in renames:
+            os.rename(src, dst)
+            renamed.append((src, dst))
+
+        if copies:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(copies)))) as pool:
+                futures = [
+                    (dst, pool.submit(copy_file, src, dst, checksum))
+                    for src, dst in copies
+                ]
+            error = None
+            for dst, future in futures:
+                # a failed copy may still have written part of its destination
+                copied.append(dst)
+                if (e := future.exception()) is not None:
+                    error = error or e
+                elif (result := future.result()) is not None:
+                    checksums[dst] = result
+            if error is not None:
+                raise error
+    except BaseException:
+        for src, dst in reversed(renamed):
+            os.rename(dst, src)
+        for dst in copied:
+            if dst.exists():
+                dst.unlink()
+        raise
+
+    if mode == "move":
+        for src, _ in copies:
+            src.unlink()
+    return checksums
+
+
+@contextmanager
+def staged_directory(path):
+    """
+    Yield a hidden staging directory next to path to transfer files into, which is renamed
+    to path once the block completes, so that readers see either the complete directory or
+    nothing. The path may already exist as long as it is an empty directory.
+
+    If the block raises, the staging directory is removed. If the final rename fails the
+    staging directory is left in place, since it may hold the only copy of files moved into it
+    """
+    path = Path(path)
+    staging = Path(path.parent, f".{path.name}.staging-{os.getpid()}")
+    staging.mkdir(parents=True)
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    os.rename(staging, path)
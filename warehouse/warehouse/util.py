@@ -1,10 +1,11 @@
+import os
 import sys
 import json
 import traceback
 import inspect
 import logging
-import requests
 import time
+import yaml
 
 from tempfile import NamedTemporaryFile
 from subprocess import Popen, PIPE
@@ -13,6 +14,8 @@ from datetime import datetime
 from pytz import UTC
 from termcolor import colored, cprint
 
+import warehouse.resources as resources
+
 
 def load_file_lines(file_path):
     if not file_path:
@@ -31,6 +34,59 @@ def load_file_lines(file_path):
     return retlist
 
 
+def load_new_file_lines(file_path, offset=0):
+    """
+    Read the complete lines that have been appended to a file since the given byte offset.
+    A trailing line without a newline is treated as a partial write and left for the next call
+
+    Parameters:
+        file_path (str, Path): the file to read
+        offset (int): the byte offset to start reading from
+    Returns:
+        (list, int) the new non-empty lines, and the byte offset to resume reading from
+    """
+    with open(file_path, "rb") as instream:
+        instream.seek(offset)
+        chunk = instream.read()
+    end = chunk.rfind(b"\n") + 1
+    lines = [x for x in chunk[:end].decode("utf-8").split("\n") if x]
+    return lines, offset + end
+
+
+def write_atomic(outpath, lines, mode=0o664):
+    """
+    Write lines out to a temp file next to outpath, and then rename it over outpath,
+    so that readers either see the complete old file or the complete new one
+    """
+    outpath = Path(outpath)
+    tmppath = Path(outpath.parent, f".{outpath.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmppath, "w") as outstream:
+            outstream.writelines(lines)
+            outstream.flush()
+            os.fsync(outstream.fileno())
+        tmppath.chmod(mode)
+        os.replace(tmppath, outpath)
+    finally:
+        if tmppath.exists():
+            tmppath.unlink()
+
+
+def dataset_cache_path(name, dataset_id):
+    """
+    The sqlite file of a per-dataset cache, kept in its own directory under the
+    DEFAULT_CACHE_PATH of the warehouse config, so the warehouse and publication
+    directories only hold the datasets themselves
+
+    Parameters:
+        name (str): the name of the cache, e.g. "checksums"
+        dataset_id (str): the dataset the cache is for
+    """
+    with open(Path(resources.__file__).parent / "warehouse_config.yaml", "r") as instream:
+        warehouse_conf = yaml.load(instream, Loader=yaml.SafeLoader)
+    return Path(warehouse_conf["DEFAULT_CACHE_PATH"], name, f"{dataset_id}.sqlite")
+
+
 def get_last_status_line(file_path):
     with open(file_path, "r") as instream:
         last_line = None
@@ -188,8 +244,31 @@ def log_message(level, message, user_level='INFO'):  # message BOTH to log file
 # -----------------------------------------------
 
 
+_search_cache = None
+
+
+def set_search_cache(cache):
+    """
+    Set the ESGFSearchCache consulted by sproket_with_id, search_esgf and search_esgf_batch,
+    passing None turns caching off
+    """
+    global _search_cache
+    _search_cache = cache
+
+
+def get_search_cache():
+    return _search_cache
+
+
+# -----------------------------------------------
+
+
 def sproket_with_id(dataset_id, sproket_path="sproket", **kwargs):
 
+    cache_facets = {"_search": "sproket", "dataset_id": dataset_id, "latest": "true"}
+    if _search_cache is not None and (files := _search_cache.get(cache_facets)) is not None:
+        return dataset_id, files
+
     # create the path to the config, write it out
     tempfile = NamedTemporaryFile(suffix=".json")
     with open(tempfile.name, mode="w") as tmp:
@@ -216,12 +295,35 @@ def sproket_with_id(dataset_id, sproket_path="sproket", **kwargs):
         return dataset_id, None
 
     files = sorted([i.decode("utf-8") for i in out.split()])
+    if _search_cache is not None:
+        _search_cache.put(cache_facets, files)
     return dataset_id, files
 
 
 # -----------------------------------------------
 
 
+_session = None
+
+
+def get_session():
+    """
+    Returns a requests.Session shared by all the ESGF searches made from this process,
+    so that connections to the index node are pooled instead of re-opened per query
+    """
+    global _session
+    if _session is None:
+        # requests is only needed once a search is made, keep it off the startup path
+        import requests
+
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4, pool_maxsize=16, max_retries=3)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
 def search_esgf(
     project,
     facets,
@@ -244,9 +346,16 @@ def search_esgf(
         filter_values (list): A list of string values to be filtered out of the return document
         latest (str): boolean (true/false not True/False) to search for only the latest version of a dataset
     """
+    cache_facets = dict(facets)
+    cache_facets.update(
+        {"_search": "search_esgf", "_node": node, "_project": project, "_latest": latest, "_filter": filter_values})
+    if _search_cache is not None and (docs := _search_cache.get(cache_facets)) is not None:
+        log_message("info", f"util.py: search_esgf: returning cached docs len={len(docs)}")
+        return docs
+
     url = f"https://{node}/esg-search/search/?offset=0&limit=10000&project={project}&format=application%2Fsolr%2Bjson&latest={latest}&{'&'.join([f'{k}={v}' for k,v in facets.items()])}"
     log_message("info", f"search_esgf: issues URL: {url}")
-    req = requests.get(url)
+    req = get_session().get(url)
     if req.status_code != 200:
         log_message("error", f"util.py: search_esgf: ESGF search request failed: (stat_code {req.status_code}) {url}")
         raise ValueError(f"ESGF search request failed: {url}")
@@ -255,8 +364,120 @@ def search_esgf(
         {k: v for k, v in doc.items() if k not in filter_values}
         for doc in req.json()["response"]["docs"]
     ]
+    if _search_cache is not None:
+        _search_cache.put(cache_facets, docs)
     log_message("info", f"util.py: search_esgf: returning docs len={len(docs)}")
     return docs
 
 
 # -----------------------------------------------
+
+def search_esgf_pages(url, params, page_size=10000):
+    """
+    Yield every document matching an ESGF search, following the offset/limit
+    pagination until numFound documents have been returned
+
+    Parameters:
+        url (str): The search endpoint, e.g. https://esgf-node.llnl.gov/esg-search/search/
+        params (list): (key, value) query parameters, keys may repeat to OR together facet values
+        page_size (int): The number of documents to request per page
+    """
+    session = get_session()
+    offset = 0
+    while True:
+        page = params + [("offset", offset), ("limit", page_size)]
+        req = session.get(url, params=page)
+        if req.status_code != 200:
+            log_message("error", f"util.py: search_esgf_pages: ESGF search request failed: (stat_code {req.status_code}) {req.url}")
+            raise ValueError(f"ESGF search request failed: {req.url}")
+        response = req.json()["response"]
+        docs = response["docs"]
+        yield from docs
+        offset += len(docs)
+        if not docs or offset >= response["numFound"]:
+            return
+
+
+def search_esgf_batch(
+    project,
+    dataset_ids,
+    node="esgf-node.llnl.gov",
+    index_url=None,
+    batch_size=50,
+    page_size=10000,
+    latest="true",
+):
+    """
+    Find the published files for many datasets at once. Instead of two queries per dataset,
+    the master_ids are OR'd together into one Dataset query per batch, followed by one
+    File query for all the matching dataset instances.
+
+    Parameters:
+        project (str): The ESGF project to search inside
+        dataset_ids (list): The dataset master_ids to search for
+        node (str): The esgf index node to querry
+        index_url (str): The full url of the search endpoint, overrides the node
+        batch_size (int): The number of dataset ids to put in a single query
+        page_size (int): The number of documents to request per page
+        latest (str): boolean (true/false not True/False) to search for only the latest version of a dataset
+    Returns:
+        dict of dataset_id -> list of file titles, for the datasets that have published files
+    """
+    url = index_url if index_url else f"https://{node}/esg-search/search/"
+    common = [
+        ("project", project),
+        ("format", "application/solr+json"),
+        ("latest", latest),
+    ]
+    dataset_ids = list(dataset_ids)
+    files = {}
+
+    # datasets that were found recently dont need to be searched for again
+    cache_facets = {
+        x: {"_search": "files", "_url": url, "_project": project, "_latest": latest, "master_id": x}
+        for x in dataset_ids
+    }
+    if _search_cache is not None:
+        cached = _search_cache.get_many([cache_facets[x] for x in dataset_ids])
+        missed = []
+        for dataset_id, value in zip(dataset_ids, cached):
+            if value is None:
+                missed.append(dataset_id)
+            elif value:
+                files[dataset_id] = value
+        log_message("info", f"util.py: search_esgf_batch: {len(dataset_ids) - len(missed)} of {len(dataset_ids)} {project} datasets found in the search cache")
+        dataset_ids = missed
+
+    found = {}
+    for i in range(0, len(dataset_ids), batch_size):
+        batch = dataset_ids[i : i + batch_size]
+        params = common + [("type", "Dataset"), ("fields", "id,master_id,number_of_files")]
+        params.extend([("master_id", x) for x in batch])
+
+        # only keep the first instance of each dataset, the same way
+        # the per-dataset search does, so replicas dont double the file list
+        instances = {}
+        for doc in search_esgf_pages(url, params, page_size):
+            if int(doc.get("number_of_files", 0)) == 0:
+                continue
+            if doc["master_id"] in instances.values():
+                continue
+            instances[doc["id"]] = doc["master_id"]
+        if not instances:
+            continue
+
+        params = common + [("type", "File"), ("fields", "dataset_id,title")]
+        params.extend([("dataset_id", x) for x in instances.keys()])
+        for doc in search_esgf_pages(url, params, page_size):
+            if (master_id := instances.get(doc["dataset_id"])) is None:
+                continue
+            found.setdefault(master_id, []).append(doc["title"])
+
+    if _search_cache is not None:
+        _search_cache.put_many([(cache_facets[x], found.get(x, [])) for x in dataset_ids])
+    files.update(found)
+    log_message("info", f"util.py: search_esgf_batch: found files for {len(found)} of {len(dataset_ids)} searched {project} datasets")
+    return files
+
+
+# -----------------------------------------------
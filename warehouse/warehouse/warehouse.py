@@ -1,25 +1,24 @@
 import os
-from re import I
 import sys
 
-import ipdb
 from warehouse.dataset import DatasetStatusMessage
 import yaml
 import inspect
 import fnmatch
+import threading
 
 from pprint import pformat
 from pathlib import Path
-from time import sleep
-from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import sleep, perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from termcolor import colored, cprint
 
 
 from warehouse.workflows import Workflow
 from warehouse.dataset import Dataset, DatasetStatus
-from warehouse.slurm import Slurm
-from warehouse.listener import Listener
+from warehouse.executor import get_executor, EXECUTORS
+from warehouse.scheduler import JobScheduler, parse_job_limits
+from warehouse.esgf_cache import ESGFSearchCache
 import warehouse.resources as resources
 import warehouse.util as util
 from warehouse.util import setup_logging, log_message
@@ -35,6 +34,10 @@ DEFAULT_WAREHOUSE_PATH = warehouse_conf["DEFAULT_WAREHOUSE_PATH"]
 DEFAULT_PUBLICATION_PATH = warehouse_conf["DEFAULT_PUBLICATION_PATH"]
 DEFAULT_ARCHIVE_PATH = warehouse_conf["DEFAULT_ARCHIVE_PATH"]
 DEFAULT_STATUS_PATH = warehouse_conf["DEFAULT_STATUS_PATH"]
+DEFAULT_ESGF_CACHE_PATH = warehouse_conf["DEFAULT_ESGF_CACHE_PATH"]
+DEFAULT_ARCHIVE_MAP_PATH = warehouse_conf.get(
+    "DEFAULT_ARCHIVE_MAP_PATH", os.path.join(resource_path, "Archive_Map"))
+DEFAULT_ARCHIVE_CACHE_PATH = warehouse_conf.get("DEFAULT_ARCHIVE_CACHE_PATH")
 NAME = "auto"
 
 # -------------------------------------------------------------
@@ -61,6 +64,9 @@ class AutoWarehouse:
             self.dataset_ids = [self.dataset_ids]
         self.slurm_path = kwargs.get("slurm", "slurm_scripts")
         self.report_missing = kwargs.get("report_missing")
+        self.archive_map_path = kwargs.get("archive_map", DEFAULT_ARCHIVE_MAP_PATH)
+        self.archive_cache_path = kwargs.get("archive_cache", DEFAULT_ARCHIVE_CACHE_PATH)
+        self.archive_map = None
         self.job_workers = kwargs.get("job_workers", 8)
         self.datasets = None
         self.datasets_from_path = kwargs.get("datasets_from_path", False)
@@ -72,6 +78,10 @@ class AutoWarehouse:
         else:
             self.debug = "INFO"
 
+        self.esgf_cache_path = kwargs.get("esgf_cache", DEFAULT_ESGF_CACHE_PATH)
+        self.refresh_esgf = kwargs.get("refresh_esgf", False)
+        self.esgf_cache = None
+
         self.ask = kwargs.get("ask")
         self.tmpdir = kwargs.get("tmp", os.environ.get("TMPDIR", '/tmp'))
 
@@ -98,8 +108,28 @@ class AutoWarehouse:
             # this is a list of WorkflowJob objects
             self.job_pool = []
 
-            # create the local Slurm object
-            self.slurm = Slurm()
+            # held while datasets change state and jobs are submitted, since that happens
+            # on the listener worker, and on the batcher's timer when job arrays are used
+            self.lock = threading.RLock()
+
+            # jobs waiting on their inputs, or on their job type limits
+            self.scheduler = JobScheduler(
+                limits=parse_job_limits(kwargs.get("job_limit")),
+                largest_first=kwargs.get("largest_first", False))
+
+            # create the executor that runs the job scripts, slurm by default
+            self.executor = get_executor(
+                kwargs.get("executor", "slurm"),
+                queue_interval=kwargs.get("queue_interval", 10),
+                cpus=kwargs.get("local_cpus"))
+
+            # when an array window is set, jobs of the same type are
+            # collected and submitted together as slurm job arrays
+            self.batcher = None
+            if array_window := kwargs.get("array_window"):
+                from warehouse.job_array import JobArrayBatcher
+                self.batcher = JobArrayBatcher(
+                    self.executor, self.slurm_path, window=array_window, lock=self.lock)
 
         # dont setup the listener until after we've gathered the datasets
         self.listener = None
@@ -127,7 +157,8 @@ class AutoWarehouse:
             self.start_listener()
 
             # start a workflow for each dataset as needed
-            self.start_datasets()
+            with self.lock:
+                self.start_datasets()
 
             # wait around while jobs run
             while True:
@@ -136,9 +167,9 @@ class AutoWarehouse:
                 sleep(10)
 
         except KeyboardInterrupt:
-            if listeners := self.listener:
-                for l in listeners:
-                    l.stop()
+            if listener := self.listener:
+                listener.stop()
+            self.flush_job_arrays()
             exit(1)
 
         return 0
@@ -154,6 +185,8 @@ class AutoWarehouse:
             elif x.status == DatasetStatus.UNITITIALIZED.value:
                 found_missing = True
                 msg = f"No files in dataset {x.dataset_id}"
+                if x.project == "E3SM":
+                    msg += self.archive_report(x.dataset_id)
                 log_message("error", msg)
             elif x.status != DatasetStatus.SUCCESS.value:
                 found_missing = True
@@ -162,6 +195,31 @@ class AutoWarehouse:
         if not found_missing:
             log_message("info", "No missing files in datasets")
 
+    def archive_report(self, dataset_id):
+        """
+        Describe what the Archive_Map holds for a dataset, for reporting datasets that havent
+        been extracted yet
+
+        Returns:
+            str: how many files an extraction would produce and from how many archive entries,
+            or that the dataset isnt in the Archive_Map
+        """
+        if self.archive_map is None:
+            # only the missing dataset report reads the Archive_Map
+            from warehouse.archive_map import ArchiveMap
+
+            try:
+                self.archive_map = ArchiveMap(self.archive_map_path, cache_path=self.archive_cache_path)
+            except OSError as e:
+                log_message("warning", f"Unable to read the Archive_Map {self.archive_map_path}: {e}")
+                self.archive_map = False
+        if not self.archive_map:
+            return ""
+        if not (entries := self.archive_map.entries(dataset_id)):
+            return ", and it isnt in the Archive_Map"
+        count, size = self.archive_map.size(dataset_id)
+        return f", {count} files ({size} bytes) can be extracted from {len(entries)} Archive_Map entries"
+
     def find_e3sm_source_dataset(self, job):
         """
         Given a job with a CMIP6 dataset that needs to be run, 
@@ -289,26 +347,51 @@ class AutoWarehouse:
         # find the state of each dataset
         if check_esgf:
             # import ipdb; ipdb.set_trace()
+            if self.esgf_cache_path:
+                self.esgf_cache = ESGFSearchCache(self.esgf_cache_path)
+                if self.refresh_esgf:
+                    log_message("info", f"Clearing the ESGF search cache {self.esgf_cache_path}")
+                    self.esgf_cache.invalidate()
+                util.set_search_cache(self.esgf_cache)
+
+            start = perf_counter()
+            esgf_files = self.search_esgf_files()
+            search_time = perf_counter() - start
+            if esgf_files is not None:
+                esgf_files = {x: esgf_files.get(x, []) for x in self.datasets.keys()}
+            else:
+                esgf_files = {x: None for x in self.datasets.keys()}
+
+            # the status lookups are dominated by waiting on http and the filesystem,
+            # so they run in threads that share the Dataset objects (and the http session)
+            # rather than pickling every Dataset over to a process pool
+            from tqdm import tqdm
+
+            start = perf_counter()
             if not self.serial:
-                pool = ProcessPoolExecutor(max_workers=self.num_workers)
-                futures = [pool.submit(x.find_status)
-                           for x in self.datasets.values()]
-                for future in tqdm(
-                    as_completed(futures),
-                    total=len(futures),
-                    desc="Searching ESGF for datasets",
-                ):
-                    dataset_id, status, missing = future.result()
-                    if isinstance(status, DatasetStatus):
-                        status = status.value
-                    self.datasets[dataset_id].status = status
-                    self.datasets[dataset_id].missing = missing
+                with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+                    futures = [pool.submit(x.find_status, esgf_files[x.dataset_id])
+                               for x in self.datasets.values()]
+                    for future in tqdm(
+                        as_completed(futures),
+                        total=len(futures),
+                        desc="Searching ESGF for datasets",
+                    ):
+                        dataset_id, status, missing = future.result()
+                        if isinstance(status, DatasetStatus):
+                            status = status.value
+                        self.datasets[dataset_id].status = status
+                        self.datasets[dataset_id].missing = missing
             else:
                 for dataset in tqdm(self.datasets.values()):
-                    dataset_id, status, _ = dataset.find_status()
+                    dataset_id, status, _ = dataset.find_status(esgf_files[dataset.dataset_id])
                     if isinstance(status, DatasetStatus):
                         status = status.value
                     self.datasets[dataset_id].status = status
+
+            self.report_discovery_timings(search_time, perf_counter() - start)
+            if self.esgf_cache is not None:
+                self.esgf_cache.report()
         
         if self.ask:
             for name, dataset in self.datasets.items():
@@ -321,6 +404,47 @@ class AutoWarehouse:
 
         return
 
+    def report_discovery_timings(self, search_time, status_time):
+        """
+        Log how long dataset discovery took, broken down by phase. The per-dataset
+        phase times are summed across datasets, so with parallel workers their total
+        can be larger than the wall clock time
+        """
+        phases = {}
+        for dataset in self.datasets.values():
+            for phase, seconds in dataset.timings.items():
+                phases.setdefault(phase, []).append(seconds)
+
+        log_message("info", f"Batched ESGF search took {search_time:.2f}s")
+        log_message("info", f"Status lookup for {len(self.datasets)} datasets took {status_time:.2f}s")
+        for phase, times in phases.items():
+            log_message(
+                "info",
+                f"    {phase}: {len(times)} datasets, total {sum(times):.2f}s, mean {sum(times) / len(times):.3f}s, max {max(times):.2f}s",
+            )
+
+    def search_esgf_files(self):
+        """
+        Find the published files for all the datasets with a handful of batched ESGF
+        searches, instead of two searches per dataset
+
+        Returns:
+            dict of dataset_id -> list of published file names, or None if the search failed
+        """
+        cmip6_ids = [x for x in self.datasets.keys() if x.startswith("CMIP6")]
+        e3sm_ids = [x for x in self.datasets.keys() if not x.startswith("CMIP6")]
+        esgf_files = {}
+        try:
+            if cmip6_ids:
+                esgf_files.update(util.search_esgf_batch("CMIP6", cmip6_ids))
+            if e3sm_ids:
+                esgf_files.update(util.search_esgf_batch("e3sm", e3sm_ids))
+        except (ValueError, OSError) as e:
+            log_message(
+                "error", f"Batched ESGF search failed, falling back to searching per dataset: {repr(e)}")
+            return None
+        return esgf_files
+
     def workflow_error(self, dataset):
         log_message(
             "error", f"Dataset {dataset.dataset_id} FAILED from {dataset.status}"
@@ -331,48 +455,51 @@ class AutoWarehouse:
             "info", f"Dataset {dataset.dataset_id} SUCCEEDED from {dataset.status}"
         )
 
-    def status_was_updated(self, path):
+    def status_was_updated(self, path, dataset_id=None):
         """
         This should be called whenever a datasets status file is updated
-        Parameters: path (str) -> the path to the directory containing the status file
+        Parameters:
+            path (str) -> the path to the status file
+            dataset_id (str) -> the dataset the status file belongs to, if not given
+                its read from the status file
         """
-        dataset_id = None
-
-        with open(path, "r") as instream:
-            for line in instream.readlines():
-                if "DATASETID" in line:
-                    dataset_id = line.split("=")[-1].strip()
-        if dataset_id is None:
-            log_message("error", "Unable to find dataset ID in status file")
-
-        dataset = self.datasets[dataset_id]
-        dataset.update_from_status_file()
-        dataset.unlock(dataset.latest_warehouse_dir)
-
-        # check to see of there's a slurm ID in the second to last status
-        # and if there is, and the latest is either Pass or Fail, then
-        # remove the job from the job_pool
-        latest, second_latest = dataset.get_latest_status()
-        log_message("info", f"dataset: {dataset_id} updated to state {latest}")
-
-        if second_latest is not None:
-            latest_attrs = latest.split(":")
-            second_latest_attrs = second_latest.split(":")
-            if "slurm_id" in second_latest_attrs[-1]:
-                job_id = int(
-                    second_latest_attrs[-1][second_latest_attrs[-1].index(
-                        "=") + 1:]
-                )
-                # if the job names  are the same 
-                if second_latest_attrs[-3] == latest_attrs[-3]:
-                    if "Pass" in latest_attrs[-2] or "Fail" in latest_attrs[-2]:
-                        for job in self.job_pool:
-                            if job.job_id == job_id:
-                                self.job_pool.remove(job)
-                                break
-
-        # start the transition change for the dataset
-        self.start_datasets({dataset_id: dataset})
+        with self.lock:
+            if dataset_id is None:
+                with open(path, "r") as instream:
+                    for line in instream.readlines():
+                        if "DATASETID" in line:
+                            dataset_id = line.split("=")[-1].strip()
+            if dataset_id is None:
+                log_message("error", "Unable to find dataset ID in status file")
+
+            dataset = self.datasets[dataset_id]
+            dataset.update_from_status_file()
+            dataset.unlock(dataset.latest_warehouse_dir)
+
+            # check to see of there's a slurm ID in the second to last status
+            # and if there is, and the latest is either Pass or Fail, then
+            # remove the job from the job_pool
+            latest, second_latest = dataset.get_latest_status()
+            log_message("info", f"dataset: {dataset_id} updated to state {latest}")
+
+            if second_latest is not None:
+                latest_attrs = latest.split(":")
+                second_latest_attrs = second_latest.split(":")
+                if "slurm_id" in second_latest_attrs[-1]:
+                    # job array tasks have ids like ARRAYID_TASKID
+                    job_id = second_latest_attrs[-1][second_latest_attrs[-1].index(
+                        "=") + 1:].strip()
+                    # if the job names  are the same 
+                    if second_latest_attrs[-3] == latest_attrs[-3]:
+                        if "Pass" in latest_attrs[-2] or "Fail" in latest_attrs[-2]:
+                            for job in self.job_pool:
+                                if str(job.job_id) == job_id:
+                                    self.job_pool.remove(job)
+                                    self.scheduler.finished(job)
+                                    break
+
+            # start the transition change for the dataset
+            self.start_datasets({dataset_id: dataset})
 
     def start_datasets(self, datasets=None):
         """
@@ -500,15 +627,17 @@ class AutoWarehouse:
                         "debug",
                         f"Created jobs from {state} for dataset {dataset_id}"
                     )
+                    self.scheduler.wait(newjob)
                     new_jobs.append(newjob)
                 else:
                     matching_job.setup_requisites(newjob.dataset)
+                    if matching_job not in new_jobs:
+                        new_jobs.append(matching_job)
 
-        # start the jobs in the job_pool if they're ready
+        # queue the new jobs that are ready to start
         for job in new_jobs:
             log_message("info", f"starting job: {job}")
             job_name = f"{job}".split(':')[0]
-            # import ipdb; ipdb.set_trace()
             if not job.meets_requirements() and job.dataset.project == "CMIP6" or ( job_name == 'POSTPROCESS' and ('time-series' in job.dataset.dataset_id or 'climo' in job.dataset.dataset_id) ):
                 source_dataset = self.find_e3sm_source_dataset(job)
                 if source_dataset is None:
@@ -519,28 +648,51 @@ class AutoWarehouse:
             if job.job_id is None and job.meets_requirements():
                 log_message(
                     "info", f"Job {job} meets its input dataset requirements")
-                job_id = job(self.slurm)
-                if job_id is not None:
-                    job.job_id = job_id
+                self.scheduler.push(job)
+            else:
+                log_message("info", f"Job {job} is waiting on its input datasets")
+
+        self.submit_ready_jobs()
+        return
+
+    def submit_ready_jobs(self):
+        """
+        Start the queued jobs that are allowed to run, in priority order
+        """
+        for job in self.scheduler.pop_ready():
+            if self.batcher is not None:
+                # the job id is set once its array has been submitted
+                if (script_path := job.prepare(self.executor)) is not None:
                     self.job_pool.append(job)
+                    self.batcher.add(job, script_path)
                 else:
                     log_message("error", f"Error starting up job {job}")
+                    self.scheduler.finished(job)
+                continue
+            job_id = job(self.executor)
+            if job_id is not None:
+                job.job_id = job_id
+                self.job_pool.append(job)
+                if not job_id:
+                    self.scheduler.finished(job)
             else:
-                log_message("info", "DGB: WH: Is it possible to fall through to here?")
-        return
+                log_message("error", f"Error starting up job {job}")
+                self.scheduler.finished(job)
 
     def start_listener(self):
         """
-        Starts a file change listener for the status file
-        for each of the datasets.
+        Starts a single file change listener on the status directory,
+        and registers the status file for each of the datasets with it.
         """
-        self.listener = []
-        for _, dataset in self.datasets.items():
-            log_message("info", f"starting listener for {dataset.status_path}")
-            listener = Listener(warehouse=self, file_path=dataset.status_path)
-            listener.start()
-            self.listener.append(listener)
-        log_message("info", "Listener setup complete")
+        # watchdog is only needed once the warehouse starts running
+        from warehouse.listener import Listener
+
+        self.listener = Listener(warehouse=self, file_path=self.status_path)
+        for dataset_id, dataset in self.datasets.items():
+            self.listener.add_path(dataset.status_path, dataset_id)
+        self.listener.start()
+        log_message(
+            "info", f"Listener setup complete, watching {len(self.datasets)} status files in {self.status_path}")
 
     def check_done(self):
         """
@@ -556,38 +708,33 @@ class AutoWarehouse:
             ):
                 all_done = False
         if all_done:
-            for listener in self.listener:
-                listener.observer.stop()
+            self.flush_job_arrays()
+            self.listener.observer.stop()
             self.should_exit = True
             log_message("info", "All datasets complete, exiting")
             sys.exit(0)
         return
 
+    def flush_job_arrays(self):
+        """
+        Submit the jobs still collecting in job array groups, so none are left behind on exit
+        """
+        if getattr(self, "batcher", None) is not None:
+            self.batcher.flush()
+
     def find_matching_job(self, searchjob):
         """
-        Given a job object to searh for, looks at all jobs
-        in the job_pool to find a job with the matching characteristics.
+        Given a job object to searh for, looks up the jobs waiting on their
+        input datasets to find a job with the matching characteristics.
         Additionally checks if the job, and the searching job, meet their
         dataset input requirements.
 
         Parameters:
-            searchjob (WorkflowJob): a job to search the job_pool for
+            searchjob (WorkflowJob): a job to search the waiting jobs for
         Returns:
             WorkflowJob: the matching job
         """
-        for job in self.job_pool:
-            if (
-                job.name == searchjob.name
-                and job.dataset.experiment == searchjob.dataset.experiment
-                and job.dataset.model_version == searchjob.dataset.model_version
-                and job.dataset.ensemble == searchjob.dataset.ensemble
-                and not job.meets_requirements()
-                and not searchjob.meets_requirements()
-                and job.matches_requirement(searchjob.dataset)
-                and searchjob.matches_requirement(job.dataset)
-            ):
-                return job
-        return
+        return self.scheduler.find_matching_job(searchjob)
 
     def collect_cmip_datasets(self, **kwargs):
         for activity_name, activity_val in self.dataset_spec["project"]["CMIP6"].items():
@@ -636,7 +783,7 @@ class AutoWarehouse:
     ):
         p = parser.add_parser(name=NAME, help="Automated warehouse processing")
         p.add_argument(
-            "-n", "--num", default=8, type=int, help="Number of parallel workers"
+            "-n", "--num", default=8, type=int, help="Number of parallel workers used to look up dataset status"
         )
         p.add_argument(
             "-s", "--serial", action="store_true", help="Run esgf checks in serial"
@@ -689,6 +836,42 @@ class AutoWarehouse:
             default=8,
             help="number of parallel workers each job should create when running, default=8",
         )
+        p.add_argument(
+            "--job-limit",
+            nargs="*",
+            help="Limit how many jobs of a type can run at once, given as JobName=N, the job name can be a "
+            "glob such as GenerateAtm*CMIP=4, by default there is no limit",
+        )
+        p.add_argument(
+            "--largest-first",
+            action="store_true",
+            help="Start the ready jobs of the largest datasets first, by default the smallest datasets go first",
+        )
+        p.add_argument(
+            "--executor",
+            choices=EXECUTORS,
+            default="slurm",
+            help="How job scripts are run, either submitted to slurm or run as subprocesses on this node, default=slurm",
+        )
+        p.add_argument(
+            "--local-cpus",
+            type=int,
+            help="The number of cpus the local executor can reserve for running jobs, "
+            "each job reserves --job-workers cpus, default is all the cpus on this node",
+        )
+        p.add_argument(
+            "--array-window",
+            type=float,
+            default=0,
+            help="Collect jobs of the same type for this many seconds and submit them together as a slurm job array, "
+            "default=0 which submits every job on its own",
+        )
+        p.add_argument(
+            "--queue-interval",
+            type=float,
+            default=10,
+            help="Number of seconds between snapshots of the slurm queue, default=10",
+        )
         p.add_argument(
             "--testing", action="store_true", help="run the warehouse in testing mode"
         )
@@ -710,11 +893,36 @@ class AutoWarehouse:
             action="store_true",
             help=f"When starting up, print out the datasets that will be affected (and their initial status), and ask the user if they would like to proceed.",
         )
+        p.add_argument(
+            "--esgf-cache",
+            required=False,
+            default=DEFAULT_ESGF_CACHE_PATH,
+            help=f"Path to the sqlite file used to cache ESGF search results between runs, default={DEFAULT_ESGF_CACHE_PATH}",
+        )
+        p.add_argument(
+            "--refresh-esgf",
+            required=False,
+            action="store_true",
+            help="Ignore and clear the cached ESGF search results, and search ESGF again for every dataset",
+        )
         p.add_argument(
             "--report-missing",
             required=False,
             action="store_true",
-            help="After collecting the datasets, print out any that have missing files and exit",
+            help="After collecting the datasets, print out any that have missing files and exit. "
+            "E3SM datasets without any files are looked up in the Archive_Map",
+        )
+        p.add_argument(
+            "--archive-map",
+            required=False,
+            default=DEFAULT_ARCHIVE_MAP_PATH,
+            help=f"Path to the Archive_Map used by --report-missing, default={DEFAULT_ARCHIVE_MAP_PATH}",
+        )
+        p.add_argument(
+            "--archive-cache",
+            required=False,
+            default=DEFAULT_ARCHIVE_CACHE_PATH,
+            help=f"Path to the sqlite file caching the parsed Archive_Map and the archive listings, default={DEFAULT_ARCHIVE_CACHE_PATH}",
         )
         p.add_argument(
             "--debug",
@@ -2,14 +2,15 @@
 import yaml
 import importlib
 import os
+import re
 import sys
 import inspect
+from collections.abc import Mapping
 from pprint import pformat
 from pathlib import Path
 
 from warehouse.workflows import jobs
 import warehouse.resources as resources
-from warehouse.workflows import jobs
 from warehouse.util import setup_logging, log_message
 
 
@@ -27,12 +28,68 @@ DEFAULT_STATUS_PATH = warehouse_conf['DEFAULT_STATUS_PATH']
 NAME = 'Warehouse'
 
 
+class JobRegistry(Mapping):
+    """
+    The WorkflowJob classes in the jobs directory keyed by their NAME. The directory
+    is scanned once for the job names without importing anything, and each job
+    module is only imported the first time its class is looked up
+    """
+
+    name_pattern = re.compile(r"""^NAME\s*=\s*['"](\w+)['"]""", re.MULTILINE)
+
+    def __init__(self, jobs_path):
+        self.jobs_path = Path(jobs_path)
+        self._modules = None
+        self._classes = {}
+
+    @property
+    def modules(self):
+        """
+        A dict of job NAME -> module name
+        """
+        if self._modules is None:
+            modules = {}
+            for file in self.jobs_path.glob('*.py'):
+                if file.name == '__init__.py':
+                    continue
+                module_string = f'warehouse.workflows.jobs.{file.stem}'
+                if match := self.name_pattern.search(file.read_text()):
+                    modules[match.group(1)] = module_string
+                else:
+                    # the NAME isnt a plain string literal, fall back to importing the module
+                    module = importlib.import_module(module_string)
+                    modules[module.NAME] = module_string
+            self._modules = modules
+        return self._modules
+
+    def __getitem__(self, name):
+        if (job_class := self._classes.get(name)) is None:
+            module = importlib.import_module(self.modules[name])
+            job_class = self._classes[name] = getattr(module, module.NAME)
+        return job_class
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __len__(self):
+        return len(self.modules)
+
+
+# shared by every node in every workflow tree
+job_registry = JobRegistry(Path(jobs.__file__).parent.absolute())
+
+# transitions.yaml path -> parsed transitions, so each file is only read once per process
+_transitions_cache = {}
+
+
 class Workflow(object):
 
     def __init__(self, parent=None, slurm_scripts='temp', **kwargs):
         self.parent = parent
         self.transitions = {}
         self.children = {}
+        # state -> data type -> [(next state, workflow)], see compile_transitions()
+        self.transition_table = {}
         self.slurm_scripts = slurm_scripts
         self.name = NAME.upper()
         self.jobs = self.load_jobs()
@@ -43,20 +100,10 @@ class Workflow(object):
 
     def load_jobs(self):
         """
-        get the path to the jobs directory which should be a sibling
-        of the warehouse.py file
+        Returns the registry of job classes from the jobs directory, which should be
+        a sibling of this file. The registry is shared, and imports the jobs lazily
         """
-        modules = {}
-        jobs_path = Path(jobs.__file__).parent.absolute()
-
-        for file in jobs_path.glob('*'):
-            if file.name == '__init__.py' or file.is_dir():
-                continue
-            module_string = f'warehouse.workflows.jobs.{file.stem}'
-            module = importlib.import_module(module_string)
-            job_class = getattr(module, module.NAME)
-            modules[module.NAME] = job_class
-        return modules
+        return job_registry
 
     def get_status_prefix(self, prefix=""):
         """
@@ -69,72 +116,119 @@ class Workflow(object):
             # return prefix
             return self.name + ':' + prefix
 
-    def next_state(self, dataset, state, params, idx=0):
+    @staticmethod
+    def get_data_type(dataset):
         """
-        Parameters: 
-            dataset (Dataset) : The dataset which is changing state
-            state (string) : The state to move out from (trimmed to "test_state" below)
-            idx (int) : The recursive depth index
-        Returns the name of the next state to transition to given the current state of the dataset
+        The data type key used in the transitions.yaml files, e.g. atmos-native-mon
+        """
+        if dataset.grid == "native":
+            return f'{dataset.realm}-native-{dataset.freq}'
+        return f'{dataset.realm}-{dataset.data_type.replace("-", "")}-{dataset.freq}'
+
+    def resolve_state(self, state, idx=0):
+        """
+        Walk down the workflow tree following the components of the state to find the
+        workflow whose transitions contain it. The last two components (e.g. "CheckTime:Pass")
+        are the transition key, the components before them name the workflows on the way down
+
+        Parameters:
+            state (string) : The full state string, e.g. "WAREHOUSE:VALIDATION:CheckTime:Pass:"
+            idx (int) : The component of the state to start walking from
+        Returns:
+            (workflow, transition key, idx) where workflow is None if the state isnt in the graph
         """
-        log_message("info", " ----- entered next_state() ----- ")
-        log_message("info", f"WF_init next_state: self.name = {self.name} for dataset {dataset.dataset_id}")
-        log_message("debug", f"WF_init next_state: current state = {state}")
-        # import ipdb; ipdb.set_trace()
-        self.print_debug(f"next_state: current = *{state}*")
         state_attrs = state.split(':')
         if len(state_attrs) < 3:
             test_state = state
         else:
-            test_state = f"{state_attrs[-3]}:{state_attrs[-2]}"       # OMG this is brittle.
-
-        # test_state = test_state.upper()
-        state_attrs_curr = state_attrs[idx].upper()
-
-        prefix = self.get_status_prefix()
-        log_message("info", f"WF_init next_state: status_prefix = {prefix}")
-        log_message("info", f"WF_init next_state: state_attrs = {state_attrs}")
-        log_message("info", f"WF_init next_state: curr test_state = {test_state}")
-        log_message("debug", f"WF_init next_state: self.transitions.keys = {self.transitions.keys()}")
-        log_message("debug", f"WF_init next_state: self.children.keys = {self.children.keys()}")
-
-        if test_state in self.transitions.keys():
-            log_message("info", f"WF_init next_state: test_state {test_state} FOUND in self.transition.keys: leads to {self.transitions[test_state]}")
-            if dataset.grid == "native":
-                target_data_type = f'{dataset.realm}-native-{dataset.freq}'
-            else:
-                target_data_type = f'{dataset.realm}-{dataset.data_type.replace("-", "")}-{dataset.freq}'
-
-            log_message("info", f"WF_init next_state: target_data_type = {target_data_type}")
-            self.print_debug(f"target_data_type: {target_data_type}")
-            transitions = self.transitions[test_state].get(target_data_type)
-            log_message("info", f"WF_init next_state: transitions = {transitions}")
-            if transitions is None:
-                try:
-                    return [(f'{prefix}{x}:', self, params) for x in self.transitions[test_state]['default']]
-                except KeyError as e:
-                    log_message('error', f"Dataset {dataset.dataset_id} tried to go to the 'default' transition from the {test_state}, but no default was found")
-                    sys.exit(1)
+            test_state = f"{state_attrs[-3]}:{state_attrs[-2]}"
+
+        workflow = self
+        while test_state not in workflow.transitions:
+            if idx >= len(state_attrs):
+                return None, test_state, idx
+            state_attrs_curr = state_attrs[idx].upper()
+            if state_attrs_curr == "WAREHOUSE":
+                # jump over "WAREHOUSE" state component, try again
+                idx += 1
+            elif state_attrs_curr in workflow.children:
+                workflow = workflow.children[state_attrs_curr]
+                idx += 1
             else:
-                ret_list = [(f'{prefix}{x}:', self, params) for x in transitions]
-                log_message("info", f"WF_init next_state: for {dataset.dataset_id} returning {ret_list}")
-                return ret_list
+                return None, test_state, idx
+        return workflow, test_state, idx
 
-        elif state_attrs_curr == "WAREHOUSE":
-            return self.next_state(dataset, state, params, idx + 1)     # jump over "WAREHOUSE" state component, try again
+    def compile_state(self, state):
+        """
+        Resolve a state into its entry in the transition table
 
-        # import ipdb; ipdb.set_trace()
-        elif state_attrs_curr in self.children.keys():
-            log_message("info", f"WF_init next_state: state_attrs_curr {state_attrs_curr} FOUND in self.children.keys: leads to {self.children[state_attrs_curr]}")
-            return self.children[state_attrs_curr].next_state(dataset, state, params, idx + 1)  # recurse
+        Returns:
+            a dict of data type -> [(next state, workflow)], or None if the state isnt in the graph
+        """
+        workflow, test_state, _ = self.resolve_state(state)
+        if workflow is None:
+            return None
+        prefix = workflow.get_status_prefix()
+        return {
+            data_type: [(f'{prefix}{x}:', workflow) for x in targets]
+            for data_type, targets in (workflow.transitions[test_state] or {}).items()
+            if targets is not None
+        }
+
+    def compile_transitions(self):
+        """
+        Flatten the nested transitions of the whole workflow tree into a single table
+        keyed by the full state string, and then the data type. Every state the
+        workflows can emit is compiled up front, anything else is compiled the first time its seen
+        """
+        states = set()
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children.values())
+            prefix = node.get_status_prefix()
+            for key, transitions in node.transitions.items():
+                states.add(f'{prefix}{key}:')
+                for targets in (transitions or {}).values():
+                    states.update(f'{prefix}{x}:' for x in targets or [])
+
+        self.transition_table = {}
+        for state in states:
+            if (entry := self.compile_state(state)) is not None:
+                self.transition_table[state] = entry
+        log_message("info", f"WF_init: {self.name} compiled {len(self.transition_table)} states into the transition table")
+
+    def next_state(self, dataset, state, params):
+        """
+        Parameters:
+            dataset (Dataset) : The dataset which is changing state
+            state (string) : The state to move out from
+            params (dict) : The parameters passed along to the next state
+        Returns a list of (next state, workflow, params) to transition to given the current state of the dataset
+        """
+        # the table is keyed by the state without its trailing params, like slurm_id=...,
+        # so that each parameterized status doesnt add its own entry to the table
+        key = state.rsplit(':', 1)[0] + ':'
+        if (entry := self.transition_table.get(key)) is None:
+            if (entry := self.compile_state(key)) is None:
+                _, test_state, idx = self.resolve_state(key)
+                state_attrs = key.split(':')
+                state_attrs_curr = state_attrs[idx].upper() if idx < len(state_attrs) else None
+                log_message("error", f"WF_init next_state: target state {test_state} is not present in the transition graph for {self.name}")
+                log_message("error", f"WF_init next_state: (info) idx={idx}, state_attrs_curr = {state_attrs_curr}")
+                log_message("error", f"WF_init next_state: (info) child_keys: {self.children.keys()}")
+                sys.exit(1)
+            self.transition_table[key] = entry
 
-        else:
-            log_message("error", f"WF_init next_state: target state {test_state} is not present in the transition graph for {self.name}")
-            log_message("error", f"WF_init next_state: (info) idx={idx}, state_attrs_curr = {state_attrs_curr}")
-            log_message("error", f"WF_init next_state: (info) child_keys: {self.children.keys()}")
+        target_data_type = self.get_data_type(dataset)
+        if (transitions := entry.get(target_data_type)) is None:
+            if (transitions := entry.get('default')) is None:
+                log_message('error', f"Dataset {dataset.dataset_id} tried to go to the 'default' transition from the {state}, but no default was found")
+                sys.exit(1)
 
-            # import ipdb; ipdb.set_trace()
-            sys.exit(1)
+        ret_list = [(next_state, workflow, params) for next_state, workflow in transitions]
+        self.print_debug(f"next_state: {dataset.dataset_id} at {state} with data type {target_data_type} moves to {[x[0] for x in ret_list]}")
+        return ret_list
 
     def get_job(self, dataset, state, params, scripts_path, slurm_out_path, workflow, job_workers=8, **kwargs):
         state_attrs = state.split(':')
@@ -179,10 +273,16 @@ class Workflow(object):
     def load_transitions(self):
         transition_path = Path(Path(inspect.getfile(
             self.__class__)).parents[0], 'transitions.yaml')
-        with open(transition_path, 'r') as instream:
-            self.transitions = yaml.load(instream, Loader=yaml.SafeLoader)
-            log_message("info", f"WF_init: {self.name} loads transitions")
-            log_message("debug", f"WF_init: {self.name} loads transitions {self.transitions}")
+        if (transitions := _transitions_cache.get(transition_path)) is None:
+            with open(transition_path, 'r') as instream:
+                transitions = yaml.load(instream, Loader=yaml.SafeLoader)
+            _transitions_cache[transition_path] = transitions
+        self.transitions = transitions
+        log_message("info", f"WF_init: {self.name} loads transitions")
+        log_message("debug", f"WF_init: {self.name} loads transitions {self.transitions}")
+        # the root of the tree loads its transitions after all its children
+        if self.parent is None:
+            self.compile_transitions()
 
     def load_children(self):
         my_path = Path(inspect.getfile(self.__class__)).parent.absolute()
@@ -10,5 +10,5 @@ class CheckFileIntegrity(WorkflowJob):
         self.name = NAME
         self._cmd = f"""
 cd {self.scripts_path}
-python check_file_integrity.py -p {self._job_workers} {self.dataset.latest_warehouse_dir}
+python check_file_integrity.py -p {self._job_workers} --dataset-id {self.dataset.dataset_id} {self.dataset.latest_warehouse_dir}
 """
@@ -40,6 +40,22 @@ class WorkflowJob(object):
         return f"{self.parent}:{self.name}:{self.dataset.dataset_id}"
 
     def __call__(self, slurm):
+        script_path = self.prepare(slurm)
+        if script_path is None:
+            return None
+        self.submitted(slurm.sbatch(str(script_path)))
+        return self._job_id
+
+    def prepare(self, slurm):
+        """
+        Resolve the jobs command, lock the working directory and render the run script,
+        without submitting it
+
+        Parameters:
+            slurm (Slurm): the slurm interface used to render the script
+        Returns:
+            The Path to the rendered run script, or None if the job cant be started
+        """
         if not self.meets_requirements():
             log_message("error", f"Job does not meet requirements! {self.requires}")
             return None
@@ -57,7 +73,7 @@ class WorkflowJob(object):
 
         self._outname = self.get_slurm_output_script_name()
         output_option = (
-            '-o', f'{Path(self._slurm_out, self._outname).resolve()}')
+            '-o', f'{self.output_path}')
 
         self._slurm_opts.extend(
             [output_option, ('-N', 1), ('-c', self._job_workers)])
@@ -73,12 +89,20 @@ class WorkflowJob(object):
         self.add_cmd_suffix()
         log_message("info", f"WF_jobs_init:render_script: self,cmd={self.cmd}, script_path={str(script_path)}")
         slurm.render_script(self.cmd, str(script_path), self._slurm_opts)
-        self._job_id = slurm.sbatch(str(script_path))
+        return script_path
+
+    def submitted(self, job_id):
+        """
+        Record the slurm id the job was submitted under, and mark the dataset as engaged
+
+        Parameters:
+            job_id (int|str): the slurm job id, or "ARRAYID_TASKID" for a job array task
+        """
+        self._job_id = job_id
         log_message("info", f"WF_jobs_init: _call_: setting status to {self._parent}:{self.name}:Engaged: for {self.dataset.dataset_id}")
         self.dataset.status = (f"{self._parent}:{self.name}:Engaged:", 
                                {"slurm_id": self.job_id})
-        return self._job_id
-    
+
     def get_slurm_output_script_name(self):
         return f'{self.dataset.dataset_id}-{self.name}.out'
 
@@ -216,6 +240,14 @@ rm $message_file
     def render_cleanup(self):
         return ""
 
+    @property
+    def output_path(self):
+        return Path(self._slurm_out, self.get_slurm_output_script_name()).resolve()
+
+    @property
+    def slurm_opts(self):
+        return self._slurm_opts
+
     @property
     def cmd(self):
         return self._cmd